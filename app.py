@@ -1,24 +1,57 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+import time
+
+app_import_started = time.perf_counter()  # import_seconds on /api/ready is measured from here
+
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
 from flask_cors import CORS  # Added for React frontend
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from werkzeug.formparser import parse_form_data
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import tempfile
 import pickle
-from azure.storage.blob import BlobServiceClient
+from azure.core import MatchConditions
+from azure.core.pipeline.transport import RequestsTransport
+import re
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+import atexit
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError, ResourceModifiedError
 from io import BytesIO
+from collections import OrderedDict, Counter, deque
 import json
 from datetime import datetime
 import uuid  # Added for client sessions
+import threading
+import contextvars
+import bisect
+import asyncio
+import sqlite3
+import glob
+import itertools
+import multiprocessing
+import hashlib
+import importlib
+import math
+import random
+import numpy as np
+import faiss
+import mmap
+import shutil
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+# In its own module, so the PDF extraction processes import it without running this module's setup
+from pdf_extract import get_pdf_page_count, extract_page_range
 
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import google.generativeai as genai
-from langchain_community.vectorstores import FAISS
-from langchain_groq import ChatGroq
-from langchain.chains.question_answering import load_qa_chain
-from langchain.prompts import PromptTemplate
+# Only the base classes subclassed below are imported up front; the clients, the LangChain FAISS wrapper,
+# the text splitter and the QA chain are imported by the functions that build them (see README "Worker startup")
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_community.docstore.base import Docstore
 
 from dotenv import load_dotenv
 
@@ -28,326 +61,2928 @@ app = Flask(__name__)
 # Enable CORS for all routes
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-app.secret_key = os.urandom(24)
+app.secret_key = os.urandom(24)
+
+AZURE_CONNECTION_STRING = os.getenv("AZURE_CONN_STRING")
+CONTAINER_NAME = os.getenv("AZURE_CONTAINER_NAME")
+VECTOR_STORE_PATH = "vector_store/faiss_index"  # legacy single-blob index, read as one segment
+VECTOR_STORE_MANIFEST_PATH = "vector_store/manifest.json"
+VECTOR_STORE_SEGMENTS_PREFIX = "vector_store/segments/"
+# Segment format, see README "Vector store format": raw FAISS index + JSON-lines docstore + uint64 offsets
+SEGMENT_FORMAT = "mmap-v1"
+SEGMENT_FILES = ("index.faiss", "docstore.jsonl", "docstore.offsets")
+KEYWORD_INDEX_FILE = "bm25.npz"  # BM25 postings, in segments whose manifest entry has "bm25": true
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", "index_cache")
+INDEX_DOCSTORE_MODE = os.getenv("INDEX_DOCSTORE_MODE", "local")  # 'local' (download + mmap) or 'remote' (range reads)
+# IO_FLAG_MMAP_IFC maps flat codes and IVF lists alike; combined with IO_FLAG_MMAP it fails on IVF indexes
+FAISS_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+PROCESSED_FILES_LIST_PATH = "vector_store/processed_files.pkl"  # legacy filename list, read-only
+# Document registry: one small blob per indexed PDF, named by the SHA-256 of its content
+DOCUMENT_REGISTRY_PREFIX = "vector_store/registry/"
+UPLOAD_FOLDER = 'uploads'
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs('chat_history', exist_ok=True)
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+# Append-only chat history (SQLite in WAL mode, shared safely by every worker process)
+CHAT_HISTORY_DB_PATH = os.getenv("CHAT_HISTORY_DB_PATH", "chat_history/chat_history.db")
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+
+# Connection pools of the shared clients (one set per worker process)
+BLOB_POOL_SIZE = int(os.getenv("BLOB_POOL_SIZE", "32"))
+GROQ_POOL_SIZE = int(os.getenv("GROQ_POOL_SIZE", "32"))
+# Files are uploaded to Azure as staged blocks, so memory per upload is about block size x concurrency
+BLOB_BLOCK_SIZE = int(os.getenv("BLOB_BLOCK_SIZE", str(4 * 1024 * 1024)))
+BLOB_UPLOAD_CONCURRENCY = int(os.getenv("BLOB_UPLOAD_CONCURRENCY", "4"))  # blocks staged in parallel per file
+UPLOAD_READ_SIZE = 1024 * 1024
+# The async client (ASGI mode, see asgi.py) holds many more in-flight questions per worker
+GROQ_ASYNC_POOL_SIZE = int(os.getenv("GROQ_ASYNC_POOL_SIZE", "256"))
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192")
+
+# Seconds between ETag checks of the shared Azure index (0 = check on every query)
+AZURE_INDEX_CHECK_INTERVAL = float(os.getenv("AZURE_INDEX_CHECK_INTERVAL", "0"))
+
+# Segmented Azure index: manifest updates and background compaction of small segments
+MANIFEST_MAX_RETRIES = int(os.getenv("MANIFEST_MAX_RETRIES", "10"))
+COMPACTION_MIN_SEGMENTS = int(os.getenv("COMPACTION_MIN_SEGMENTS", "8"))
+COMPACTION_SMALL_SEGMENT_CHUNKS = int(os.getenv("COMPACTION_SMALL_SEGMENT_CHUNKS", "5000"))
+COMPACTION_RETIRE_GRACE_SECONDS = float(os.getenv("COMPACTION_RETIRE_GRACE_SECONDS", "600"))
+
+# Index type of each Azure segment, see README "Index types": auto, flat, ivf_flat, hnsw, ivf_pq, sq_fp16 or sq8
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+ANN_MIN_CHUNKS = int(os.getenv("ANN_MIN_CHUNKS", "20000"))  # smaller segments always stay flat (exact)
+ANN_PQ_MIN_CHUNKS = int(os.getenv("ANN_PQ_MIN_CHUNKS", "1000000"))  # auto: IVF-PQ from here, IVF-Flat below
+ANN_TRAIN_SAMPLE = int(os.getenv("ANN_TRAIN_SAMPLE", "100000"))  # rows sampled to train IVF centroids / PQ codebooks
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+PQ_BITS = 8
+# Default per-query search effort; /api/query can override both
+SEARCH_NPROBE = int(os.getenv("SEARCH_NPROBE", "16"))
+SEARCH_EF_SEARCH = int(os.getenv("SEARCH_EF_SEARCH", "64"))
+
+# Retrieval: 'hybrid' fuses BM25 keyword hits with the dense results by reciprocal rank, 'dense' is vectors only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))  # chunks given to the LLM; /api/query can override up to RETRIEVAL_MAX_K
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "20"))
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))  # candidates taken from each retriever before fusion
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Context given to the "stuff" prompt: duplicates dropped, neighbouring chunks merged, packed to a token budget
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))  # estimate; Groq's tokenizer is not local
+# Optional local cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (needs sentence-transformers); empty = off
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "20"))  # candidates retrieved for the reranker to order
+
+# Metrics, see README "Metrics": stage and request timings, blob bytes and LLM tokens on /metrics
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false") == "true"  # Server-Timing header on every (non-streamed) response
+METRIC_TYPES = {
+    'rag_request_seconds': ('histogram', 'Time to respond, per route (streamed responses: time to the first byte)'),
+    'rag_stage_seconds': ('histogram', 'Time spent in one stage of ingestion or querying'),
+    'rag_blob_bytes_total': ('counter', 'Bytes downloaded from and uploaded to Azure Blob Storage'),
+    'rag_llm_tokens_total': ('counter', 'LLM tokens as reported by Groq, or estimated from characters'),
+    'rag_startup_seconds': ('gauge', 'Worker import, prewarm and time to its first answered query'),
+}
+
+# Worker startup, see README "Worker startup": with PREWARM every worker loads the LLM and embedding clients
+# and the shared Azure index in the background once imported; /api/ready answers 503 until that has finished
+PREWARM = os.getenv("PREWARM", "false") == "true"
+
+# Budget for per-session vector stores kept in memory by /api/query
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "64"))
+SESSION_CACHE_IDLE_SECONDS = float(os.getenv("SESSION_CACHE_IDLE_SECONDS", "1800"))
+SESSION_CACHE_POLICY = os.getenv("SESSION_CACHE_POLICY", "lru")  # 'lru' or 'largest'
+# How session indexes are written, see README "Compact session indexes": 'faiss' (float32 index + pickled docstore),
+# or 'fp16' / 'int8' (scalar-quantized index, chunk text read through mmap from one offset-indexed file)
+SESSION_INDEX_MODE = os.getenv("SESSION_INDEX_MODE", "faiss")
+SESSION_INDEX_TYPES = {'fp16': 'sq_fp16', 'int8': 'sq8'}
+
+# Client sessions, see README "Sessions": 'sqlite' is shared by every worker process, 'memory' suits one worker only
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "sqlite")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(UPLOAD_FOLDER, "sessions.db"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "86400"))  # idle time before a session and its files are deleted
+SESSION_GC_INTERVAL = float(os.getenv("SESSION_GC_INTERVAL", "300"))  # seconds between collections in each worker
+SESSION_TOUCH_INTERVAL = 60  # a session's last-seen time is written at most this often
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(500 * 1024 * 1024)))  # PDFs + index on disk; 0 = no limit
+SESSION_MAX_FILES = int(os.getenv("SESSION_MAX_FILES", "100"))  # distinct PDFs kept per session; 0 = no limit
+# One request body can never be larger than a whole session's quota
+app.config['MAX_CONTENT_LENGTH'] = SESSION_MAX_BYTES or None
+
+# Answer cache for repeated questions, keyed by (index version, normalized question)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Cosine similarity at which a differently worded question reuses an answer (0 = exact matches only)
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0"))
+
+# /api/query-batch: questions of one request share an embedding call and a FAISS search; LLM calls are bounded per worker
+QUERY_BATCH_MAX_QUESTIONS = int(os.getenv("QUERY_BATCH_MAX_QUESTIONS", "1000"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
+
+# Background ingestion of /api/upload requests
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+INGEST_STAGES = ['extract', 'chunk', 'embed', 'save', 'azure']
+
+# Page-parallel PDF text extraction
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+# Page-range tasks extracted ahead of the chunker; finished pages wait in memory until they are chunked
+PDF_EXTRACT_PREFETCH = int(os.getenv("PDF_EXTRACT_PREFETCH", str(2 * PDF_EXTRACT_WORKERS)))
+# 'spawn' avoids forking a process that already runs request and ingest threads
+PDF_EXTRACT_START_METHOD = os.getenv("PDF_EXTRACT_START_METHOD", "spawn")
+
+# Embedding pipeline
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")  # 'google' or 'fake' (offline, deterministic)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_QPS = float(os.getenv("EMBEDDING_MAX_QPS", "5"))  # 0 = unlimited
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")  # empty = no disk cache
+EMBEDDING_FAKE_DIM = int(os.getenv("EMBEDDING_FAKE_DIM", "768"))
+EMBEDDING_FAKE_LATENCY = float(os.getenv("EMBEDDING_FAKE_LATENCY", "0"))
+# Chunks embedded and appended to the index at a time; ingestion holds about one batch of text and vectors
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", str(EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY)))
+
+# Histograms and counters by (name, labels); the request being served (if any) is traced in request_trace
+metric_values = {}
+metrics_lock = threading.Lock()
+request_trace = contextvars.ContextVar('request_trace', default=None)
+
+# Import and prewarm timings of this worker, served by /api/ready
+startup_stats = {'status': 'starting', 'import_seconds': None, 'prewarm_seconds': None, 'steps': {}, 'errors': [],
+                 'time_to_first_query_seconds': None, 'first_query_seconds': None}
+startup_lock = threading.Lock()
+startup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prewarm')
+
+# Client sessions live in the session store (get_session_store); expired ones are collected in the background
+session_gc_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-gc')
+session_gc_stats = {'last_run': 0.0, 'runs': 0, 'expired': 0, 'orphans': 0, 'bytes_freed': 0, 'errors': 0}
+session_gc_lock = threading.Lock()
+
+# Ingestion jobs by id, run on a local thread pool (no external broker)
+ingest_jobs = {}
+ingest_jobs_lock = threading.Lock()
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+
+pdf_process_pool = None
+pdf_process_pool_lock = threading.Lock()
+
+# Loaded session vector stores keyed by index directory, least recently used first
+session_store_cache = OrderedDict()
+session_store_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+session_store_cache_lock = threading.Lock()
+
+# Long-lived clients (blob container, embeddings, LLM, QA chain), built once per worker
+resources = {}
+resources_lock = threading.RLock()  # factories may build other resources
+
+# Cached answers, least recently used first, and the index version each scope was last seen at
+answer_cache = OrderedDict()
+answer_cache_versions = {}
+answer_cache_stats = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+answer_cache_lock = threading.Lock()
+
+# One SQLite connection per thread
+chat_history_local = threading.local()
+
+# Process-wide cache of the shared Azure vector store, keyed by the blob ETag
+azure_index_cache = {
+    'entry': None,  # (etag, vector_store), swapped as a single reference
+    'checked_at': 0.0,
+    'hits': 0,
+    'misses': 0,
+    'reloads': 0,
+    'checks': 0,
+    'errors': 0,
+    'last_load_seconds': None
+}
+azure_index_stats_lock = threading.Lock()
+azure_index_load_lock = threading.Lock()
+
+# Loaded Azure segments by id; segments are immutable so entries never go stale
+azure_segment_cache = {}
+
+compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compaction')
+compaction_lock = threading.Lock()  # held while this worker has a compaction queued or running
+
+# BM25 lookups run here while the request thread does the dense search
+keyword_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='bm25')
+
+# LLM calls of /api/query-batch requests, shared by every batch this worker serves
+query_batch_executor = ThreadPoolExecutor(max_workers=QUERY_BATCH_CONCURRENCY, thread_name_prefix='query-batch')
+
+# Shared Resources
+def get_resource(name, factory):
+    resource = resources.get(name)
+    if resource is None:
+        with resources_lock:
+            resource = resources.get(name)
+            if resource is None:
+                resource = factory()
+                resources[name] = resource
+    return resource
+
+def reset_resources():
+    # Drops every shared client, e.g. from a gunicorn post_fork hook when the app is preloaded
+    with resources_lock:
+        for closer in resources.pop('closers', []):
+            closer()
+        for closer in resources.pop('async_closers', []):
+            # Not closed by asgi.py's lifespan shutdown, so no running event loop ever used the client
+            try:
+                asyncio.run(closer())
+            except Exception as e:
+                print(f"Error closing async client: {str(e)}")
+        resources.clear()
+
+atexit.register(reset_resources)
+
+def register_closer(closer):
+    resources.setdefault('closers', []).append(closer)
+
+def register_async_closer(closer):
+    # closer is a coroutine function; asgi.py awaits it on its event loop at shutdown (close_async_resources)
+    resources.setdefault('async_closers', []).append(closer)
+
+async def close_async_resources():
+    with resources_lock:
+        closers = resources.pop('async_closers', [])
+    for closer in closers:
+        await closer()
+
+# Metrics
+def observe_histogram(name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        entry = metric_values.get(key)
+        if entry is None:
+            entry = metric_values[key] = {'buckets': [0] * (len(METRICS_BUCKETS) + 1), 'count': 0, 'sum': 0.0}
+        entry['buckets'][bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+        entry['count'] += 1
+        entry['sum'] += value
+
+def increment_counter(name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_values[key] = metric_values.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_values[key] = value
+
+def format_metric_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+def render_metrics():
+    # Prometheus text exposition format; every worker process reports its own values
+    with metrics_lock:
+        snapshot = {key: dict(value, buckets=list(value['buckets'])) if isinstance(value, dict) else value
+                    for key, value in metric_values.items()}
+    
+    lines = []
+    for name, (kind, help_text) in METRIC_TYPES.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, labels), value in sorted(snapshot.items()):
+            if metric != name:
+                continue
+            if kind in ('counter', 'gauge'):
+                lines.append(f"{name}{format_metric_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS, value['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_metric_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_bucket{format_metric_labels(labels, le='+Inf')} {value['count']}")
+            lines.append(f"{name}_sum{format_metric_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{format_metric_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def start_request_trace():
+    trace = {'started': time.perf_counter(), 'stages': {}, 'blob_bytes': {}, 'llm_tokens': {}}
+    request_trace.set(trace)
+    return trace
+
+@contextmanager
+def timed_stage(stage):
+    # Also usable as a function decorator; nested stages are each recorded with their full duration
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe_histogram('rag_stage_seconds', seconds, stage=stage)
+        trace = request_trace.get()
+        if trace is not None:
+            entry = trace['stages'].setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+def record_blob_bytes(direction, count):
+    increment_counter('rag_blob_bytes_total', count, direction=direction)
+    trace = request_trace.get()
+    if trace is not None:
+        trace['blob_bytes'][direction] = trace['blob_bytes'].get(direction, 0) + count
+
+def record_llm_tokens(prompt_tokens, completion_tokens):
+    increment_counter('rag_llm_tokens_total', prompt_tokens, kind='prompt')
+    increment_counter('rag_llm_tokens_total', completion_tokens, kind='completion')
+    trace = request_trace.get()
+    if trace is not None:
+        for kind, count in (('prompt', prompt_tokens), ('completion', completion_tokens)):
+            trace['llm_tokens'][kind] = trace['llm_tokens'].get(kind, 0) + count
+
+class LLMUsageCallback(BaseCallbackHandler):
+    # Token counts of one LLM call as Groq reports them, or estimated from characters when a model reports none
+    run_inline = True
+    
+    def __init__(self):
+        self.prompt_text = ""
+    
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_text = "\n".join(str(message.content) for batch in messages for message in batch)
+    
+    def on_llm_end(self, response, **kwargs):
+        generation = response.generations[0][0]
+        usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+        if usage:
+            record_llm_tokens(usage.get('input_tokens', 0), usage.get('output_tokens', 0))
+        else:
+            record_llm_tokens(estimate_tokens(self.prompt_text), estimate_tokens(generation.text))
+
+def get_trace_breakdown(trace):
+    # The per-request debug view: milliseconds and calls per stage, blob bytes and LLM tokens
+    return {
+        'total_ms': round((time.perf_counter() - trace['started']) * 1000, 1),
+        'stages': {stage: {'ms': round(seconds * 1000, 1), 'calls': calls} for stage, (seconds, calls) in trace['stages'].items()},
+        'blob_bytes': dict(trace['blob_bytes']),
+        'llm_tokens': dict(trace['llm_tokens'])
+    }
+
+def format_server_timing(trace):
+    timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, (seconds, _) in trace['stages'].items()]
+    timings.append(f"total;dur={(time.perf_counter() - trace['started']) * 1000:.1f}")
+    return ", ".join(timings)
+
+# Azure Blob Storage Functions
+def build_container_client():
+    from azure.storage.blob import BlobServiceClient
+    
+    # One pooled HTTP session for every blob call this worker makes
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=BLOB_POOL_SIZE, pool_maxsize=BLOB_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    register_closer(session.close)
+    
+    transport = RequestsTransport(session=session, session_owner=False)
+    # Anything larger than one block is staged block by block instead of read whole for a single PUT
+    blob_service_client = BlobServiceClient.from_connection_string(
+        AZURE_CONNECTION_STRING, transport=transport,
+        max_block_size=BLOB_BLOCK_SIZE, max_single_put_size=BLOB_BLOCK_SIZE
+    )
+    return blob_service_client.get_container_client(CONTAINER_NAME)
+
+def get_blob_client():
+    try:
+        return get_resource('container_client', build_container_client)
+    except Exception as e:
+        print(f"Error connecting to Azure Blob Storage: {str(e)}")
+        return None
+
+def blob_exists(container_client, blob_path):
+    try:
+        blob_client = container_client.get_blob_client(blob_path)
+        return blob_client.exists()
+    except Exception:
+        return False
+
+def get_blob_etag(container_client, blob_path):
+    try:
+        blob_client = container_client.get_blob_client(blob_path)
+        return blob_client.get_blob_properties().etag
+    except ResourceNotFoundError:
+        return None
+
+def save_to_blob(container_client, blob_path, data):
+    # Returns the upload properties (truthy, includes the new 'etag') on success
+    try:
+        blob_client = container_client.get_blob_client(blob_path)
+        with timed_stage('blob_upload'):
+            result = blob_client.upload_blob(data, overwrite=True)
+        record_blob_bytes('upload', len(data))
+        return result
+    except Exception as e:
+        print(f"Error saving to Azure Blob Storage: {str(e)}")
+        return False
+
+def upload_file_to_blob(container_client, blob_path, file_path, overwrite=True):
+    # Streams the file from disk; blocks are staged BLOB_UPLOAD_CONCURRENCY at a time, then committed
+    blob_client = container_client.get_blob_client(blob_path)
+    size = os.path.getsize(file_path)
+    with timed_stage('blob_upload'), open(file_path, "rb") as f:
+        result = blob_client.upload_blob(f, length=size, overwrite=overwrite, max_concurrency=BLOB_UPLOAD_CONCURRENCY)
+    record_blob_bytes('upload', size)
+    return result
+
+def download_from_blob(container_client, blob_path):
+    try:
+        # A missing blob is a 404 on the download itself, no separate exists() round-trip
+        blob_client = container_client.get_blob_client(blob_path)
+        with timed_stage('blob_download'):
+            data = blob_client.download_blob().readall()
+        record_blob_bytes('download', len(data))
+        return data
+    except ResourceNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error downloading from Azure Blob Storage: {str(e)}")
+        return None
+
+def get_legacy_processed_files(container_client):
+    processed_files = []
+    data = download_from_blob(container_client, PROCESSED_FILES_LIST_PATH)
+    if data:
+        processed_files = pickle.loads(data)
+    return processed_files
+
+def get_processed_files(container_client):
+    # Filenames of every indexed document: registry entries plus files listed before the registry existed
+    processed_files = [
+        blob.metadata.get('filename') for blob in
+        container_client.list_blobs(name_starts_with=DOCUMENT_REGISTRY_PREFIX, include=['metadata'])
+    ]
+    known = set(processed_files)
+    processed_files.extend(filename for filename in get_legacy_processed_files(container_client) if filename not in known)
+    return processed_files
+
+# Document Registry
+def hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# Uploads
+class HashingUploadFile:
+    # Target of one multipart file part: written straight to disk and hashed as the blocks arrive
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+    
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def receive_uploads():
+    # Parses the current multipart request without buffering files in memory or in werkzeug's spool;
+    # each file part lands in a fresh directory under uploads/incoming/ until store_session_upload moves it
+    incoming_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'incoming', uuid.uuid4().hex)
+    os.makedirs(incoming_dir)
+    
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        return HashingUploadFile(os.path.join(incoming_dir, uuid.uuid4().hex))
+    
+    try:
+        _, form, files = parse_form_data(
+            request.environ, stream_factory=stream_factory,
+            max_form_memory_size=request.max_form_memory_size, max_content_length=request.max_content_length
+        )
+    except Exception:
+        shutil.rmtree(incoming_dir, ignore_errors=True)
+        raise
+    return form, files, incoming_dir
+
+def store_session_upload(session_id, file):
+    # Renames (no copy) a received PDF to uploads/<session_id>/pdfs/<sha256>.pdf, so sessions never
+    # overwrite each other's files and the ingest job does not read it again to hash it
+    upload = file.stream
+    upload.close()
+    content_hash = upload.sha256.hexdigest()
+    pdf_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id, 'pdfs')
+    os.makedirs(pdf_dir, exist_ok=True)
+    path = os.path.join(pdf_dir, f"{content_hash}.pdf")
+    os.replace(upload.path, path)
+    return {'filename': secure_filename(file.filename), 'path': path, 'sha256': content_hash, 'bytes': upload.size}
+
+def get_registered_document(container_client, content_hash):
+    data = download_from_blob(container_client, f"{DOCUMENT_REGISTRY_PREFIX}{content_hash}.json")
+    return json.loads(data) if data else None
+
+def register_document(container_client, entry):
+    # Create-only, so two workers indexing the same content cannot both register it
+    blob_client = container_client.get_blob_client(f"{DOCUMENT_REGISTRY_PREFIX}{entry['sha256']}.json")
+    try:
+        blob_client.upload_blob(json.dumps(entry).encode("utf-8"), overwrite=False,
+                                metadata={'filename': entry['filename']})
+        return True
+    except ResourceExistsError:
+        return False
+
+# Embeddings
+class FakeEmbeddings(Embeddings):
+    # Deterministic hash-seeded vectors with a simulated per-call latency, for offline runs
+    def __init__(self, size=EMBEDDING_FAKE_DIM, latency=EMBEDDING_FAKE_LATENCY):
+        self.size = size
+        self.latency = latency
+    
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+    
+    def embed_documents(self, texts, task_type=None):
+        # Queries and documents get the same vector, whatever the task type
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+    
+    async def aembed_documents(self, texts):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+    
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+class CachedBatchEmbeddings(Embeddings):
+    # Batches, rate-limits, retries and disk-caches calls to the underlying embeddings model
+    def __init__(self, base, model_name, cache_dir=EMBEDDING_CACHE_DIR, batch_size=EMBEDDING_BATCH_SIZE,
+                 concurrency=EMBEDDING_CONCURRENCY, max_qps=EMBEDDING_MAX_QPS, max_retries=EMBEDDING_MAX_RETRIES):
+        self.base = base
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_qps = max_qps
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='embed')
+        self.rate_lock = threading.Lock()
+        self.next_call_at = 0.0
+        self.stats_lock = threading.Lock()
+        self.stats = {'texts': 0, 'cache_hits': 0, 'api_calls': 0, 'api_texts': 0, 'retries': 0, 'failures': 0}
+    
+    def _count(self, **increments):
+        with self.stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+    
+    def _cache_path(self, text, kind):
+        # Questions and chunks are embedded with different task types, so the same text has two vectors;
+        # chunk vectors keep the key they had before questions were told apart
+        name = f"{self.model_name}\0{text}" if kind == 'document' else f"{self.model_name}\0{kind}\0{text}"
+        key = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.f32")
+    
+    def _read_cache(self, text, kind='document'):
+        if not self.cache_dir:
+            return None
+        path = self._cache_path(text, kind)
+        if not os.path.exists(path):
+            return None
+        return np.fromfile(path, dtype=np.float32).tolist()
+    
+    def _write_cache(self, text, vector, kind='document'):
+        if not self.cache_dir:
+            return
+        path = self._cache_path(text, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        np.asarray(vector, dtype=np.float32).tofile(temp_path)
+        os.replace(temp_path, path)
+    
+    def _wait_for_rate_limit(self):
+        if not self.max_qps:
+            return
+        with self.rate_lock:
+            now = time.monotonic()
+            wait = self.next_call_at - now
+            self.next_call_at = max(now, self.next_call_at) + 1.0 / self.max_qps
+        if wait > 0:
+            time.sleep(wait)
+    
+    def _embed_base(self, texts, kind):
+        # Google embeds questions with task type RETRIEVAL_QUERY and chunks with RETRIEVAL_DOCUMENT
+        if kind == 'query' and len(texts) == 1:
+            return [self.base.embed_query(texts[0])]
+        if kind == 'query':
+            # Several questions (/api/query-batch) in one call, with the task type embed_query uses
+            return self.base.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        return self.base.embed_documents(texts)
+    
+    def _embed_batch(self, texts, kind='document'):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            try:
+                vectors = self._embed_base(texts, kind)
+                self._count(api_calls=1, api_texts=len(texts))
+                return vectors
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._count(failures=1)
+                    raise
+                self._count(retries=1)
+                delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+                print(f"Embedding batch failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
+    def _embed_texts(self, texts, kind, on_progress=None):
+        vectors = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            cached = self._read_cache(text, kind)
+            if cached is not None:
+                vectors[i] = cached
+            else:
+                # Identical chunks within one call are embedded once
+                missing.setdefault(text, []).append(i)
+        self._count(texts=len(texts), cache_hits=len(texts) - sum(len(v) for v in missing.values()))
+        
+        unique_texts = list(missing)
+        batches = [unique_texts[i:i + self.batch_size] for i in range(0, len(unique_texts), self.batch_size)]
+        done = len(texts) - sum(len(v) for v in missing.values())
+        if on_progress:
+            on_progress(done, len(texts))
+        
+        for batch, batch_vectors in zip(batches, self.executor.map(self._embed_batch, batches, itertools.repeat(kind))):
+            for text, vector in zip(batch, batch_vectors):
+                self._write_cache(text, vector, kind)
+                for i in missing[text]:
+                    vectors[i] = vector
+                done += len(missing[text])
+            if on_progress:
+                on_progress(done, len(texts))
+        return vectors
+    
+    def embed_documents(self, texts, on_progress=None):
+        return self._embed_texts(texts, 'document', on_progress)
+    
+    def embed_query(self, text):
+        with timed_stage('embed_query'):
+            return self._embed_texts([text], 'query')[0]
+    
+    def embed_queries(self, texts):
+        # Same vectors as embed_query, batched like embed_documents
+        with timed_stage('embed_query'):
+            return self._embed_texts(texts, 'query')
+    
+    async def _await_rate_limit(self):
+        if not self.max_qps:
+            return
+        with self.rate_lock:
+            now = time.monotonic()
+            wait = self.next_call_at - now
+            self.next_call_at = max(now, self.next_call_at) + 1.0 / self.max_qps
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    async def aembed_query(self, text):
+        # Async path for the ASGI server: no thread is held while waiting on the embeddings API
+        with timed_stage('embed_query'):
+            self._count(texts=1)
+            cached = self._read_cache(text, 'query')
+            if cached is not None:
+                self._count(cache_hits=1)
+                return cached
+            
+            for attempt in range(self.max_retries + 1):
+                await self._await_rate_limit()
+                try:
+                    vector = await self.base.aembed_query(text)
+                    self._count(api_calls=1, api_texts=1)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self._count(failures=1)
+                        raise
+                    self._count(retries=1)
+                    delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+                    print(f"Embedding query failed ({str(e)}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            self._write_cache(text, vector, 'query')
+            return vector
+    
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats, model=self.model_name, batch_size=self.batch_size,
+                        concurrency=self.concurrency, max_qps=self.max_qps)
+
+def build_embeddings():
+    if EMBEDDING_BACKEND == 'fake':
+        base, model_name = FakeEmbeddings(), f"fake-{EMBEDDING_FAKE_DIM}"
+    else:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        import google.generativeai as genai
+        
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        base, model_name = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL
+    embeddings = CachedBatchEmbeddings(base, model_name)
+    register_closer(embeddings.executor.shutdown)
+    return embeddings
+
+def get_embeddings():
+    return get_resource('embeddings', build_embeddings)
+
+# PDF Processing Functions
+def get_pdf_process_pool():
+    global pdf_process_pool
+    if pdf_process_pool is None:
+        with pdf_process_pool_lock:
+            if pdf_process_pool is None:
+                pdf_process_pool = ProcessPoolExecutor(
+                    max_workers=PDF_EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context(PDF_EXTRACT_START_METHOD)
+                )
+    return pdf_process_pool
+
+def iter_pdf_pages(pdf_paths):
+    # Yields (pdf_path, page_number, text) in document order, page numbers starting at 1
+    tasks = []
+    for pdf_path in pdf_paths:
+        page_count = get_pdf_page_count(pdf_path)
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            tasks.append((pdf_path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+    
+    total_pages = sum(end - start for _, start, end in tasks)
+    if PDF_EXTRACT_WORKERS <= 1 or total_pages < PDF_PARALLEL_MIN_PAGES:
+        for pdf_path, start, end in tasks:
+            for page_number, text in extract_page_range(pdf_path, start, end):
+                yield pdf_path, page_number, text
+        return
+    
+    # At most PDF_EXTRACT_PREFETCH tasks are submitted ahead, so a slow consumer bounds the pages held in memory
+    pool = get_pdf_process_pool()
+    pending = iter(tasks)
+    futures = deque()
+    
+    def submit_next(count):
+        for pdf_path, start, end in itertools.islice(pending, count):
+            futures.append((pdf_path, pool.submit(extract_page_range, pdf_path, start, end)))
+    
+    try:
+        submit_next(max(1, PDF_EXTRACT_PREFETCH))
+        while futures:
+            pdf_path, future = futures.popleft()
+            submit_next(1)
+            for page_number, text in future.result():
+                yield pdf_path, page_number, text
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+@timed_stage('pdf_extract')
+def get_pdf_text(pdf_path):
+    return "".join(text for _, _, text in iter_pdf_pages([pdf_path]))
+
+def get_text_splitter(add_start_index=False):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=add_start_index)
+
+@timed_stage('chunk')
+def get_text_chunks(text):
+    text_splitter = get_text_splitter()
+    chunks = text_splitter.split_text(text)
+    return chunks
+
+@timed_stage('embed_documents')
+def get_vector_store(text_chunks, on_progress=None, metadatas=None, ids=None):
+    from langchain_community.vectorstores import FAISS
+    
+    embeddings = get_embeddings()
+    vectors = embeddings.embed_documents(text_chunks, on_progress=on_progress)
+    vector_store = FAISS.from_embeddings(zip(text_chunks, vectors), embedding=embeddings, metadatas=metadatas, ids=ids)
+    return vector_store
+
+# Ingestion Pipeline
+def new_ingest_document(filename, path):
+    return {'filename': filename, 'path': path, 'pages': 0, 'chunks': 0}
+
+def iter_document_chunks(documents, on_page=None):
+    # documents: {content hash: new_ingest_document(...)}. Pages are split one at a time, so chunks never
+    # straddle two pages or two files; each carries source, sha256, page, start_index (within the page) and chunk.
+    path_hashes = {document['path']: content_hash for content_hash, document in documents.items()}
+    text_splitter = get_text_splitter(add_start_index=True)
+    for path, page_number, text in iter_pdf_pages(list(path_hashes)):
+        content_hash = path_hashes[path]
+        document = documents[content_hash]
+        document['pages'] += 1
+        with timed_stage('chunk'):
+            docs = text_splitter.create_documents(
+                [text], metadatas=[{'source': document['filename'], 'sha256': content_hash, 'page': page_number}]
+            )
+        for doc in docs:
+            # Numbered per file, so get_chunk_position can merge neighbours on the same page
+            doc.metadata['chunk'] = document['chunks']
+            doc.id = f"{content_hash[:16]}-{document['chunks']}"
+            document['chunks'] += 1
+            yield doc
+        if on_page:
+            on_page()
+
+def iter_batches(items, size):
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+def append_to_vector_store(vector_store, docs, vectors):
+    # Returns the store, created on the first batch
+    from langchain_community.vectorstores import FAISS
+    
+    texts = [doc.page_content for doc in docs]
+    metadatas = [doc.metadata for doc in docs]
+    ids = [doc.id for doc in docs]
+    if vector_store is None:
+        return FAISS.from_embeddings(zip(texts, vectors), embedding=get_embeddings(), metadatas=metadatas, ids=ids)
+    vector_store.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+    return vector_store
+
+def index_document_chunks(chunks, batch_size=INGEST_BATCH_SIZE, on_batch=None):
+    # Embeds and appends one batch at a time, so neither the corpus text nor its vectors are ever held whole.
+    # on_batch(docs, vectors) sees every batch; returns the FAISS store, or None if there were no chunks.
+    embeddings = get_embeddings()
+    vector_store = None
+    for docs in iter_batches(chunks, batch_size):
+        with timed_stage('embed_documents'):
+            vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+        vector_store = append_to_vector_store(vector_store, docs, vectors)
+        if on_batch:
+            on_batch(docs, vectors)
+    return vector_store
+
+# Keyword Index
+BM25_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+def tokenize(text):
+    # Drug names and codes stay whole ("co-amoxiclav", "e11.9") and are also indexed by their parts
+    tokens = []
+    for match in BM25_TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[.\-/]", token) if part)
+    return tokens
+
+class BM25Index:
+    # Inverted index over one store's chunks (row i = FAISS position i), with CSR postings
+    def __init__(self, terms, indptr, doc_ids, term_freqs, doc_lengths):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.total_length = int(doc_lengths.sum())
+    
+    @classmethod
+    def build(cls, texts):
+        counts = [Counter(tokenize(text)) for text in texts]
+        terms = sorted(set().union(*counts))
+        term_ids = {term: i for i, term in enumerate(terms)}
+        postings = [[] for _ in terms]
+        for doc_id, doc_counts in enumerate(counts):
+            for term, frequency in doc_counts.items():
+                postings[term_ids[term]].append((doc_id, frequency))
+        
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        return cls(
+            terms=np.array(terms, dtype=str),
+            indptr=indptr,
+            doc_ids=np.array([doc_id for p in postings for doc_id, _ in p], dtype=np.uint32),
+            term_freqs=np.array([min(f, 65535) for p in postings for _, f in p], dtype=np.uint16),
+            doc_lengths=np.array([sum(c.values()) for c in counts], dtype=np.uint32)
+        )
+    
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in data.files})
+    
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, terms=self.terms, indptr=self.indptr, doc_ids=self.doc_ids,
+                     term_freqs=self.term_freqs, doc_lengths=self.doc_lengths)
+    
+    def __len__(self):
+        return len(self.doc_lengths)
+    
+    def _term_id(self, term):
+        i = int(np.searchsorted(self.terms, term))
+        return i if i < len(self.terms) and self.terms[i] == term else None
+    
+    def document_frequencies(self, terms):
+        frequencies = {}
+        for term in terms:
+            i = self._term_id(term)
+            frequencies[term] = 0 if i is None else int(self.indptr[i + 1] - self.indptr[i])
+        return frequencies
+    
+    def top(self, idf, average_length, k):
+        # idf and average_length come from the whole corpus so scores are comparable across segments
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, weight in idf.items():
+            i = self._term_id(term)
+            if i is None:
+                continue
+            docs = self.doc_ids[self.indptr[i]:self.indptr[i + 1]]
+            frequency = self.term_freqs[self.indptr[i]:self.indptr[i + 1]].astype(np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / average_length)
+            scores[docs] += weight * frequency * (BM25_K1 + 1) / (frequency + norm)
+        
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        return [(int(position), float(scores[position])) for position in candidates]
+
+def load_bm25_index(directory):
+    path = os.path.join(directory, KEYWORD_INDEX_FILE)
+    return BM25Index.load(path) if os.path.exists(path) else None
+
+def reciprocal_rank_fusion(rankings):
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+class PositionalIds(Mapping):
+    # index_to_docstore_id for segment stores: FAISS position i is docstore row i
+    def __init__(self, size):
+        self.size = size
+    
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise KeyError(position)
+        return position
+    
+    def __iter__(self):
+        return iter(range(self.size))
+    
+    def __len__(self):
+        return self.size
+
+class OffsetDocstore(Docstore):
+    # Reads row i of docstore.jsonl from bytes offsets[i]:offsets[i + 1], via a local mmap or blob range reads
+    def __init__(self, offsets, read_range):
+        self.offsets = offsets
+        self.read_range = read_range
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def search(self, search):
+        position = int(search)
+        if not 0 <= position < len(self):
+            return f"ID {search} not found."
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        row = json.loads(self.read_range(start, end - start))
+        return Document(id=row['id'], page_content=row['page_content'], metadata=row['metadata'])
+
+def get_store_documents(vector_store):
+    # Documents in FAISS position order, for any LangChain FAISS store
+    return [vector_store.docstore.search(vector_store.index_to_docstore_id[i]) for i in range(vector_store.index.ntotal)]
+
+def write_segment_files(directory, index, docs):
+    faiss.write_index(index, os.path.join(directory, "index.faiss"))
+    BM25Index.build([doc.page_content for doc in docs]).save(os.path.join(directory, KEYWORD_INDEX_FILE))
+    
+    offsets = [0]
+    with open(os.path.join(directory, "docstore.jsonl"), "wb") as f:
+        for position, doc in enumerate(docs):
+            row = {'id': doc.id or str(position), 'page_content': doc.page_content, 'metadata': doc.metadata}
+            line = json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.asarray(offsets, dtype="<u8").tofile(os.path.join(directory, "docstore.offsets"))
+
+def open_segment_store(directory, embeddings, read_range=None):
+    # The index is memory-mapped rather than read; the docstore is read row by row on demand
+    from langchain_community.vectorstores import FAISS
+    
+    index = faiss.read_index(os.path.join(directory, "index.faiss"), FAISS_MMAP_FLAGS)
+    offsets = np.fromfile(os.path.join(directory, "docstore.offsets"), dtype="<u8")
+    
+    if read_range is None:
+        with open(os.path.join(directory, "docstore.jsonl"), "rb") as f:
+            docstore_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        read_range = lambda start, length: docstore_map[start:start + length]
+    
+    vector_store = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=OffsetDocstore(offsets, read_range),
+        index_to_docstore_id=PositionalIds(index.ntotal)
+    )
+    vector_store.bm25 = load_bm25_index(directory)
+    return vector_store
+
+def deserialize_vector_store(combined_data, embeddings):
+    # Legacy pickled {"index.faiss", "index.pkl"} container; only read for data not yet migrated
+    from langchain_community.vectorstores import FAISS
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dict = pickle.loads(combined_data)
+        
+        with open(os.path.join(temp_dir, "index.faiss"), "wb") as f:
+            f.write(data_dict["index.faiss"])
+        with open(os.path.join(temp_dir, "index.pkl"), "wb") as f:
+            f.write(data_dict["index.pkl"])
+        
+        return FAISS.load_local(temp_dir, embeddings, allow_dangerous_deserialization=True)
+
+@timed_stage('index_merge')
+def merge_vector_stores(vector_store, container_client):
+    # Appends the new documents as their own segment and returns it (None on failure); existing segments are never rewritten
+    return append_vector_store_segment(vector_store, container_client)
+
+# Segmented Azure Index
+class SegmentedVectorStore:
+    # Searches every segment with one query embedding and keeps the overall top k by distance
+    def __init__(self, segments, embeddings):
+        self.segments = segments
+        self.embeddings = embeddings
+    
+    @property
+    def ntotal(self):
+        return sum(segment.index.ntotal for segment in self.segments)
+    
+    def get_document(self, segment_no, position):
+        segment = self.segments[segment_no]
+        return segment.docstore.search(segment.index_to_docstore_id[position])
+    
+    def search_dense_batch(self, embeddings, k, nprobe=None, ef_search=None):
+        # One FAISS search per segment for the whole query matrix; [(segment_no, position, distance)] per query
+        queries = np.asarray(embeddings, dtype=np.float32)
+        results = [[] for _ in range(len(queries))]
+        for segment_no, segment in enumerate(self.segments):
+            params = get_search_parameters(segment.index, nprobe, ef_search)
+            distances, positions = segment.index.search(queries, k, params=params)
+            for query_results, query_distances, query_positions in zip(results, distances, positions):
+                query_results.extend(
+                    (segment_no, int(position), float(distance))
+                    for distance, position in zip(query_distances, query_positions) if position >= 0
+                )
+        for query_results in results:
+            query_results.sort(key=lambda result: result[2])
+        return [query_results[:k] for query_results in results]
+    
+    def search_dense(self, embedding, k, nprobe=None, ef_search=None):
+        # [(segment_no, position, distance)], nearest first
+        return self.search_dense_batch([embedding], k, nprobe, ef_search)[0]
+    
+    def search_keywords(self, query, k):
+        # [(segment_no, position, score)], best first; BM25 statistics span every segment with a keyword index
+        terms = set(tokenize(query))
+        keyword_indexes = [(n, segment.bm25) for n, segment in enumerate(self.segments) if getattr(segment, 'bm25', None) is not None]
+        if not terms or not keyword_indexes:
+            return []
+        
+        total_docs = sum(len(bm25) for _, bm25 in keyword_indexes)
+        if not total_docs:
+            return []
+        average_length = sum(bm25.total_length for _, bm25 in keyword_indexes) / total_docs or 1.0
+        frequencies = Counter()
+        for _, bm25 in keyword_indexes:
+            frequencies.update(bm25.document_frequencies(terms))
+        idf = {term: float(np.log(1 + (total_docs - df + 0.5) / (df + 0.5))) for term, df in frequencies.items() if df}
+        if not idf:
+            return []
+        
+        results = [
+            (segment_no, position, score)
+            for segment_no, bm25 in keyword_indexes
+            for position, score in bm25.top(idf, average_length, k)
+        ]
+        results.sort(key=lambda result: -result[2])
+        return results[:k]
+    
+    def search_batch(self, queries, embeddings, k=RETRIEVAL_K, nprobe=None, ef_search=None):
+        # Documents for the LLM, per query: dense and keyword candidates fused by reciprocal rank in hybrid mode
+        if RETRIEVAL_MODE != 'hybrid':
+            return [[self.get_document(n, p) for n, p, _ in dense]
+                    for dense in self.search_dense_batch(embeddings, k, nprobe, ef_search)]
+        
+        fetch_k = max(k, HYBRID_FETCH_K)
+        keyword_futures = [keyword_search_executor.submit(self.search_keywords, query, fetch_k) for query in queries]
+        documents = []
+        for dense, keyword_future in zip(self.search_dense_batch(embeddings, fetch_k, nprobe, ef_search), keyword_futures):
+            keywords = keyword_future.result()
+            fused = reciprocal_rank_fusion([[(n, p) for n, p, _ in dense], [(n, p) for n, p, _ in keywords]])
+            documents.append([self.get_document(n, p) for n, p in fused[:k]])
+        return documents
+    
+    def search(self, query, embedding, k=RETRIEVAL_K, nprobe=None, ef_search=None):
+        return self.search_batch([query], [embedding], k, nprobe, ef_search)[0]
+    
+    def similarity_search_with_score_by_vector(self, embedding, k=4, nprobe=None, ef_search=None, **kwargs):
+        return [(self.get_document(n, p), distance) for n, p, distance in self.search_dense(embedding, k, nprobe, ef_search)]
+    
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+    
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k=k, **kwargs)
+    
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+# Approximate Nearest-Neighbour Indexes
+def get_index_type(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq_fp16' if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
+    return 'flat'
+
+def choose_index_type(ntotal):
+    if ntotal < ANN_MIN_CHUNKS:
+        return 'flat'
+    index_type = INDEX_TYPE
+    if index_type == 'auto':
+        index_type = 'ivf_pq' if ntotal >= ANN_PQ_MIN_CHUNKS else 'ivf_flat'
+    # PQ codebooks need ~39 training points per centroid
+    if index_type == 'ivf_pq' and ntotal < 39 * 2 ** PQ_BITS:
+        index_type = 'ivf_flat'
+    return index_type
+
+def get_index_factory_string(index_type, ntotal, dimension):
+    # ~4 * sqrt(n) inverted lists, but never fewer than 39 training points per list
+    nlist = max(1, min(int(4 * ntotal ** 0.5), ntotal // 39))
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'hnsw':
+        return f"HNSW{HNSW_M}"
+    if index_type == 'ivf_flat':
+        return f"IVF{nlist},Flat"
+    if index_type == 'ivf_pq':
+        # ~8 dimensions per sub-quantizer: 768-d float vectors shrink from 3072 to 96 bytes
+        subquantizers = max(m for m in range(1, max(1, dimension // 8) + 1) if dimension % m == 0)
+        return f"IVF{nlist},PQ{subquantizers}x{PQ_BITS}"
+    if index_type == 'sq_fp16':
+        # Exact search over half-precision vectors: half the bytes of flat
+        return "SQfp16"
+    if index_type == 'sq8':
+        # One byte per dimension, scaled per dimension from the training vectors: a quarter of flat
+        return "SQ8"
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def build_segment_index(vectors, index_type=None):
+    # vectors are in docstore order, so FAISS position i still maps to docstore row i
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index_type = index_type or choose_index_type(len(vectors))
+    index = faiss.index_factory(vectors.shape[1], get_index_factory_string(index_type, len(vectors), vectors.shape[1]))
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > ANN_TRAIN_SAMPLE:
+            sample = vectors[np.random.default_rng().choice(len(vectors), ANN_TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+def get_index_vectors(index):
+    # Exact for flat, IVF-Flat and HNSW; IVF-PQ and the scalar quantizers only return the quantized approximation
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def get_search_parameters(index, nprobe=None, ef_search=None):
+    # Per-call parameters; the shared index objects are never mutated by a query
+    index_type = get_index_type(index)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return faiss.SearchParametersIVF(nprobe=nprobe or SEARCH_NPROBE)
+    if index_type == 'hnsw':
+        return faiss.SearchParametersHNSW(efSearch=ef_search or SEARCH_EF_SEARCH)
+    return None
+
+def new_segment_id():
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+def read_manifest(container_client):
+    # Returns (manifest, etag); etag is None when no manifest has been written yet
+    try:
+        with timed_stage('blob_download'):
+            download = container_client.get_blob_client(VECTOR_STORE_MANIFEST_PATH).download_blob()
+            data = download.readall()
+        record_blob_bytes('download', len(data))
+        return json.loads(data), download.properties.etag
+    except ResourceNotFoundError:
+        pass
+    
+    manifest = {'version': 0, 'segments': [], 'retired': []}
+    legacy_etag = get_blob_etag(container_client, VECTOR_STORE_PATH)
+    if legacy_etag:
+        manifest['segments'].append({'id': 'legacy', 'path': VECTOR_STORE_PATH, 'chunks': None, 'bytes': None})
+    return manifest, None
+
+def write_manifest(container_client, manifest, etag):
+    # Optimistic concurrency: fails with ResourceModifiedError/ResourceExistsError if someone else won
+    manifest = dict(manifest, version=manifest['version'] + 1, updated_at=datetime.now().isoformat())
+    blob_client = container_client.get_blob_client(VECTOR_STORE_MANIFEST_PATH)
+    data = json.dumps(manifest).encode("utf-8")
+    if etag is None:
+        result = blob_client.upload_blob(data, overwrite=False)
+    else:
+        result = blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+    return manifest, result.get('etag')
+
+def update_manifest(container_client, change):
+    # change(manifest) mutates the manifest in place, or returns False to abandon the update
+    for attempt in range(MANIFEST_MAX_RETRIES):
+        manifest, etag = read_manifest(container_client)
+        if change(manifest) is False:
+            return None, None
+        try:
+            return write_manifest(container_client, manifest, etag)
+        except (ResourceModifiedError, ResourceExistsError):
+            time.sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+    raise RuntimeError("Could not update the vector store manifest: too many concurrent writers")
+
+def get_segment_files(segment):
+    return SEGMENT_FILES + (KEYWORD_INDEX_FILE,) if segment.get('bm25') else SEGMENT_FILES
+
+def segment_blob_paths(segment):
+    if segment.get('format') != SEGMENT_FORMAT:
+        return [segment['path']]
+    return [f"{segment['path']}/{name}" for name in get_segment_files(segment)]
+
+def upload_segment(container_client, index, docs):
+    segment_id = new_segment_id()
+    path = f"{VECTOR_STORE_SEGMENTS_PREFIX}{segment_id}"
+    local_dir = os.path.join(INDEX_CACHE_DIR, segment_id)
+    os.makedirs(local_dir, exist_ok=True)
+    write_segment_files(local_dir, index, docs)
+    
+    total_bytes = 0
+    for name in SEGMENT_FILES + (KEYWORD_INDEX_FILE,):
+        file_path = os.path.join(local_dir, name)
+        total_bytes += os.path.getsize(file_path)
+        upload_file_to_blob(container_client, f"{path}/{name}", file_path, overwrite=False)
+    
+    with azure_index_load_lock:
+        azure_segment_cache[segment_id] = open_segment_store(local_dir, get_embeddings())
+    return {
+        'id': segment_id,
+        'path': path,
+        'format': SEGMENT_FORMAT,
+        'index_type': get_index_type(index),
+        'bm25': True,
+        'chunks': index.ntotal,
+        'bytes': total_bytes,
+        'created_at': datetime.now().isoformat()
+    }
+
+@timed_stage('segment_load')
+def load_segment(container_client, segment):
+    if segment.get('format') != SEGMENT_FORMAT:
+        return deserialize_vector_store(download_from_blob(container_client, segment['path']), get_embeddings())
+    
+    local_dir = os.path.join(INDEX_CACHE_DIR, segment['id'])
+    os.makedirs(local_dir, exist_ok=True)
+    names = [name for name in get_segment_files(segment) if INDEX_DOCSTORE_MODE == 'local' or name != "docstore.jsonl"]
+    for name in names:
+        file_path = os.path.join(local_dir, name)
+        if os.path.exists(file_path):
+            continue
+        # Stream straight to disk; the blob is never held in memory as a whole
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        with timed_stage('blob_download'), open(temp_path, "wb") as f:
+            record_blob_bytes('download', container_client.get_blob_client(f"{segment['path']}/{name}").download_blob().readinto(f))
+        os.replace(temp_path, file_path)
+    
+    read_range = None
+    if INDEX_DOCSTORE_MODE != 'local':
+        docstore_blob = container_client.get_blob_client(f"{segment['path']}/docstore.jsonl")
+        
+        def read_remote_range(start, length):
+            with timed_stage('blob_download'):
+                data = docstore_blob.download_blob(offset=start, length=length).readall()
+            record_blob_bytes('download', len(data))
+            return data
+        read_range = read_remote_range
+    return open_segment_store(local_dir, get_embeddings(), read_range)
+
+def append_vector_store_segment(vector_store, container_client):
+    try:
+        index = vector_store.index
+        if choose_index_type(index.ntotal) != get_index_type(index):
+            index = build_segment_index(get_index_vectors(index))
+        segment = upload_segment(container_client, index, get_store_documents(vector_store))
+        manifest, _ = update_manifest(container_client, lambda manifest: manifest['segments'].append(segment))
+    except Exception as e:
+        print(f"Error appending segment to Azure vector store: {str(e)}")
+        return None
+    
+    schedule_compaction(container_client, manifest)
+    return segment
+
+def is_small_segment(segment):
+    return segment['chunks'] is None or segment['chunks'] < COMPACTION_SMALL_SEGMENT_CHUNKS
+
+def schedule_compaction(container_client, manifest):
+    small_segments = [segment for segment in manifest['segments'] if is_small_segment(segment)]
+    if len(small_segments) < COMPACTION_MIN_SEGMENTS or not compaction_lock.acquire(blocking=False):
+        return
+    try:
+        future = compaction_executor.submit(compact_vector_store, container_client)
+    except Exception:
+        compaction_lock.release()
+        raise
+    future.add_done_callback(lambda _: compaction_lock.release())
+
+def compact_vector_store(container_client):
+    try:
+        manifest, _ = read_manifest(container_client)
+        delete_retired_segments(container_client, manifest)
+        
+        small_segments = [segment for segment in manifest['segments'] if is_small_segment(segment)]
+        if len(small_segments) < 2:
+            return None
+        
+        vectors, docs = [], []
+        for segment in small_segments:
+            segment_store = azure_segment_cache.get(segment['id']) or load_segment(container_client, segment)
+            vectors.append(get_index_vectors(segment_store.index))
+            docs.extend(get_store_documents(segment_store))
+        
+        # Large enough merged segments are trained as an ANN index here, off the query path
+        index = build_segment_index(np.vstack(vectors))
+        compacted = upload_segment(container_client, index, docs)
+        compacted_ids = {segment['id'] for segment in small_segments}
+        
+        def replace_segments(manifest):
+            current_ids = {segment['id'] for segment in manifest['segments']}
+            if not compacted_ids <= current_ids:
+                # Another worker compacted some of these segments first
+                return False
+            manifest['segments'] = [s for s in manifest['segments'] if s['id'] not in compacted_ids] + [compacted]
+            # Readers holding the old manifest may still fetch these, so delete them after a grace period
+            manifest.setdefault('retired', []).extend(
+                {'path': segment['path'], 'blobs': segment_blob_paths(segment), 'retired_at': time.time()}
+                for segment in small_segments
+            )
+        
+        manifest, _ = update_manifest(container_client, replace_segments)
+        if manifest is None:
+            for blob_path in segment_blob_paths(compacted):
+                container_client.get_blob_client(blob_path).delete_blob()
+            return None
+        
+        print(f"Compacted {len(small_segments)} vector store segments into {compacted['id']}")
+        return compacted
+    except Exception as e:
+        print(f"Error compacting Azure vector store: {str(e)}")
+        return None
+
+def delete_retired_segments(container_client, manifest):
+    cutoff = time.time() - COMPACTION_RETIRE_GRACE_SECONDS
+    expired = [entry for entry in manifest.get('retired', []) if entry['retired_at'] < cutoff]
+    if not expired:
+        return
+    
+    for entry in expired:
+        for blob_path in entry.get('blobs', [entry['path']]):
+            try:
+                container_client.get_blob_client(blob_path).delete_blob()
+            except ResourceNotFoundError:
+                pass
+    
+    expired_paths = {entry['path'] for entry in expired}
+    update_manifest(container_client, lambda manifest: manifest.update(
+        retired=[entry for entry in manifest.get('retired', []) if entry['path'] not in expired_paths]
+    ))
+
+# Shared Azure Index Cache
+def get_azure_index_version(container_client):
+    # Cheap HEAD on the manifest; falls back to the legacy single blob before the first manifest exists
+    etag = get_blob_etag(container_client, VECTOR_STORE_MANIFEST_PATH)
+    if etag is not None:
+        return etag
+    legacy_etag = get_blob_etag(container_client, VECTOR_STORE_PATH)
+    return f"legacy:{legacy_etag}" if legacy_etag else None
+
+def publish_azure_vector_store(etag, vector_store):
+    if not etag:
+        return
+    with azure_index_stats_lock:
+        previous = azure_index_cache['entry']
+        azure_index_cache['entry'] = (etag, vector_store)
+        azure_index_cache['checked_at'] = time.monotonic()
+        if previous is not None and previous[0] != etag:
+            azure_index_cache['reloads'] += 1
+
+def load_azure_vector_store(container_client):
+    # Caller holds azure_index_load_lock; only segments not already in memory are downloaded
+    manifest, etag = read_manifest(container_client)
+    if not manifest['segments']:
+        return None, None
+    
+    segments = []
+    for segment in manifest['segments']:
+        segment_store = azure_segment_cache.get(segment['id'])
+        if segment_store is None:
+            segment_store = load_segment(container_client, segment)
+            azure_segment_cache[segment['id']] = segment_store
+        segments.append(segment_store)
+    
+    live_ids = {segment['id'] for segment in manifest['segments']}
+    for segment_id in [k for k in azure_segment_cache if k not in live_ids]:
+        del azure_segment_cache[segment_id]
+        # Open mmaps keep the data alive until the last reader drops the old store
+        shutil.rmtree(os.path.join(INDEX_CACHE_DIR, segment_id), ignore_errors=True)
+    
+    if etag is None:
+        etag = get_azure_index_version(container_client)
+    return etag, SegmentedVectorStore(segments, get_embeddings())
+
+def get_azure_vector_store(container_client):
+    entry = azure_index_cache['entry']
+    now = time.monotonic()
+    
+    # Skip the HEAD round-trip entirely while the last check is still fresh
+    if entry is not None and now - azure_index_cache['checked_at'] < AZURE_INDEX_CHECK_INTERVAL:
+        with azure_index_stats_lock:
+            azure_index_cache['hits'] += 1
+        return entry[1]
+    
+    try:
+        etag = get_azure_index_version(container_client)
+    except Exception as e:
+        print(f"Error checking Azure vector store version: {str(e)}")
+        with azure_index_stats_lock:
+            azure_index_cache['errors'] += 1
+        # Serve the last known version rather than failing the query
+        return entry[1] if entry is not None else None
+    
+    with azure_index_stats_lock:
+        azure_index_cache['checks'] += 1
+        azure_index_cache['checked_at'] = now
+    
+    if etag is None:
+        return None
+    
+    if entry is not None and entry[0] == etag:
+        with azure_index_stats_lock:
+            azure_index_cache['hits'] += 1
+        return entry[1]
+    
+    return refresh_azure_vector_store(container_client, etag)
+
+def refresh_azure_vector_store(container_client, etag):
+    # Only one thread loads a new version; the others wait and reuse it
+    with azure_index_load_lock:
+        entry = azure_index_cache['entry']
+        if entry is not None and entry[0] == etag:
+            with azure_index_stats_lock:
+                azure_index_cache['hits'] += 1
+            return entry[1]
+        
+        with azure_index_stats_lock:
+            azure_index_cache['misses'] += 1
+        
+        started = time.monotonic()
+        try:
+            # Key by the manifest version actually read, which may be newer than the HEAD
+            with timed_stage('index_load'):
+                loaded_etag, vector_store = load_azure_vector_store(container_client)
+        except Exception as e:
+            print(f"Error downloading from Azure Blob Storage: {str(e)}")
+            with azure_index_stats_lock:
+                azure_index_cache['errors'] += 1
+            return entry[1] if entry is not None else None
+        
+        if vector_store is None:
+            return None
+        
+        publish_azure_vector_store(loaded_etag, vector_store)
+        with azure_index_stats_lock:
+            azure_index_cache['last_load_seconds'] = round(time.monotonic() - started, 3)
+        return vector_store
+
+def get_azure_index_cache_stats():
+    with azure_index_stats_lock:
+        entry = azure_index_cache['entry']
+        return {
+            'etag': entry[0] if entry is not None else None,
+            'loaded': entry is not None,
+            'segments': len(entry[1].segments) if entry is not None else 0,
+            'hits': azure_index_cache['hits'],
+            'misses': azure_index_cache['misses'],
+            'reloads': azure_index_cache['reloads'],
+            'checks': azure_index_cache['checks'],
+            'errors': azure_index_cache['errors'],
+            'last_load_seconds': azure_index_cache['last_load_seconds']
+        }
+
+# Session Store
+def new_session_record():
+    return {
+        'pdf_processed': False,
+        'vector_store_exists': False,
+        'processed_files': [],
+        'vector_store_path': None
+    }
+
+class SQLiteSessionStore:
+    # Sessions shared by every worker process on the host: one row per session, one connection per thread
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_seen_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_by_last_seen ON sessions (last_seen_at)")
+    
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+    
+    def create(self, session_id):
+        now = time.time()
+        self.connect().execute(
+            "INSERT INTO sessions (session_id, data, created_at, last_seen_at) VALUES (?, ?, ?, ?)",
+            (session_id, json.dumps(new_session_record()), now, now)
+        )
+    
+    def get(self, session_id, touch=True):
+        conn = self.connect()
+        row = conn.execute("SELECT data, last_seen_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if touch and now - row[1] > min(SESSION_TOUCH_INTERVAL, SESSION_TTL_SECONDS / 2):
+            conn.execute("UPDATE sessions SET last_seen_at = ? WHERE session_id = ?", (now, session_id))
+        return json.loads(row[0])
+    
+    def update(self, session_id, **fields):
+        # Returns False if the session no longer exists
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE sessions SET data = ?, last_seen_at = ? WHERE session_id = ?",
+                    (json.dumps(dict(json.loads(row[0]), **fields)), time.time(), session_id)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+    
+    def delete_expired(self, cutoff):
+        # Each expired row is deleted by exactly one worker, which then owns the cleanup of its files
+        rows = self.connect().execute(
+            "DELETE FROM sessions WHERE last_seen_at < ? RETURNING session_id", (cutoff,)
+        ).fetchall()
+        return [row[0] for row in rows]
+    
+    def count(self):
+        return self.connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+class MemorySessionStore:
+    # The same interface kept in this process only (sessions are lost on restart and not seen by other workers)
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+    
+    def create(self, session_id):
+        with self.lock:
+            self.sessions[session_id] = {'data': new_session_record(), 'last_seen_at': time.time()}
+    
+    def get(self, session_id, touch=True):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            if touch:
+                entry['last_seen_at'] = time.time()
+            return dict(entry['data'])
+    
+    def update(self, session_id, **fields):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return False
+            entry['data'].update(fields)
+            entry['last_seen_at'] = time.time()
+            return True
+    
+    def delete_expired(self, cutoff):
+        with self.lock:
+            expired = [session_id for session_id, entry in self.sessions.items() if entry['last_seen_at'] < cutoff]
+            for session_id in expired:
+                del self.sessions[session_id]
+        return expired
+    
+    def count(self):
+        with self.lock:
+            return len(self.sessions)
+
+def build_session_store():
+    if SESSION_STORE_BACKEND == 'memory':
+        return MemorySessionStore()
+    return SQLiteSessionStore(SESSION_DB_PATH)
+
+def get_session_store():
+    return get_resource('session_store', build_session_store)
+
+def create_session():
+    session_id = str(uuid.uuid4())
+    get_session_store().create(session_id)
+    schedule_session_gc()
+    return session_id
+
+def get_session_dir(session_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], session_id)
+
+def get_dir_bytes(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+def check_session_quota(session_id, files):
+    # files: received PDF parts not yet stored; returns an error message, or None if they fit the quota
+    pdf_dir = os.path.join(get_session_dir(session_id), 'pdfs')
+    existing = set(os.listdir(pdf_dir)) if os.path.isdir(pdf_dir) else set()
+    new_bytes = {}
+    for file in files:
+        name = f"{file.stream.sha256.hexdigest()}.pdf"
+        if name not in existing:
+            new_bytes[name] = file.stream.size
+    
+    if SESSION_MAX_FILES and len(existing) + len(new_bytes) > SESSION_MAX_FILES:
+        return f"Session quota exceeded: at most {SESSION_MAX_FILES} PDFs per session"
+    if SESSION_MAX_BYTES and get_dir_bytes(get_session_dir(session_id)) + sum(new_bytes.values()) > SESSION_MAX_BYTES:
+        return f"Session quota exceeded: at most {SESSION_MAX_BYTES // (1024 * 1024)} MiB of files per session"
+    return None
+
+def remove_session_dir(session_id):
+    # Returns the bytes freed; the worker's loaded copy of the session index and its cached answers are dropped too
+    session_dir = get_session_dir(session_id)
+    vector_store_dir = os.path.join(session_dir, "faiss_index")
+    with session_store_cache_lock:
+        session_store_cache.pop(vector_store_dir, None)
+    drop_cached_answers(f"session:{vector_store_dir}")
+    freed = get_dir_bytes(session_dir)
+    shutil.rmtree(session_dir, ignore_errors=True)
+    return freed
+
+def collect_sessions():
+    # Deletes sessions idle for SESSION_TTL_SECONDS with their PDFs and index, then session directories no
+    # session owns any more (a crash, a job that outlived its session) and abandoned incoming uploads
+    now = time.time()
+    cutoff = now - SESSION_TTL_SECONDS
+    store = get_session_store()
+    expired = store.delete_expired(cutoff)
+    freed = sum(remove_session_dir(session_id) for session_id in expired)
+    
+    orphans = 0
+    upload_folder = app.config['UPLOAD_FOLDER']
+    for name in os.listdir(upload_folder):
+        path = os.path.join(upload_folder, name)
+        if name == 'incoming' or not os.path.isdir(path) or os.path.getmtime(path) >= cutoff:
+            continue
+        if store.get(name, touch=False) is None:
+            freed += remove_session_dir(name)
+            orphans += 1
+    
+    incoming_root = os.path.join(upload_folder, 'incoming')
+    if os.path.isdir(incoming_root):
+        for name in os.listdir(incoming_root):
+            path = os.path.join(incoming_root, name)
+            if os.path.getmtime(path) < cutoff:
+                freed += get_dir_bytes(path)
+                shutil.rmtree(path, ignore_errors=True)
+    
+    with session_gc_lock:
+        session_gc_stats['runs'] += 1
+        session_gc_stats['expired'] += len(expired)
+        session_gc_stats['orphans'] += orphans
+        session_gc_stats['bytes_freed'] += freed
+    return expired
+
+def run_session_gc():
+    try:
+        collect_sessions()
+    except Exception as e:
+        print(f"Error collecting expired sessions: {str(e)}")
+        with session_gc_lock:
+            session_gc_stats['errors'] += 1
+
+def schedule_session_gc():
+    # At most one collection per SESSION_GC_INTERVAL in each worker, off the request thread
+    now = time.time()
+    with session_gc_lock:
+        if now - session_gc_stats['last_run'] < SESSION_GC_INTERVAL:
+            return
+        session_gc_stats['last_run'] = now
+    session_gc_executor.submit(run_session_gc)
+
+def get_session_gc_stats():
+    with session_gc_lock:
+        stats = dict(session_gc_stats)
+    stats.update({
+        'backend': SESSION_STORE_BACKEND,
+        'sessions': get_session_store().count(),
+        'ttl_seconds': SESSION_TTL_SECONDS,
+        'max_bytes': SESSION_MAX_BYTES,
+        'max_files': SESSION_MAX_FILES
+    })
+    return stats
+
+# Session Vector Store Cache
+def get_index_dir_size(vector_store_dir):
+    total = 0
+    for name in ("index.faiss", "index.pkl", KEYWORD_INDEX_FILE) + SEGMENT_FILES[1:]:
+        path = os.path.join(vector_store_dir, name)
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+def get_index_dir_version(vector_store_dir):
+    return os.path.getmtime(os.path.join(vector_store_dir, "index.faiss"))
+
+def is_compact_index_dir(vector_store_dir):
+    return os.path.exists(os.path.join(vector_store_dir, "docstore.offsets"))
+
+def save_session_vector_store(vector_store_dir, vector_store):
+    # Returns the store to serve from now on. In compact mode that is the quantized index read back from disk,
+    # so the float32 vectors and Document objects built during ingestion are freed once the job ends.
+    os.makedirs(vector_store_dir, exist_ok=True)
+    if SESSION_INDEX_MODE not in SESSION_INDEX_TYPES:
+        for name in SEGMENT_FILES[1:]:
+            if os.path.exists(os.path.join(vector_store_dir, name)):
+                os.remove(os.path.join(vector_store_dir, name))
+        vector_store.save_local(vector_store_dir)
+        # Chunks were added in order, so row i of the keyword index is FAISS position i
+        vector_store.bm25 = BM25Index.build(doc.page_content for doc in get_store_documents(vector_store))
+        vector_store.bm25.save(os.path.join(vector_store_dir, KEYWORD_INDEX_FILE))
+        return vector_store
+    
+    # Written aside and renamed into place, index.faiss (the version) last: a worker that still maps
+    # the previous files keeps reading them intact
+    index = build_segment_index(get_index_vectors(vector_store.index), SESSION_INDEX_TYPES[SESSION_INDEX_MODE])
+    temp_dir = f"{vector_store_dir}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(temp_dir)
+    try:
+        write_segment_files(temp_dir, index, get_store_documents(vector_store))
+        for name in SEGMENT_FILES[1:] + (KEYWORD_INDEX_FILE, SEGMENT_FILES[0]):
+            os.replace(os.path.join(temp_dir, name), os.path.join(vector_store_dir, name))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    if os.path.exists(os.path.join(vector_store_dir, "index.pkl")):
+        os.remove(os.path.join(vector_store_dir, "index.pkl"))
+    return open_segment_store(vector_store_dir, get_embeddings())
+
+def evict_session_stores_locked(now):
+    # Caller holds session_store_cache_lock
+    for key in [k for k, v in session_store_cache.items() if now - v['last_used'] > SESSION_CACHE_IDLE_SECONDS]:
+        del session_store_cache[key]
+        session_store_cache_stats['expired'] += 1
+    
+    while session_store_cache and (
+        len(session_store_cache) > SESSION_CACHE_MAX_ENTRIES or
+        sum(v['bytes'] for v in session_store_cache.values()) > SESSION_CACHE_MAX_BYTES
+    ):
+        if SESSION_CACHE_POLICY == 'largest':
+            key = max(session_store_cache, key=lambda k: session_store_cache[k]['bytes'])
+        else:
+            key = next(iter(session_store_cache))
+        del session_store_cache[key]
+        session_store_cache_stats['evictions'] += 1
+
+def cache_session_vector_store(vector_store_dir, vector_store):
+    entry = {
+        'vector_store': vector_store,
+        'bytes': get_index_dir_size(vector_store_dir),
+        'version': get_index_dir_version(vector_store_dir),
+        'last_used': time.monotonic()
+    }
+    with session_store_cache_lock:
+        session_store_cache[vector_store_dir] = entry
+        session_store_cache.move_to_end(vector_store_dir)
+        evict_session_stores_locked(entry['last_used'])
+
+@timed_stage('index_load')
+def load_session_vector_store(vector_store_dir):
+    # Either format, whatever SESSION_INDEX_MODE is now
+    from langchain_community.vectorstores import FAISS
+    
+    if is_compact_index_dir(vector_store_dir):
+        return open_segment_store(vector_store_dir, get_embeddings())
+    vector_store = FAISS.load_local(vector_store_dir, get_embeddings(), allow_dangerous_deserialization=True)
+    vector_store.bm25 = load_bm25_index(vector_store_dir)
+    return vector_store
+
+def get_session_vector_store(vector_store_dir):
+    now = time.monotonic()
+    version = get_index_dir_version(vector_store_dir)
+    
+    with session_store_cache_lock:
+        entry = session_store_cache.get(vector_store_dir)
+        if entry is not None and entry['version'] == version:
+            entry['last_used'] = now
+            session_store_cache.move_to_end(vector_store_dir)
+            session_store_cache_stats['hits'] += 1
+            evict_session_stores_locked(now)
+            return entry['vector_store']
+        session_store_cache_stats['misses'] += 1
+    
+    vector_store = load_session_vector_store(vector_store_dir)
+    cache_session_vector_store(vector_store_dir, vector_store)
+    return vector_store
+
+def get_session_cache_stats():
+    with session_store_cache_lock:
+        evict_session_stores_locked(time.monotonic())
+        return {
+            'entries': len(session_store_cache),
+            'bytes': sum(v['bytes'] for v in session_store_cache.values()),
+            'max_bytes': SESSION_CACHE_MAX_BYTES,
+            'max_entries': SESSION_CACHE_MAX_ENTRIES,
+            'idle_seconds': SESSION_CACHE_IDLE_SECONDS,
+            'policy': SESSION_CACHE_POLICY,
+            **session_store_cache_stats
+        }
+
+# Conversational Chain
+PROMPT_TEMPLATE = """
+    You are a healthcare assistant providing medical information and advice based on the medical documents provided.
+    Answer the question as detailed as possible from the provided medical context, making sure to provide accurate healthcare information.
+    If the answer is not in the provided context, just say "I don't have enough information to answer that question based on the available medical documents."
+    Do not provide any incorrect medical information or advice.
+
+    Context:\n {context}?\n
+    Question: \n{question}\n
+
+    Answer:
+    """
+
+def build_llm():
+    from langchain_groq import ChatGroq
+    
+    # Keep-alive connections to Groq are reused across questions
+    http_client = httpx.Client(limits=httpx.Limits(max_connections=GROQ_POOL_SIZE, max_keepalive_connections=GROQ_POOL_SIZE))
+    register_closer(http_client.close)
+    http_async_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=GROQ_ASYNC_POOL_SIZE, max_keepalive_connections=GROQ_ASYNC_POOL_SIZE))
+    register_async_closer(http_async_client.aclose)
+    return ChatGroq(model=GROQ_MODEL, temperature=0.3, http_client=http_client, http_async_client=http_async_client)
+
+def get_llm():
+    return get_resource('llm', build_llm)
+
+def build_prompt():
+    from langchain.prompts import PromptTemplate
+    
+    return PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+
+def get_prompt():
+    return get_resource('prompt', build_prompt)
+
+def build_conversational_chain():
+    from langchain.chains.question_answering import load_qa_chain
+    
+    return load_qa_chain(get_llm(), chain_type="stuff", prompt=get_prompt())
+
+def get_conversational_chain():
+    return get_resource('qa_chain', build_conversational_chain)
+
+def stream_answer(user_question, docs):
+    # Same prompt the "stuff" chain builds, but streamed token by token from Groq
+    context = "\n\n".join(doc.page_content for doc in docs)
+    
+    with timed_stage('llm'):
+        prompt = get_prompt().format(context=context, question=user_question)
+        for chunk in get_llm().stream(prompt, config={'callbacks': [LLMUsageCallback()]}):
+            if chunk.content:
+                yield chunk.content
+
+# Answer Cache
+def normalize_question(question):
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+def sync_answer_cache_version_locked(scope, version):
+    # Caller holds answer_cache_lock; a new index version drops every answer computed for the old one
+    if answer_cache_versions.get(scope) == version:
+        return
+    if scope in answer_cache_versions:
+        for key in [k for k in answer_cache if k[0] == scope]:
+            del answer_cache[key]
+        answer_cache_stats['invalidations'] += 1
+    elif len(answer_cache_versions) >= ANSWER_CACHE_MAX_ENTRIES:
+        # Sessions collected by another worker are never dropped here; forget every scope with no answer left
+        live_scopes = {k[0] for k in answer_cache}
+        for stale_scope in [s for s in answer_cache_versions if s not in live_scopes]:
+            del answer_cache_versions[stale_scope]
+    answer_cache_versions[scope] = version
+
+def drop_cached_answers(scope):
+    # The index is gone (session collected): its answers and its version are forgotten
+    with answer_cache_lock:
+        for key in [k for k in answer_cache if k[0] == scope]:
+            del answer_cache[key]
+        answer_cache_versions.pop(scope, None)
+
+def find_cached_answer(index_key, user_question):
+    # Returns (entry or None, question embedding or None); the embedding is reused for retrieval
+    entry = lookup_cached_answer(index_key, user_question)
+    if entry is not None:
+        return entry, None
+    
+    embedding = get_embeddings().embed_query(user_question) if ANSWER_CACHE_SEMANTIC_THRESHOLD else None
+    return find_similar_answer(index_key, embedding), embedding
+
+@timed_stage('answer_cache')
+def lookup_cached_answer(index_key, user_question):
+    # Exact match on the normalized question
+    scope, version = index_key
+    key = (scope, version, normalize_question(user_question))
+    now = time.monotonic()
+    
+    with answer_cache_lock:
+        sync_answer_cache_version_locked(scope, version)
+        entry = answer_cache.get(key)
+        if entry is not None and now - entry['created_at'] > ANSWER_CACHE_TTL_SECONDS:
+            del answer_cache[key]
+            answer_cache_stats['expired'] += 1
+            entry = None
+        if entry is not None:
+            answer_cache.move_to_end(key)
+            answer_cache_stats['hits'] += 1
+        return entry
+
+@timed_stage('answer_cache')
+def find_similar_answer(index_key, embedding):
+    # Closest cached question for the same index version; embedding is None when semantic matching is off
+    scope, version = index_key
+    now = time.monotonic()
+    if embedding is None:
+        with answer_cache_lock:
+            answer_cache_stats['misses'] += 1
+        return None
+    
+    query_vector = np.asarray(embedding, dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1.0
+    
+    with answer_cache_lock:
+        candidates = [(k, v) for k, v in answer_cache.items()
+                      if k[0] == scope and k[1] == version and now - v['created_at'] <= ANSWER_CACHE_TTL_SECONDS]
+        if candidates:
+            similarities = np.stack([v['embedding'] for _, v in candidates]) @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= ANSWER_CACHE_SEMANTIC_THRESHOLD:
+                best_key, entry = candidates[best]
+                answer_cache.move_to_end(best_key)
+                answer_cache_stats['semantic_hits'] += 1
+                return entry
+        answer_cache_stats['misses'] += 1
+    return None
+
+def store_cached_answer(index_key, user_question, embedding, response, docs, context=None):
+    scope, version = index_key
+    vector = np.asarray(embedding, dtype=np.float32)
+    vector /= np.linalg.norm(vector) or 1.0
+    entry = {
+        'response': response,
+        'sources': [{'content': doc.page_content, 'metadata': doc.metadata} for doc in docs],
+        'context': context,
+        'embedding': vector,
+        'created_at': time.monotonic()
+    }
+    
+    with answer_cache_lock:
+        sync_answer_cache_version_locked(scope, version)
+        if answer_cache_versions[scope] != version:
+            return
+        key = (scope, version, normalize_question(user_question))
+        answer_cache[key] = entry
+        answer_cache.move_to_end(key)
+        while len(answer_cache) > ANSWER_CACHE_MAX_ENTRIES:
+            answer_cache.popitem(last=False)
+            answer_cache_stats['evictions'] += 1
+
+def get_answer_cache_stats():
+    with answer_cache_lock:
+        return {
+            'entries': len(answer_cache),
+            'max_entries': ANSWER_CACHE_MAX_ENTRIES,
+            'ttl_seconds': ANSWER_CACHE_TTL_SECONDS,
+            'semantic_threshold': ANSWER_CACHE_SEMANTIC_THRESHOLD,
+            **answer_cache_stats
+        }
+
+# Context Assembly
+def estimate_tokens(text):
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+
+def build_reranker():
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        print("RERANK_MODEL is set but sentence-transformers is not installed; reranking is disabled")
+        return False
+    return CrossEncoder(RERANK_MODEL)
+
+def get_reranker():
+    if not RERANK_MODEL:
+        return None
+    return get_resource('reranker', build_reranker) or None
+
+def get_chunk_position(doc):
+    # ((document, page), chunk number), or None for chunks indexed without their position
+    metadata = doc.metadata or {}
+    if metadata.get('chunk') is None:
+        return None
+    return (metadata.get('sha256') or metadata.get('source'), metadata.get('page')), metadata['chunk']
+
+def join_overlapping(first, second):
+    # Consecutive chunks share up to CHUNK_OVERLAP characters; keep them once
+    for size in range(min(len(first), len(second), 2 * CHUNK_OVERLAP), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first} {second}"
+
+def merge_adjacent_chunks(docs):
+    # Runs of consecutive chunks from the same document and page become one document, ranked by its best chunk
+    runs, groups = [], {}
+    for rank, doc in enumerate(docs):
+        position = get_chunk_position(doc)
+        if position is None:
+            runs.append((rank, [doc]))
+        else:
+            groups.setdefault(position[0], []).append((position[1], rank, doc))
+    
+    for members in groups.values():
+        members.sort(key=lambda member: member[0])
+        run = [members[0]]
+        for member in members[1:]:
+            if member[0] != run[-1][0] + 1:
+                runs.append((min(r for _, r, _ in run), [d for _, _, d in run]))
+                run = []
+            run.append(member)
+        runs.append((min(r for _, r, _ in run), [d for _, _, d in run]))
+    runs.sort(key=lambda run: run[0])
+    
+    merged = []
+    for _, run_docs in runs:
+        if len(run_docs) == 1:
+            merged.append(run_docs[0])
+            continue
+        text = run_docs[0].page_content
+        for doc in run_docs[1:]:
+            text = join_overlapping(text, doc.page_content)
+        metadata = dict(run_docs[0].metadata, chunks=[doc.metadata['chunk'] for doc in run_docs])
+        merged.append(Document(id=run_docs[0].id, page_content=text, metadata=metadata))
+    return merged
+
+@timed_stage('context')
+def build_context(user_question, candidates, k=RETRIEVAL_K, token_budget=CONTEXT_TOKEN_BUDGET):
+    # Returns (documents for the prompt, counts reported with the answer)
+    context = {
+        'retrieved': len(candidates),
+        'retrieved_tokens': sum(estimate_tokens(doc.page_content) for doc in candidates[:k]),
+        'duplicates_removed': 0,
+        'reranked': False,
+        'merged': 0,
+        'dropped': 0,
+        'truncated': 0
+    }
+    
+    # The same passage indexed twice, or a chunk contained in a better-ranked one
+    kept = []
+    for doc in candidates:
+        text = " ".join(doc.page_content.split())
+        if any(text in other for other, _ in kept):
+            context['duplicates_removed'] += 1
+            continue
+        kept.append((text, doc))
+    docs = [doc for _, doc in kept]
+    
+    reranker = get_reranker()
+    if reranker is not None and len(docs) > 1:
+        scores = reranker.predict([(user_question, doc.page_content) for doc in docs])
+        docs = [docs[i] for i in np.argsort(-np.asarray(scores), kind='stable')]
+        context['reranked'] = True
+    docs = docs[:k]
+    
+    merged = merge_adjacent_chunks(docs)
+    context['merged'] = len(docs) - len(merged)
+    
+    # Best first until the budget is spent; an oversized top document is truncated rather than dropped
+    packed, tokens = [], 0
+    for doc in merged:
+        doc_tokens = estimate_tokens(doc.page_content)
+        if tokens + doc_tokens <= token_budget:
+            packed.append(doc)
+            tokens += doc_tokens
+        elif not packed:
+            text = doc.page_content[:int(token_budget * CONTEXT_CHARS_PER_TOKEN)]
+            packed.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+            tokens += estimate_tokens(text)
+            context['truncated'] += 1
+        else:
+            context['dropped'] += 1
+    
+    context.update(chunks=len(packed), context_tokens=tokens, token_budget=token_budget)
+    return packed, context
+
+# Query Functions
+def get_search_kwargs(data):
+    # Per-query k and ANN effort (nprobe/ef_search are ignored by flat indexes); None if a value is invalid
+    search_kwargs = {}
+    for name in ('k', 'nprobe', 'ef_search'):
+        if data.get(name) in (None, ''):
+            continue
+        try:
+            search_kwargs[name] = max(1, int(data[name]))
+        except (TypeError, ValueError):
+            return None
+    if 'k' in search_kwargs:
+        search_kwargs['k'] = min(search_kwargs['k'], RETRIEVAL_MAX_K)
+    return search_kwargs
+
+@timed_stage('search')
+def search_vector_store(user_question, vector_store, embedding, search_kwargs=None):
+    if not isinstance(vector_store, SegmentedVectorStore):
+        vector_store = SegmentedVectorStore([vector_store], get_embeddings())
+    return vector_store.search(user_question, embedding, **(search_kwargs or {}))
+
+@timed_stage('search')
+def search_vector_store_batch(user_questions, vector_store, embeddings, search_kwargs=None):
+    if not isinstance(vector_store, SegmentedVectorStore):
+        vector_store = SegmentedVectorStore([vector_store], get_embeddings())
+    return vector_store.search_batch(user_questions, embeddings, **(search_kwargs or {}))
+
+def retrieve_documents(user_question, vector_store, embedding=None, search_kwargs=None):
+    if embedding is None:
+        embedding = get_embeddings().embed_query(user_question)
+    return search_vector_store(user_question, vector_store, embedding, search_kwargs), embedding
+
+def get_candidate_search_kwargs(search_kwargs):
+    # Returns (k documents for the prompt, search kwargs); the reranker picks the top k from a wider candidate set
+    search_kwargs = dict(search_kwargs or {})
+    k = search_kwargs.pop('k', RETRIEVAL_K)
+    search_kwargs['k'] = max(k, RERANK_FETCH_K) if get_reranker() is not None else k
+    return k, search_kwargs
+
+def retrieve_context(user_question, vector_store, embedding=None, search_kwargs=None):
+    # Returns (documents for the prompt, context counts, question embedding)
+    k, search_kwargs = get_candidate_search_kwargs(search_kwargs)
+    candidates, embedding = retrieve_documents(user_question, vector_store, embedding, search_kwargs)
+    docs, context = build_context(user_question, candidates, k)
+    return docs, context, embedding
 
-# Configure API keys
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-AZURE_CONNECTION_STRING = os.getenv("AZURE_CONN_STRING")
-CONTAINER_NAME = os.getenv("AZURE_CONTAINER_NAME")
-VECTOR_STORE_PATH = "vector_store/faiss_index"
-PROCESSED_FILES_LIST_PATH = "vector_store/processed_files.pkl"
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs('chat_history', exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+def generate_answer(user_question, docs):
+    chain = get_conversational_chain()
+    
+    with timed_stage('llm'):
+        response = chain(
+            {"input_documents": docs, "question": user_question},
+            return_only_outputs=True,
+            callbacks=[LLMUsageCallback()]
+        )
+    return response["output_text"]
 
-# Dictionary to store client sessions
-client_sessions = {}
+def answer_question(user_question, vector_store, index_key=None, search_kwargs=None):
+    # Returns (answer, context counts)
+    embedding = None
+    if index_key is not None:
+        cached, embedding = find_cached_answer(index_key, user_question)
+        if cached is not None:
+            return cached['response'], dict(cached['context'] or {}, cached=True)
+    
+    docs, context, embedding = retrieve_context(user_question, vector_store, embedding, search_kwargs)
+    response = generate_answer(user_question, docs)
+    
+    if index_key is not None:
+        store_cached_answer(index_key, user_question, embedding, response, docs, context)
+    return response, context
 
-# Azure Blob Storage Functions
-def get_blob_client():
-    try:
-        blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONNECTION_STRING)
-        container_client = blob_service_client.get_container_client(CONTAINER_NAME)
-        return container_client
-    except Exception as e:
-        print(f"Error connecting to Azure Blob Storage: {str(e)}")
-        return None
+def query_local_vector_store(user_question, vector_store, index_key=None, search_kwargs=None):
+    return answer_question(user_question, vector_store, index_key, search_kwargs)[0]
 
-def blob_exists(container_client, blob_path):
-    try:
-        blob_client = container_client.get_blob_client(blob_path)
-        return blob_client.exists()
-    except Exception:
-        return False
+def query_azure_vector_store(user_question, container_client):
+    vector_store = get_azure_vector_store(container_client)
+    if vector_store is None:
+        return "No medical documents have been stored in the database yet. Please upload medical documents first."
+    
+    return query_local_vector_store(user_question, vector_store)
 
-def save_to_blob(container_client, blob_path, data):
-    try:
-        blob_client = container_client.get_blob_client(blob_path)
-        blob_client.upload_blob(data, overwrite=True)
-        return True
-    except Exception as e:
-        print(f"Error saving to Azure Blob Storage: {str(e)}")
-        return False
+def resolve_azure_vector_store():
+    # Returns (vector_store, None, index_key) or (None, message to show the user, None)
+    container_client = get_blob_client()
+    if not container_client:
+        return None, "Failed to connect to Azure Storage. Please check your connection string and container name.", None
+    
+    vector_store = get_azure_vector_store(container_client)
+    if vector_store is None:
+        return None, "No documents have been stored in Azure Storage yet. Please upload and save documents first.", None
+    
+    entry = azure_index_cache['entry']
+    index_key = ('azure', entry[0]) if entry is not None and entry[1] is vector_store else None
+    return vector_store, None, index_key
 
-def download_from_blob(container_client, blob_path):
+def resolve_session_vector_store(session_id):
+    schedule_session_gc()
+    record = get_session_store().get(session_id) if session_id else None
+    if not (record and record.get('pdf_processed', False)):
+        return None, "Please upload and process PDF files first.", None
+    
+    vector_store_dir = record.get('vector_store_path')
+    if not vector_store_dir or not os.path.exists(vector_store_dir):
+        return None, "Error loading vector store. Please process PDFs again.", None
+    
     try:
-        blob_client = container_client.get_blob_client(blob_path)
-        if not blob_client.exists():
-            return None
-        
-        download = blob_client.download_blob()
-        downloaded_bytes = download.readall()
-        return downloaded_bytes
+        vector_store = get_session_vector_store(vector_store_dir)
+        return vector_store, None, (f"session:{vector_store_dir}", get_index_dir_version(vector_store_dir))
     except Exception as e:
-        print(f"Error downloading from Azure Blob Storage: {str(e)}")
-        return None
+        return None, f"Error loading vector store: {str(e)}", None
 
-def get_processed_files(container_client):
-    processed_files = []
-    data = download_from_blob(container_client, PROCESSED_FILES_LIST_PATH)
-    if data:
-        processed_files = pickle.loads(data)
-    return processed_files
+# Streaming Responses
+def wants_stream(data):
+    return str(data.get('stream', '')).lower() in ('1', 'true', 'yes')
 
-def save_processed_files(container_client, processed_files):
-    data = pickle.dumps(processed_files)
-    return save_to_blob(container_client, PROCESSED_FILES_LIST_PATH, data)
+def wants_debug(data):
+    # Adds the request's per-stage timings, blob bytes and LLM tokens to the answer
+    return str(data.get('debug', '')).lower() in ('1', 'true', 'yes')
 
-# PDF Processing Functions
-def get_pdf_text(pdf_path):
-    text = ""
-    pdf_reader = PdfReader(pdf_path)
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-def get_text_chunks(text):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = text_splitter.split_text(text)
-    return chunks
+def stream_query_response(user_question, vector_store, message, mode, session_id=None, index_key=None, search_kwargs=None, debug=False):
+    # Event order: sources, token*, done (chat history is saved once, after the last token)
+    trace = request_trace.get()
+    
+    def generate():
+        parts = []
+        context = None
+        cached, embedding = (None, None) if vector_store is None or index_key is None else find_cached_answer(index_key, user_question)
+        if vector_store is None:
+            yield sse_event('sources', {'sources': []})
+            parts.append(message)
+            yield sse_event('token', {'token': message})
+        elif cached is not None:
+            context = dict(cached['context'] or {}, cached=True)
+            yield sse_event('sources', {'sources': cached['sources'], 'context': context})
+            parts.append(cached['response'])
+            yield sse_event('token', {'token': cached['response']})
+        else:
+            docs, context, embedding = retrieve_context(user_question, vector_store, embedding, search_kwargs)
+            yield sse_event('sources', {
+                'sources': [{'content': doc.page_content, 'metadata': doc.metadata} for doc in docs],
+                'context': context
+            })
+            try:
+                for token in stream_answer(user_question, docs):
+                    parts.append(token)
+                    yield sse_event('token', {'token': token})
+                if index_key is not None:
+                    store_cached_answer(index_key, user_question, embedding, "".join(parts), docs, context)
+            except Exception as e:
+                yield sse_event('error', {'message': str(e)})
+        
+        response = "".join(parts)
+        chat_history = save_chat_history(user_question, response, mode, session_id)
+        done = {'status': 'success', 'response': response, 'chat_history': chat_history, 'context': context}
+        if debug and trace is not None:
+            done['timings'] = get_trace_breakdown(trace)
+        yield sse_event('done', done)
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-def get_vector_store(text_chunks):
-    embeddings = GoogleGenerativeAIEmbeddings(model='models/embedding-001')
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    return vector_store
+# Batch Queries
+def cached_batch_result(entry):
+    return {'status': 'success', 'response': entry['response'], 'sources': entry['sources'],
+            'context': dict(entry['context'] or {}, cached=True)}
 
-def merge_vector_stores(vector_store, container_client):
-    existing_data = download_from_blob(container_client, VECTOR_STORE_PATH)
-    if existing_data:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            data_dict = pickle.loads(existing_data)
-            
-            with open(os.path.join(temp_dir, "index.faiss"), "wb") as f:
-                f.write(data_dict["index.faiss"])
-            with open(os.path.join(temp_dir, "index.pkl"), "wb") as f:
-                f.write(data_dict["index.pkl"])
-            
-            embeddings = GoogleGenerativeAIEmbeddings(model='models/embedding-001')
-            existing_store = FAISS.load_local(temp_dir, embeddings, allow_dangerous_deserialization=True)
-            
-            existing_store.merge_from(vector_store)
-            
-            existing_store.save_local(temp_dir)
-            
-            with open(os.path.join(temp_dir, "index.faiss"), "rb") as f:
-                index_data = f.read()
-            with open(os.path.join(temp_dir, "index.pkl"), "rb") as f:
-                pkl_data = f.read()
+def iter_batch_answers(user_questions, vector_store, index_key=None, search_kwargs=None):
+    # Yields (positions in user_questions, result) as answers complete. Questions with the same normalized
+    # text are answered once; the cache misses are embedded in one call and searched as one query matrix.
+    groups = {}
+    for position, user_question in enumerate(user_questions):
+        groups.setdefault(normalize_question(user_question), []).append(position)
+    
+    pending = []
+    for positions in groups.values():
+        cached = lookup_cached_answer(index_key, user_questions[positions[0]]) if index_key is not None else None
+        if cached is not None:
+            yield positions, cached_batch_result(cached)
+        else:
+            pending.append({'positions': positions, 'question': user_questions[positions[0]]})
+    if not pending:
+        return
+    
+    embeddings = get_embeddings().embed_queries([item['question'] for item in pending])
+    for item, embedding in zip(pending, embeddings):
+        item['embedding'] = embedding
+    
+    if index_key is not None:
+        misses = []
+        for item in pending:
+            cached = find_similar_answer(index_key, item['embedding'] if ANSWER_CACHE_SEMANTIC_THRESHOLD else None)
+            if cached is not None:
+                yield item['positions'], cached_batch_result(cached)
+            else:
+                misses.append(item)
+        pending = misses
+        if not pending:
+            return
+    
+    k, candidate_kwargs = get_candidate_search_kwargs(search_kwargs)
+    candidates = search_vector_store_batch(
+        [item['question'] for item in pending], vector_store, [item['embedding'] for item in pending], candidate_kwargs
+    )
+    
+    # Each call runs in a copy of this request's context, so its stages still reach the request trace
+    futures = {}
+    for item, item_candidates in zip(pending, candidates):
+        item['docs'], item['context'] = build_context(item['question'], item_candidates, k)
+        future = query_batch_executor.submit(contextvars.copy_context().run, generate_answer, item['question'], item['docs'])
+        futures[future] = item
+    
+    try:
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                yield item['positions'], {'status': 'error', 'message': str(e)}
+                continue
+            if index_key is not None:
+                store_cached_answer(index_key, item['question'], item['embedding'], response, item['docs'], item['context'])
+            yield item['positions'], {
+                'status': 'success',
+                'response': response,
+                'sources': [{'content': doc.page_content, 'metadata': doc.metadata} for doc in item['docs']],
+                'context': item['context']
+            }
+    finally:
+        # A client that disconnects stops the questions not yet sent to the LLM
+        for future in futures:
+            future.cancel()
 
-            combined_data = pickle.dumps({"index.faiss": index_data, "index.pkl": pkl_data})
-            return save_to_blob(container_client, VECTOR_STORE_PATH, combined_data)
-    else:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            vector_store.save_local(temp_dir)
-            
-            with open(os.path.join(temp_dir, "index.faiss"), "rb") as f:
-                index_data = f.read()
-            with open(os.path.join(temp_dir, "index.pkl"), "rb") as f:
-                pkl_data = f.read()
-            
-            combined_data = pickle.dumps({"index.faiss": index_data, "index.pkl": pkl_data})
-            return save_to_blob(container_client, VECTOR_STORE_PATH, combined_data)
+def stream_batch_response(user_questions, vector_store, index_key=None, search_kwargs=None, debug=False):
+    # One JSON object per line and question, in completion order, then a summary line
+    trace = request_trace.get()
+    
+    def generate():
+        started = time.perf_counter()
+        counts = {'answered': 0, 'cached': 0, 'errors': 0}
+        for positions, result in iter_batch_answers(user_questions, vector_store, index_key, search_kwargs):
+            for position in positions:
+                if result['status'] != 'success':
+                    counts['errors'] += 1
+                elif result['context'].get('cached'):
+                    counts['cached'] += 1
+                else:
+                    counts['answered'] += 1
+                line = dict(result, index=position, question=user_questions[position])
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        
+        summary = dict(counts, status='done', questions=len(user_questions), seconds=round(time.perf_counter() - started, 3))
+        if debug and trace is not None:
+            summary['timings'] = get_trace_breakdown(trace)
+        yield json.dumps(summary) + "\n"
+    
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-# Conversational Chain
-def get_conversational_chain():
-    prompt_template = """
-    You are a healthcare assistant providing medical information and advice based on the medical documents provided.
-    Answer the question as detailed as possible from the provided medical context, making sure to provide accurate healthcare information.
-    If the answer is not in the provided context, just say "I don't have enough information to answer that question based on the available medical documents."
-    Do not provide any incorrect medical information or advice.
+# Ingestion Jobs
+def prune_ingest_jobs_locked(now):
+    # Caller holds ingest_jobs_lock
+    for job_id in [k for k, v in ingest_jobs.items()
+                   if v['finished_at'] is not None and now - v['finished_at'] > JOB_RETENTION_SECONDS]:
+        del ingest_jobs[job_id]
 
-    Context:\n {context}?\n
-    Question: \n{question}\n
+def submit_ingest_job(session_id, uploads, save_to_azure):
+    # uploads: the records returned by store_session_upload
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    job = {
+        'job_id': job_id,
+        'session_id': session_id,
+        'status': 'queued',
+        'files': [upload['filename'] for upload in uploads],
+        'uploads': list(uploads),
+        'save_to_azure': save_to_azure,
+        'stage': None,
+        'stages': {
+            name: {'status': 'skipped' if name == 'azure' and not save_to_azure else 'pending',
+                   'progress': 0.0, 'items': 0, 'seconds': None, 'items_per_second': None}
+            for name in INGEST_STAGES
+        },
+        'skipped_files': [],
+        'error': None,
+        'created_at': now,
+        'started_at': None,
+        'finished_at': None
+    }
+    with ingest_jobs_lock:
+        prune_ingest_jobs_locked(now)
+        ingest_jobs[job_id] = job
+    
+    future = ingest_executor.submit(run_ingest_job, job_id)
+    return job_id, future
 
-    Answer:
-    """
+def get_ingest_job(job_id):
+    with ingest_jobs_lock:
+        job = ingest_jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = dict(job, stages={name: dict(stage) for name, stage in job['stages'].items()})
+    
+    end = snapshot['finished_at'] or time.time()
+    snapshot['elapsed_seconds'] = round(end - snapshot['started_at'], 3) if snapshot['started_at'] else 0.0
+    return snapshot
 
-    model = ChatGroq(model="llama3-70b-8192", temperature=0.3)
-    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-    chain = load_qa_chain(model, chain_type="stuff", prompt=prompt)
-    return chain
+def update_job_stage(job_id, stage, **fields):
+    with ingest_jobs_lock:
+        ingest_jobs[job_id]['stages'][stage].update(fields)
 
-# Query Functions
-def query_local_vector_store(user_question, vector_store):
-    docs = vector_store.similarity_search(user_question)
-    
-    chain = get_conversational_chain()
-    
-    response = chain(
-        {"input_documents": docs, "question": user_question},
-        return_only_outputs=True
-    )
+@contextmanager
+def job_stage(job_id, stage):
+    with ingest_jobs_lock:
+        ingest_jobs[job_id]['stage'] = stage
+        ingest_jobs[job_id]['stages'][stage]['status'] = 'running'
+    started = time.monotonic()
+    try:
+        with timed_stage(f"ingest_{stage}"):
+            yield
+    except Exception:
+        update_job_stage(job_id, stage, status='failed')
+        raise
     
-    return response["output_text"]
+    seconds = time.monotonic() - started
+    with ingest_jobs_lock:
+        entry = ingest_jobs[job_id]['stages'][stage]
+        entry.update(status='done', progress=1.0, seconds=round(seconds, 3))
+        if entry['items'] and seconds > 0:
+            entry['items_per_second'] = round(entry['items'] / seconds, 2)
 
-def query_azure_vector_store(user_question, container_client):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-     
-    with tempfile.TemporaryDirectory() as temp_dir: 
-        combined_data = download_from_blob(container_client, VECTOR_STORE_PATH)
-        if not combined_data:
-            return "No medical documents have been stored in the database yet. Please upload medical documents first."
+def run_ingest_job(job_id):
+    with ingest_jobs_lock:
+        job = ingest_jobs[job_id]
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        session_id, uploads, save_to_azure = job['session_id'], job['uploads'], job['save_to_azure']
+    
+    try:
+        container_client = None
+        if save_to_azure:
+            container_client = get_blob_client()
+            if not container_client:
+                raise ConnectionError("Failed to connect to Azure Storage")
         
-        data_dict = pickle.loads(combined_data)
-         
-        with open(os.path.join(temp_dir, "index.faiss"), "wb") as f:
-            f.write(data_dict["index.faiss"])
-        with open(os.path.join(temp_dir, "index.pkl"), "wb") as f:
-            f.write(data_dict["index.pkl"])
-         
-        vector_store = FAISS.load_local(temp_dir, embeddings, allow_dangerous_deserialization=True)
+        # Identical content is only extracted once, whatever the filenames
+        documents = {}
+        skipped = []
+        for upload in uploads:
+            content_hash = upload['sha256']
+            if content_hash in documents:
+                skipped.append({'filename': upload['filename'], 'reason': 'duplicate', 'duplicate_of': documents[content_hash]['filename']})
+                continue
+            documents[content_hash] = new_ingest_document(upload['filename'], upload['path'])
         
-        docs = vector_store.similarity_search(user_question)
+        if container_client:
+            for content_hash, document in documents.items():
+                document['registered'] = get_registered_document(container_client, content_hash) is not None
+        # Chunks of documents not yet in the shared index also go to the Azure segment, as they are embedded
+        new_hashes = {h for h, d in documents.items() if save_to_azure and not d['registered']}
         
-        chain = get_conversational_chain()
+        with ingest_jobs_lock:
+            ingest_jobs[job_id]['skipped_files'] = skipped
         
-        response = chain(
-            {"input_documents": docs, "question": user_question},
-            return_only_outputs=True
-        )
+        total_pages = sum(get_pdf_page_count(document['path']) for document in documents.values()) or 1
+        counts = {'pages': 0, 'chunks': 0, 'embedded': 0}
+        azure_store = None
         
-        return response["output_text"]
-
-# Save chat history
-def save_chat_history(user_question, response, mode='azure'):
-    today = datetime.now().strftime("%d-%m-%Y")
-    chat_file = f"chat_history/{today}_{mode}.json"
+        def on_page():
+            counts['pages'] += 1
+            if counts['pages'] % PDF_PAGES_PER_TASK == 0 or counts['pages'] == total_pages:
+                progress = counts['pages'] / total_pages
+                update_job_stage(job_id, 'extract', items=counts['pages'], progress=progress)
+                update_job_stage(job_id, 'chunk', items=counts['chunks'], progress=progress)
+        
+        def count_chunks(chunks):
+            for doc in chunks:
+                counts['chunks'] += 1
+                yield doc
+        
+        def on_batch(docs, vectors):
+            nonlocal azure_store
+            counts['embedded'] += len(docs)
+            update_job_stage(job_id, 'embed', items=counts['embedded'],
+                             progress=counts['embedded'] / counts['chunks'] * counts['pages'] / total_pages)
+            new_positions = [i for i, doc in enumerate(docs) if doc.metadata['sha256'] in new_hashes]
+            if new_positions:
+                azure_store = append_to_vector_store(azure_store, [docs[i] for i in new_positions],
+                                                     [vectors[i] for i in new_positions])
+        
+        # Extraction, chunking and embedding run as one pipeline, a batch at a time, so the three stages overlap
+        with job_stage(job_id, 'extract'), job_stage(job_id, 'chunk'), job_stage(job_id, 'embed'):
+            vector_store = index_document_chunks(count_chunks(iter_document_chunks(documents, on_page)), on_batch=on_batch)
+            update_job_stage(job_id, 'chunk', items=counts['chunks'])
+        
+        if vector_store is None:
+            raise ValueError("No text could be extracted from the uploaded files")
+        
+        with job_stage(job_id, 'save'):
+            # Create a unique directory for this session's vector store
+            vector_store_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id, "faiss_index")
+            cache_session_vector_store(vector_store_dir, save_session_vector_store(vector_store_dir, vector_store))
+            
+            get_session_store().update(
+                session_id,
+                vector_store_exists=True,
+                pdf_processed=True,
+                processed_files=[document['filename'] for document in documents.values()],
+                vector_store_path=vector_store_dir
+            )
+        
+        if save_to_azure:
+            with job_stage(job_id, 'azure'):
+                # Documents already in the shared index are neither re-uploaded nor re-indexed
+                new_documents = {h: d for h, d in documents.items() if h in new_hashes and d['chunks']}
+                with ingest_jobs_lock:
+                    ingest_jobs[job_id]['skipped_files'].extend(
+                        {'filename': d['filename'], 'reason': 'already_indexed'}
+                        for d in documents.values() if d['registered']
+                    )
+                
+                if new_documents:
+                    # Save PDFs to Azure
+                    for i, document in enumerate(new_documents.values()):
+                        upload_file_to_blob(container_client, f"pdfs/{document['filename']}", document['path'])
+                        update_job_stage(job_id, 'azure', items=i + 1, progress=0.5 * (i + 1) / len(new_documents))
+                    
+                    # The new documents' chunks were embedded once, by the pipeline above
+                    segment = append_vector_store_segment(azure_store, container_client)
+                    if segment is None:
+                        raise RuntimeError("Failed to save the vector store to Azure")
+                    update_job_stage(job_id, 'azure', progress=0.9)
+                    
+                    for content_hash, document in new_documents.items():
+                        register_document(container_client, {
+                            'sha256': content_hash,
+                            'filename': document['filename'],
+                            'pages': document['pages'],
+                            'chunks': document['chunks'],
+                            'chunk_ids': [f"{content_hash[:16]}-{i}" for i in range(document['chunks'])],
+                            'segment_id': segment['id'],
+                            'ingested_at': datetime.now().isoformat()
+                        })
+        
+        status, error = 'succeeded', None
+    except Exception as e:
+        print(f"Error processing ingestion job {job_id}: {str(e)}")
+        status, error = 'failed', str(e)
     
-    if os.path.exists(chat_file):
-        with open(chat_file, "r", encoding="utf-8") as f:
-            existing_history = json.load(f)
+    with ingest_jobs_lock:
+        job = ingest_jobs[job_id]
+        job.update(status=status, error=error, stage=None, finished_at=time.time())
+
+# Chat History
+def get_chat_history_db():
+    conn = getattr(chat_history_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(CHAT_HISTORY_DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        chat_history_local.conn = conn
+    return conn
+
+def init_chat_history_db():
+    conn = get_chat_history_db()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS turns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            day TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response TEXT NOT NULL,
+            asked_at TEXT NOT NULL,
+            answered_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session_id, mode, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS turns_by_day ON turns (mode, day, id)")
+    import_legacy_chat_history(conn)
+
+def import_legacy_chat_history(conn):
+    # One-off import of the old chat_history/<dd-mm-yyyy>_<mode>.json files (newest pair first)
+    for chat_file in sorted(glob.glob("chat_history/*_*.json")):
+        day, mode = os.path.basename(chat_file)[:-len(".json")].split("_", 1)
+        # Claiming the file by renaming it means only one worker process imports it
+        claimed_file = f"{chat_file}.importing-{os.getpid()}"
+        try:
+            os.replace(chat_file, claimed_file)
+        except FileNotFoundError:
+            continue
+        try:
+            with open(claimed_file, "r", encoding="utf-8") as f:
+                history = json.load(f)
+            
+            pairs = [history[i:i + 2] for i in range(0, len(history) - 1, 2)]
+            rows = [
+                ('', mode, day, user['content'], assistant['content'], user['timestamp'], assistant['timestamp'])
+                for user, assistant in reversed(pairs)
+            ]
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO turns (session_id, mode, day, question, response, asked_at, answered_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute("COMMIT")
+        except Exception as e:
+            # Put the file back, so the next start retries it; the app starts either way
+            print(f"Error importing chat history {chat_file}: {str(e)}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            os.replace(claimed_file, chat_file)
+            continue
+        os.replace(claimed_file, f"{chat_file}.imported")
+
+def turn_to_messages(question, response, asked_at, answered_at):
+    return [
+        {"role": "user", "content": question, "timestamp": asked_at},
+        {"role": "assistant", "content": response, "timestamp": answered_at}
+    ]
+
+@timed_stage('chat_history')
+def save_chat_history(user_question, response, mode='azure', session_id=None):
+    # Appends one turn and returns just that turn's two messages
+    now = datetime.now()
+    asked_at = answered_at = now.strftime("%H:%M:%S")
+    get_chat_history_db().execute(
+        "INSERT INTO turns (session_id, mode, day, question, response, asked_at, answered_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (session_id or '', mode, now.strftime("%d-%m-%Y"), user_question, response, asked_at, answered_at)
+    )
+    return turn_to_messages(user_question, response, asked_at, answered_at)
+
+def read_chat_history(mode, session_id=None, cursor=None, limit=CHAT_HISTORY_PAGE_SIZE):
+    # Newest turn first. Without a session id this is today's shared history, as before.
+    # Returns (messages, next_cursor); pass next_cursor back to get the next older page.
+    if session_id:
+        where, params = "session_id = ? AND mode = ?", [session_id, mode]
     else:
-        existing_history = []
+        where, params = "session_id = '' AND mode = ? AND day = ?", [mode, datetime.now().strftime("%d-%m-%Y")]
+    if cursor is not None:
+        where += " AND id < ?"
+        params.append(cursor)
     
-    new_pair = [
-        {"role": "user", "content": user_question, "timestamp": datetime.now().strftime("%H:%M:%S")},
-        {"role": "assistant", "content": response, "timestamp": datetime.now().strftime("%H:%M:%S")}
-    ]
+    rows = get_chat_history_db().execute(
+        f"SELECT id, question, response, asked_at, answered_at FROM turns WHERE {where} ORDER BY id DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
     
-    updated_history = new_pair + existing_history
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    messages = []
+    for _, question, response, asked_at, answered_at in rows[:limit]:
+        messages.extend(turn_to_messages(question, response, asked_at, answered_at))
+    return messages, next_cursor
+
+def clear_chat_history(mode, session_id=None):
+    if session_id:
+        get_chat_history_db().execute("DELETE FROM turns WHERE session_id = ? AND mode = ?", (session_id, mode))
+    else:
+        get_chat_history_db().execute(
+            "DELETE FROM turns WHERE session_id = '' AND mode = ? AND day = ?",
+            (mode, datetime.now().strftime("%d-%m-%Y"))
+        )
+
+init_chat_history_db()
+
+# Worker Startup
+def prewarm_clients():
+    # Imports LangChain, Groq and the embeddings client; the QA chain builds the LLM and the prompt
+    get_embeddings()
+    get_conversational_chain()
+    get_reranker()
+
+def prewarm_azure_index():
+    vector_store, message, _ = resolve_azure_vector_store()
+    if vector_store is None:
+        print(f"Prewarm skipped the Azure index: {message}")
+        return
+    # One search pages in the memory-mapped segment data it reads
+    vector_store.search_dense(np.zeros(vector_store.segments[0].index.d, dtype=np.float32), 1)
+
+def prewarm_ingestion():
+    # The imports left to the first upload: the text splitter and PyPDF2 (page counts are read in this process)
+    importlib.import_module("PyPDF2")
     
-    with open(chat_file, "w", encoding="utf-8") as f:
-        json.dump(updated_history, f, ensure_ascii=False, indent=2)
+    get_text_splitter()
+
+def run_prewarm():
+    started = time.perf_counter()
+    for name, step in (('clients', prewarm_clients), ('azure_index', prewarm_azure_index), ('ingestion', prewarm_ingestion)):
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Error prewarming {name}: {str(e)}")
+            with startup_lock:
+                startup_stats['errors'].append(f"{name}: {str(e)}")
+        with startup_lock:
+            startup_stats['steps'][name] = time.perf_counter() - step_started
     
-    return updated_history
+    seconds = time.perf_counter() - started
+    set_gauge('rag_startup_seconds', seconds, phase='prewarm')
+    with startup_lock:
+        startup_stats['prewarm_seconds'] = seconds
+        # Ready even if a step failed: requests build whatever prewarm could not, as they would without it
+        startup_stats['status'] = 'ready'
+
+def start_prewarm():
+    # Runs once this module is imported when PREWARM is on, or from a gunicorn post_fork hook with --preload
+    with startup_lock:
+        if startup_stats['status'] == 'warming':
+            return
+        startup_stats['status'] = 'warming'
+    startup_executor.submit(run_prewarm)
+
+def record_first_query(route, seconds):
+    # seconds: time to respond to the first question this worker answered
+    if route not in ('/api/query', '/api/query-batch'):
+        return
+    with startup_lock:
+        if startup_stats['first_query_seconds'] is not None:
+            return
+        since_import = time.perf_counter() - app_import_started
+        startup_stats['first_query_seconds'] = seconds
+        startup_stats['time_to_first_query_seconds'] = since_import
+    set_gauge('rag_startup_seconds', since_import, phase='first_query')
+
+def get_startup_stats():
+    with startup_lock:
+        stats = dict(startup_stats, steps=dict(startup_stats['steps']), errors=list(startup_stats['errors']))
+    stats['prewarm'] = PREWARM
+    return stats
+
+# Request Tracing
+@app.before_request
+def begin_request_trace():
+    start_request_trace()
+
+@app.after_request
+def end_request_trace(response):
+    trace = request_trace.get()
+    if trace is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    seconds = time.perf_counter() - trace['started']
+    observe_histogram('rag_request_seconds', seconds, route=route, method=request.method, status=str(response.status_code))
+    if response.status_code == 200:
+        record_first_query(route, seconds)
+    if SERVER_TIMING and not response.is_streamed:
+        response.headers['Server-Timing'] = format_server_timing(trace)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/ready', methods=['GET'])
+def ready_api():
+    # Readiness probe: 503 while this worker is still prewarming
+    stats = get_startup_stats()
+    return jsonify(stats), 200 if stats['status'] == 'ready' else 503
 
 # Routes for React Frontend
 
 @app.route('/api/start-session', methods=['POST'])
 def start_session():
-    session_id = str(uuid.uuid4())
-    client_sessions[session_id] = {
-        'pdf_processed': False,
-        'vector_store_exists': False,
-        'processed_files': [],
-        'vector_store_path': None
-    }
+    session_id = create_session()
     return jsonify({'status': 'success', 'session_id': session_id})
 
 @app.route('/api/upload', methods=['POST'])
 def upload_api():
-    session_id = request.form.get('session_id')
-    
-    # Check if session exists
-    if not session_id or session_id not in client_sessions:
-        session_id = str(uuid.uuid4())
-        client_sessions[session_id] = {
-            'pdf_processed': False,
-            'vector_store_exists': False,
-            'processed_files': [],
-            'vector_store_path': None
-        }
-    
-    # Handle file upload
-    if 'pdfs' not in request.files:
-        return jsonify({'status': 'error', 'message': 'No files uploaded', 'session_id': session_id})
-    
-    files = request.files.getlist('pdfs')
-    
-    if not files or files[0].filename == '':
-        return jsonify({'status': 'error', 'message': 'No files selected', 'session_id': session_id})
-    
-    processed_files = []
-    all_text = ""
-    
-    for file in files:
-        if file and file.filename.endswith('.pdf'):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            text = get_pdf_text(file_path)
-            all_text += text
-            processed_files.append(filename)
-    
-    if all_text:
-        text_chunks = get_text_chunks(all_text)
-        vector_store = get_vector_store(text_chunks)
+    # The body is streamed to disk while it is parsed, so request.form / request.files are not used here
+    try:
+        form, request_files, incoming_dir = receive_uploads()
+    except RequestEntityTooLarge:
+        return jsonify({
+            'status': 'error',
+            'message': f"Upload is larger than the session quota of {SESSION_MAX_BYTES // (1024 * 1024)} MiB"
+        }), 413
+    try:
+        session_id = form.get('session_id')
         
-        client_sessions[session_id]['vector_store_exists'] = True
-        client_sessions[session_id]['pdf_processed'] = True
-        client_sessions[session_id]['processed_files'] = processed_files
+        # Check if session exists
+        if not session_id or get_session_store().get(session_id) is None:
+            session_id = create_session()
         
-        # Save vector store
-        with tempfile.TemporaryDirectory() as temp_dir:
-            vector_store.save_local(temp_dir)
-            
-            # Create a unique directory for this session's vector store
-            session_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
-            os.makedirs(session_dir, exist_ok=True)
-            
-            # Save vector store in the session directory
-            vector_store_dir = os.path.join(session_dir, "faiss_index")
-            os.makedirs(vector_store_dir, exist_ok=True)
-            
-            # Copy index files from temp dir to session dir
-            with open(os.path.join(temp_dir, "index.faiss"), "rb") as f:
-                faiss_data = f.read()
-            with open(os.path.join(temp_dir, "index.pkl"), "rb") as f:
-                pkl_data = f.read()
-            
-            with open(os.path.join(vector_store_dir, "index.faiss"), "wb") as f:
-                f.write(faiss_data)
-            with open(os.path.join(vector_store_dir, "index.pkl"), "wb") as f:
-                f.write(pkl_data)
-            
-            client_sessions[session_id]['vector_store_path'] = vector_store_dir
-            
-            # Save to Azure if requested
-            if 'save_to_azure' in request.form and request.form['save_to_azure'] == 'true':
-                container_client = get_blob_client()
-                if container_client:
-                    # Save PDFs to Azure
-                    for filename in processed_files:
-                        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        with open(file_path, 'rb') as f:
-                            pdf_content = f.read()
-                            save_to_blob(container_client, f"pdfs/{filename}", pdf_content)
-                    
-                    # Save vector store to Azure
-                    merge_vector_stores(vector_store, container_client)
-                    
-                    # Update processed files list
-                    azure_processed_files = get_processed_files(container_client)
-                    for filename in processed_files:
-                        if filename not in azure_processed_files:
-                            azure_processed_files.append(filename)
-                    save_processed_files(container_client, azure_processed_files)
+        # Handle file upload
+        if 'pdfs' not in request_files:
+            return jsonify({'status': 'error', 'message': 'No files uploaded', 'session_id': session_id})
+        
+        files = request_files.getlist('pdfs')
+        
+        if not files or files[0].filename == '':
+            return jsonify({'status': 'error', 'message': 'No files selected', 'session_id': session_id})
         
+        # Only the upload itself happens on the request thread; the rest is a background job
+        pdf_files = [file for file in files if file and file.filename.endswith('.pdf')]
+        quota_error = check_session_quota(session_id, pdf_files)
+        if quota_error:
+            return jsonify({'status': 'error', 'message': quota_error, 'session_id': session_id}), 413
+        uploads = [store_session_upload(session_id, file) for file in pdf_files]
+    finally:
+        # Parts that were not kept (other fields, non-PDF files) are deleted with the directory
+        for _, file in request_files.items(multi=True):
+            file.close()
+        shutil.rmtree(incoming_dir, ignore_errors=True)
+    
+    processed_files = [upload['filename'] for upload in uploads]
+    if not processed_files:
+        return jsonify({
+            'status': 'error', 
+            'message': 'Failed to process files',
+            'session_id': session_id
+        })
+    
+    save_to_azure = form.get('save_to_azure') == 'true'
+    job_id, future = submit_ingest_job(session_id, uploads, save_to_azure)
+    
+    # wait=true keeps the old blocking behaviour for scripts
+    if form.get('wait') == 'true':
+        future.result()
+        job = get_ingest_job(job_id)
         return jsonify({
-            'status': 'success', 
-            'message': f"Processed {len(processed_files)} files",
+            'status': 'success' if job['status'] == 'succeeded' else 'error',
+            'message': job['error'] or f"Processed {len(processed_files)} files",
             'session_id': session_id,
+            'job_id': job_id,
             'processed_files': processed_files
         })
     
     return jsonify({
-        'status': 'error', 
-        'message': 'Failed to process files',
-        'session_id': session_id
+        'status': 'success', 
+        'message': f"Queued {len(processed_files)} files for processing",
+        'session_id': session_id,
+        'job_id': job_id,
+        'processed_files': processed_files
     })
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status_api(job_id):
+    job = get_ingest_job(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'})
+    
+    return jsonify({'status': 'success', 'job': job})
+
 @app.route('/api/query', methods=['POST'])
 def query_api():
     data = request.json
@@ -358,38 +2993,66 @@ def query_api():
     if not user_question:
         return jsonify({'status': 'error', 'message': 'No question provided'})
     
+    search_kwargs = get_search_kwargs(data)
+    if search_kwargs is None:
+        return jsonify({'status': 'error', 'message': 'k, nprobe and ef_search must be integers'})
+    
     if mode == 'upload':
-        if session_id and session_id in client_sessions and client_sessions[session_id].get('pdf_processed', False):
-            # Use the session's vector store
-            vector_store_dir = client_sessions[session_id].get('vector_store_path')
-            if vector_store_dir and os.path.exists(vector_store_dir):
-                embeddings = GoogleGenerativeAIEmbeddings(model='models/embedding-001')
-                try:
-                    vector_store = FAISS.load_local(vector_store_dir, embeddings, allow_dangerous_deserialization=True)
-                    response = query_local_vector_store(user_question, vector_store)
-                except Exception as e:
-                    response = f"Error loading vector store: {str(e)}"
-            else:
-                response = "Error loading vector store. Please process PDFs again."
-        else:
-            response = "Please upload and process PDF files first."
+        vector_store, message, index_key = resolve_session_vector_store(session_id)
     else:  # Azure mode
-        container_client = get_blob_client()
-        if not container_client:
-            response = "Failed to connect to Azure Storage. Please check your connection string and container name."
-        elif not blob_exists(container_client, VECTOR_STORE_PATH):
-            response = "No documents have been stored in Azure Storage yet. Please upload and save documents first."
-        else:
-            response = query_azure_vector_store(user_question, container_client)
+        vector_store, message, index_key = resolve_azure_vector_store()
     
-    # Save chat history
-    chat_history = save_chat_history(user_question, response, mode)
+    if search_kwargs:
+        # Answers found with a non-default k or search effort are neither served from nor stored in the cache
+        index_key = None
     
-    return jsonify({
+    if wants_stream(data):
+        return stream_query_response(user_question, vector_store, message, mode, session_id, index_key, search_kwargs, wants_debug(data))
+    
+    response, context = (message, None) if vector_store is None else answer_question(user_question, vector_store, index_key, search_kwargs)
+    
+    # Save chat history; only the new turn is returned
+    chat_history = save_chat_history(user_question, response, mode, session_id)
+    
+    result = {
         'status': 'success',
         'response': response,
-        'chat_history': chat_history
-    })
+        'chat_history': chat_history,
+        'context': context
+    }
+    if wants_debug(data):
+        result['timings'] = get_trace_breakdown(request_trace.get())
+    return jsonify(result)
+
+@app.route('/api/query-batch', methods=['POST'])
+def query_batch_api():
+    data = request.json
+    user_questions = data.get('questions')
+    mode = data.get('mode', 'upload')
+    session_id = data.get('session_id')
+    
+    valid = isinstance(user_questions, list) and all(isinstance(question, str) and question.strip() for question in user_questions)
+    if not valid or not user_questions:
+        return jsonify({'status': 'error', 'message': 'questions must be a non-empty list of strings'})
+    if len(user_questions) > QUERY_BATCH_MAX_QUESTIONS:
+        return jsonify({'status': 'error', 'message': f"At most {QUERY_BATCH_MAX_QUESTIONS} questions per batch"})
+    
+    search_kwargs = get_search_kwargs(data)
+    if search_kwargs is None:
+        return jsonify({'status': 'error', 'message': 'k, nprobe and ef_search must be integers'})
+    
+    if mode == 'upload':
+        vector_store, message, index_key = resolve_session_vector_store(session_id)
+    else:  # Azure mode
+        vector_store, message, index_key = resolve_azure_vector_store()
+    if vector_store is None:
+        return jsonify({'status': 'error', 'message': message})
+    
+    if search_kwargs:
+        index_key = None
+    
+    # Batches are not conversations: nothing is written to the chat history
+    return stream_batch_response(user_questions, vector_store, index_key, search_kwargs, wants_debug(data))
 
 @app.route('/api/azure-files', methods=['GET'])
 def azure_files_api():
@@ -407,32 +3070,37 @@ def azure_files_api():
             'message': 'Failed to connect to Azure Storage'
         })
 
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats_api():
+    return jsonify({
+        'status': 'success',
+        'azure_index': get_azure_index_cache_stats(),
+        'session_stores': get_session_cache_stats(),
+        'embeddings': get_embeddings().get_stats(),
+        'answers': get_answer_cache_stats(),
+        'sessions': get_session_gc_stats()
+    })
+
 @app.route('/api/chat-history', methods=['GET'])
 def get_chat_history():
     mode = request.args.get('mode', 'azure')
-    today = datetime.now().strftime("%d-%m-%Y")
-    chat_file = f"chat_history/{today}_{mode}.json"
+    session_id = request.args.get('session_id')
+    cursor = request.args.get('cursor', type=int)
+    limit = min(request.args.get('limit', CHAT_HISTORY_PAGE_SIZE, type=int), 500)
     
-    if os.path.exists(chat_file):
-        with open(chat_file, "r", encoding="utf-8") as f:
-            chat_history = json.load(f)
-    else:
-        chat_history = []
+    chat_history, next_cursor = read_chat_history(mode, session_id, cursor, limit)
     
     return jsonify({
         'status': 'success',
-        'chat_history': chat_history
+        'chat_history': chat_history,
+        'next_cursor': next_cursor
     })
 
 @app.route('/api/clear-chat', methods=['POST'])
 def clear_chat_api():
     data = request.json
     mode = data.get('mode', 'azure')
-    today = datetime.now().strftime("%d-%m-%Y")
-    chat_file = f"chat_history/{today}_{mode}.json"
-    
-    if os.path.exists(chat_file):
-        os.remove(chat_file)
+    clear_chat_history(mode, data.get('session_id'))
     
     return jsonify({
         'status': 'success',
@@ -448,27 +3116,14 @@ def index():
 def upload():
     if request.method == 'GET':
         # Get chat history for upload page
-        mode = 'upload'
-        today = datetime.now().strftime("%d-%m-%Y")
-        chat_file = f"chat_history/{today}_{mode}.json"
-        
-        if os.path.exists(chat_file):
-            with open(chat_file, "r", encoding="utf-8") as f:
-                chat_history = json.load(f)
-        else:
-            chat_history = []
+        chat_history, _ = read_chat_history('upload')
         
         return render_template('upload.html', chat_history=chat_history)
     
     elif request.method == 'POST':
         if 'action' in request.form and request.form['action'] == 'clear':
             # Clear chat history
-            mode = 'upload'
-            today = datetime.now().strftime("%d-%m-%Y")
-            chat_file = f"chat_history/{today}_{mode}.json"
-            
-            if os.path.exists(chat_file):
-                os.remove(chat_file)
+            clear_chat_history('upload')
             
             return redirect(url_for('upload'))
         
@@ -482,7 +3137,7 @@ def upload():
             return jsonify({'status': 'error', 'message': 'No files selected'})
         
         processed_files = []
-        all_text = ""
+        documents = {}
         
         for file in files:
             if file and file.filename.endswith('.pdf'):
@@ -490,45 +3145,70 @@ def upload():
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(file_path)
                 
-                text = get_pdf_text(file_path)
-                all_text += text
+                documents.setdefault(hash_file(file_path), new_ingest_document(filename, file_path))
                 processed_files.append(filename)
         
-        if all_text:
-            text_chunks = get_text_chunks(all_text)
-            vector_store = get_vector_store(text_chunks)
-            
+        save_to_azure = 'save_to_azure' in request.form and request.form['save_to_azure'] == 'true'
+        container_client = get_blob_client() if save_to_azure else None
+        # As in run_ingest_job, only documents not yet in the shared index go to the Azure segment
+        new_hashes = {h for h in documents if container_client and get_registered_document(container_client, h) is None}
+        azure_store = None
+        
+        def on_batch(docs, vectors):
+            nonlocal azure_store
+            new_positions = [i for i, doc in enumerate(docs) if doc.metadata['sha256'] in new_hashes]
+            if new_positions:
+                azure_store = append_to_vector_store(azure_store, [docs[i] for i in new_positions],
+                                                     [vectors[i] for i in new_positions])
+        
+        vector_store = index_document_chunks(iter_document_chunks(documents), on_batch=on_batch)
+        if vector_store is not None:
             session['vector_store_exists'] = True
             session['pdf_processed'] = True
             session['processed_files'] = processed_files
             
-            # Save vector store
-            with tempfile.TemporaryDirectory() as temp_dir:
-                vector_store.save_local(temp_dir)
-                
-                vector_store_file = os.path.join(temp_dir, "faiss_index")
-                session['vector_store_path'] = vector_store_file
+            # Keep the index in a session directory, as /api/upload does, so /query can load (and stream from) it
+            session_id = session.get('session_id')
+            if not session_id or get_session_store().get(session_id) is None:
+                session_id = create_session()
+                session['session_id'] = session_id
+            
+            vector_store_dir = os.path.join(get_session_dir(session_id), "faiss_index")
+            cache_session_vector_store(vector_store_dir, save_session_vector_store(vector_store_dir, vector_store))
+            get_session_store().update(
+                session_id,
+                vector_store_exists=True,
+                pdf_processed=True,
+                processed_files=processed_files,
+                vector_store_path=vector_store_dir
+            )
+            
+            # Save to Azure if requested
+            if container_client:
+                # Documents already in the shared index are neither re-uploaded nor re-indexed
+                new_documents = {h: d for h, d in documents.items() if h in new_hashes and d['chunks']}
                 
-                # Save to Azure if requested
-                if 'save_to_azure' in request.form and request.form['save_to_azure'] == 'true':
-                    container_client = get_blob_client()
-                    if container_client:
-                        # Save PDFs to Azure
-                        for filename in processed_files:
-                            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                            with open(file_path, 'rb') as f:
-                                pdf_content = f.read()
-                                save_to_blob(container_client, f"pdfs/{filename}", pdf_content)
-                        
-                        # Save vector store to Azure
-                        merge_vector_stores(vector_store, container_client)
-                        
-                        # Update processed files list
-                        azure_processed_files = get_processed_files(container_client)
-                        for filename in processed_files:
-                            if filename not in azure_processed_files:
-                                azure_processed_files.append(filename)
-                        save_processed_files(container_client, azure_processed_files)
+                if new_documents:
+                    # Save vector store to Azure; the new documents' chunks were embedded once, above
+                    segment = merge_vector_stores(azure_store, container_client)
+                    if segment is None:
+                        # Nothing is registered, so a retry indexes these documents again
+                        return jsonify({'status': 'error', 'message': 'Failed to save the vector store to Azure'})
+                    
+                    # Save PDFs to Azure
+                    for document in new_documents.values():
+                        upload_file_to_blob(container_client, f"pdfs/{document['filename']}", document['path'])
+                    
+                    for content_hash, document in new_documents.items():
+                        register_document(container_client, {
+                            'sha256': content_hash,
+                            'filename': document['filename'],
+                            'pages': document['pages'],
+                            'chunks': document['chunks'],
+                            'chunk_ids': [f"{content_hash[:16]}-{i}" for i in range(document['chunks'])],
+                            'segment_id': segment['id'],
+                            'ingested_at': datetime.now().isoformat()
+                        })
             
             return jsonify({'status': 'success', 'message': f"Processed {len(processed_files)} files"})
         
@@ -544,29 +3224,14 @@ def query():
     mode = request.form.get('mode', 'upload')
     
     if mode == 'upload':
-        if not session.get('pdf_processed', False):
-            response = "Please upload and process PDF files first."
-        else:
-            # Query local vector store
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Reconstruct vector store
-                vector_store_file = session.get('vector_store_path')
-                if vector_store_file:
-                    embeddings = GoogleGenerativeAIEmbeddings(model='models/embedding-001')
-                    vector_store = FAISS.load_local(temp_dir, embeddings)
-                    response = query_local_vector_store(user_question, vector_store)
-                else:
-                    response = "Error loading vector store. Please process PDFs again."
+        # The /upload route keeps its index in a session directory, like /api/upload
+        vector_store, message, index_key = resolve_session_vector_store(session.get('session_id'))
     else:  # Azure mode
-        container_client = get_blob_client()
-        if not container_client:
-            response = "Failed to connect to Azure Storage. Please check your connection string and container name."
-        elif not blob_exists(container_client, VECTOR_STORE_PATH):
-            response = "No documents have been stored in Azure Storage yet. Please upload and save documents first."
-        else:
-            response = query_azure_vector_store(user_question, container_client)
+        vector_store, message, index_key = resolve_azure_vector_store()
     
-    # Save chat history
+    if wants_stream(request.form):
+        return stream_query_response(user_question, vector_store, message, mode, index_key=index_key)
+    response = message if vector_store is None else query_local_vector_store(user_question, vector_store, index_key)
     chat_history = save_chat_history(user_question, response, mode)
     
     return jsonify({
@@ -578,15 +3243,7 @@ def query():
 @app.route('/azure')
 def azure_chat():
     # Get chat history for azure page
-    mode = 'azure'
-    today = datetime.now().strftime("%d-%m-%Y")
-    chat_file = f"chat_history/{today}_{mode}.json"
-    
-    if os.path.exists(chat_file):
-        with open(chat_file, "r", encoding="utf-8") as f:
-            chat_history = json.load(f)
-    else:
-        chat_history = []
+    chat_history, _ = read_chat_history('azure')
     
     container_client = get_blob_client()
     if container_client:
@@ -599,14 +3256,17 @@ def azure_chat():
 
 @app.route('/clear-azure-history', methods=['POST'])
 def clear_azure_history():
-    mode = 'azure'
-    today = datetime.now().strftime("%d-%m-%Y")
-    chat_file = f"chat_history/{today}_{mode}.json"
-    
-    if os.path.exists(chat_file):
-        os.remove(chat_file)
+    clear_chat_history('azure')
     
     return redirect(url_for('azure_chat'))
 
+startup_stats['import_seconds'] = time.perf_counter() - app_import_started
+set_gauge('rag_startup_seconds', startup_stats['import_seconds'], phase='import')
+# Only the serving process prewarms: spawned processes of `python app.py` re-run this module as __mp_main__
+if PREWARM and multiprocessing.parent_process() is None:
+    start_prewarm()
+else:
+    startup_stats['status'] = 'ready'
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,379 @@
+# asgi.py
+# Async serving mode. /api/query and /api/azure-files run on the event loop with async Azure,
+# embeddings and Groq clients, so one worker holds hundreds of in-flight questions instead of
+# one per thread. Every other route (including /api/upload) is served by the Flask app.
+#
+#   uvicorn asgi:application --workers 1
+#
+# Requires asgiref, uvicorn and aiohttp (for azure.storage.blob.aio); app.py runs without them.
+import asyncio
+import json
+import pickle
+import time
+
+from asgiref import __version__ as asgiref_version
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from azure.core.exceptions import ResourceNotFoundError
+
+from app import (
+    app, AZURE_CONNECTION_STRING, CONTAINER_NAME, AZURE_INDEX_CHECK_INTERVAL, VECTOR_STORE_MANIFEST_PATH,
+    VECTOR_STORE_PATH, PROCESSED_FILES_LIST_PATH, DOCUMENT_REGISTRY_PREFIX, ANSWER_CACHE_SEMANTIC_THRESHOLD,
+    azure_index_cache, azure_index_stats_lock, get_blob_client, refresh_azure_vector_store,
+    resolve_session_vector_store, get_search_kwargs, retrieve_context, get_embeddings, get_llm, get_prompt, get_conversational_chain,
+    lookup_cached_answer, find_similar_answer, store_cached_answer, save_chat_history, wants_stream, wants_debug, sse_event,
+    SERVER_TIMING, request_trace, start_request_trace, timed_stage, record_blob_bytes, observe_histogram,
+    get_trace_breakdown, format_server_timing, LLMUsageCallback, record_first_query,
+    close_async_resources
+)
+
+async_clients = {}
+
+# Flask Bridge
+# asgiref runs every WSGI call on one shared thread by default; the Flask routes are thread-safe,
+# so bridged requests get a thread each, as they would under a threaded WSGI server.
+# That means re-wrapping WsgiToAsgiInstance.run_wsgi_app, an asgiref internal: checked against the
+# asgiref version pinned in README.md ("Async serving mode"), and any other layout falls back to the
+# stock single-thread bridge with a warning rather than failing or changing behaviour unnoticed.
+# The request body (e.g. an /api/upload multipart form) is read on the event loop first either way.
+ASGIREF_VERSION = "3.12.1"
+
+def get_sync_run_wsgi_app():
+    # The plain function behind asgiref's @sync_to_async run_wsgi_app, or None if asgiref changed
+    wrapper = WsgiToAsgiInstance.__dict__.get('run_wsgi_app')
+    func = getattr(wrapper, 'func', None)
+    if asgiref_version != ASGIREF_VERSION or not callable(func):
+        return None
+    return func
+
+sync_run_wsgi_app = get_sync_run_wsgi_app()
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    if sync_run_wsgi_app is not None:
+        run_wsgi_app = sync_to_async(sync_run_wsgi_app, thread_sensitive=False)
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+if sync_run_wsgi_app is not None:
+    flask_application = ThreadedWsgiToAsgi(app)
+else:
+    print(f"asgiref {asgiref_version} is not the tested {ASGIREF_VERSION}; "
+          f"Flask routes share asgiref's single WSGI thread (pip install asgiref=={ASGIREF_VERSION})")
+    flask_application = WsgiToAsgi(app)
+
+# Async Azure Client
+def get_async_blob_client():
+    container_client = async_clients.get('container')
+    if container_client is not None:
+        return container_client
+    try:
+        from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+        service_client = AsyncBlobServiceClient.from_connection_string(AZURE_CONNECTION_STRING)
+        container_client = service_client.get_container_client(CONTAINER_NAME)
+    except Exception as e:
+        print(f"Error connecting to Azure Blob Storage: {str(e)}")
+        return None
+    async_clients['service'] = service_client
+    async_clients['container'] = container_client
+    return container_client
+
+async def close_async_clients():
+    service_client = async_clients.pop('service', None)
+    async_clients.pop('container', None)
+    if service_client is not None:
+        await service_client.close()
+    # Also the Groq client's async connection pool (app.build_llm)
+    await close_async_resources()
+
+async def get_blob_etag(container_client, blob_path):
+    try:
+        properties = await container_client.get_blob_client(blob_path).get_blob_properties()
+        return properties.etag
+    except ResourceNotFoundError:
+        return None
+
+async def download_from_blob(container_client, blob_path):
+    try:
+        with timed_stage('blob_download'):
+            downloader = await container_client.get_blob_client(blob_path).download_blob()
+            data = await downloader.readall()
+        record_blob_bytes('download', len(data))
+        return data
+    except ResourceNotFoundError:
+        return None
+
+async def get_processed_files(container_client):
+    # Same listing as app.get_processed_files; the legacy list downloads while the registry is paged
+    legacy_download = asyncio.ensure_future(download_from_blob(container_client, PROCESSED_FILES_LIST_PATH))
+    try:
+        processed_files = [
+            blob.metadata.get('filename') async for blob in
+            container_client.list_blobs(name_starts_with=DOCUMENT_REGISTRY_PREFIX, include=['metadata'])
+        ]
+    finally:
+        legacy_data = await legacy_download
+    known = set(processed_files)
+    legacy_files = pickle.loads(legacy_data) if legacy_data else []
+    processed_files.extend(filename for filename in legacy_files if filename not in known)
+    return processed_files
+
+# Async Query Path
+async def get_azure_index_version(container_client):
+    etag = await get_blob_etag(container_client, VECTOR_STORE_MANIFEST_PATH)
+    if etag is not None:
+        return etag
+    legacy_etag = await get_blob_etag(container_client, VECTOR_STORE_PATH)
+    return f"legacy:{legacy_etag}" if legacy_etag else None
+
+async def get_azure_vector_store(container_client):
+    # Mirrors app.get_azure_vector_store with an async HEAD; returns (etag, vector_store)
+    entry = azure_index_cache['entry']
+    now = time.monotonic()
+
+    if entry is not None and now - azure_index_cache['checked_at'] < AZURE_INDEX_CHECK_INTERVAL:
+        with azure_index_stats_lock:
+            azure_index_cache['hits'] += 1
+        return entry
+
+    try:
+        etag = await get_azure_index_version(container_client)
+    except Exception as e:
+        print(f"Error checking Azure vector store version: {str(e)}")
+        with azure_index_stats_lock:
+            azure_index_cache['errors'] += 1
+        return entry if entry is not None else (None, None)
+
+    with azure_index_stats_lock:
+        azure_index_cache['checks'] += 1
+        azure_index_cache['checked_at'] = now
+
+    if etag is None:
+        return None, None
+
+    if entry is not None and entry[0] == etag:
+        with azure_index_stats_lock:
+            azure_index_cache['hits'] += 1
+        return entry
+
+    # A new version downloads and maps segments, which is blocking work for a thread
+    vector_store = await asyncio.to_thread(refresh_azure_vector_store, get_blob_client(), etag)
+    entry = azure_index_cache['entry']
+    return (entry[0], vector_store) if entry is not None and entry[1] is vector_store else (None, vector_store)
+
+async def resolve_azure_vector_store():
+    container_client = get_async_blob_client()
+    if not container_client:
+        return None, "Failed to connect to Azure Storage. Please check your connection string and container name.", None
+
+    etag, vector_store = await get_azure_vector_store(container_client)
+    if vector_store is None:
+        return None, "No documents have been stored in Azure Storage yet. Please upload and save documents first.", None
+    return vector_store, None, ('azure', etag) if etag is not None else None
+
+async def find_cached_answer(index_key, user_question):
+    entry = lookup_cached_answer(index_key, user_question)
+    if entry is not None:
+        return entry, None
+
+    embedding = await get_embeddings().aembed_query(user_question) if ANSWER_CACHE_SEMANTIC_THRESHOLD else None
+    return find_similar_answer(index_key, embedding), embedding
+
+async def retrieve_documents(user_question, vector_store, embedding=None, search_kwargs=None):
+    # Returns (documents for the prompt, context counts, question embedding)
+    if embedding is None:
+        embedding = await get_embeddings().aembed_query(user_question)
+    # FAISS releases the GIL while searching; the docstore may read from disk and reranking is CPU-bound
+    return await asyncio.to_thread(retrieve_context, user_question, vector_store, embedding, search_kwargs)
+
+async def answer_question(user_question, vector_store, index_key=None, search_kwargs=None):
+    embedding = None
+    if index_key is not None:
+        cached, embedding = await find_cached_answer(index_key, user_question)
+        if cached is not None:
+            return cached['response'], dict(cached['context'] or {}, cached=True)
+
+    docs, context, embedding = await retrieve_documents(user_question, vector_store, embedding, search_kwargs)
+    with timed_stage('llm'):
+        response = await get_conversational_chain().ainvoke({"input_documents": docs, "question": user_question},
+                                                            config={'callbacks': [LLMUsageCallback()]})
+
+    if index_key is not None:
+        store_cached_answer(index_key, user_question, embedding, response["output_text"], docs, context)
+    return response["output_text"], context
+
+async def stream_answer(user_question, docs):
+    context = "\n\n".join(doc.page_content for doc in docs)
+
+    with timed_stage('llm'):
+        prompt = get_prompt().format(context=context, question=user_question)
+        async for chunk in get_llm().astream(prompt, config={'callbacks': [LLMUsageCallback()]}):
+            if chunk.content:
+                yield chunk.content
+
+async def stream_query_response(user_question, vector_store, message, mode, session_id=None, index_key=None, search_kwargs=None, debug=False):
+    # Same events as app.stream_query_response: sources, token*, done
+    parts = []
+    context = None
+    cached, embedding = (None, None) if vector_store is None or index_key is None else await find_cached_answer(index_key, user_question)
+    if vector_store is None:
+        yield sse_event('sources', {'sources': []})
+        parts.append(message)
+        yield sse_event('token', {'token': message})
+    elif cached is not None:
+        context = dict(cached['context'] or {}, cached=True)
+        yield sse_event('sources', {'sources': cached['sources'], 'context': context})
+        parts.append(cached['response'])
+        yield sse_event('token', {'token': cached['response']})
+    else:
+        docs, context, embedding = await retrieve_documents(user_question, vector_store, embedding, search_kwargs)
+        yield sse_event('sources', {
+            'sources': [{'content': doc.page_content, 'metadata': doc.metadata} for doc in docs],
+            'context': context
+        })
+        try:
+            async for token in stream_answer(user_question, docs):
+                parts.append(token)
+                yield sse_event('token', {'token': token})
+            if index_key is not None:
+                store_cached_answer(index_key, user_question, embedding, "".join(parts), docs, context)
+        except Exception as e:
+            yield sse_event('error', {'message': str(e)})
+
+    response = "".join(parts)
+    chat_history = await asyncio.to_thread(save_chat_history, user_question, response, mode, session_id)
+    done = {'status': 'success', 'response': response, 'chat_history': chat_history, 'context': context}
+    if debug:
+        done['timings'] = get_trace_breakdown(request_trace.get())
+    yield sse_event('done', done)
+
+# ASGI Plumbing
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if not message.get('more_body'):
+            return bytes(body)
+
+def response_headers(content_type, extra=()):
+    # The Flask routes get CORS headers from flask_cors; the native routes set them here
+    return [(b'content-type', content_type), (b'access-control-allow-origin', b'*'), *extra]
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': response_headers(b'application/json', [(b'content-length', str(len(body)).encode())])})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_event_stream(send, events):
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': response_headers(b'text/event-stream', [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')])})
+    async for event in events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+# Routes
+async def query_api(scope, receive, send):
+    try:
+        data = json.loads(await read_body(receive) or b'null')
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return await send_json(send, {'status': 'error', 'message': 'Request body must be a JSON object'}, 400)
+
+    user_question = data.get('question')
+    mode = data.get('mode', 'upload')
+    session_id = data.get('session_id')
+
+    if not user_question:
+        return await send_json(send, {'status': 'error', 'message': 'No question provided'})
+
+    search_kwargs = get_search_kwargs(data)
+    if search_kwargs is None:
+        return await send_json(send, {'status': 'error', 'message': 'k, nprobe and ef_search must be integers'})
+
+    if mode == 'upload':
+        # Reads the index from disk on a cache miss
+        vector_store, message, index_key = await asyncio.to_thread(resolve_session_vector_store, session_id)
+    else:  # Azure mode
+        vector_store, message, index_key = await resolve_azure_vector_store()
+
+    if search_kwargs:
+        index_key = None
+
+    if wants_stream(data):
+        return await send_event_stream(send, stream_query_response(user_question, vector_store, message, mode, session_id, index_key, search_kwargs, wants_debug(data)))
+
+    response, context = (message, None) if vector_store is None else await answer_question(user_question, vector_store, index_key, search_kwargs)
+
+    # Save chat history; only the new turn is returned
+    chat_history = await asyncio.to_thread(save_chat_history, user_question, response, mode, session_id)
+
+    result = {
+        'status': 'success',
+        'response': response,
+        'chat_history': chat_history,
+        'context': context
+    }
+    if wants_debug(data):
+        result['timings'] = get_trace_breakdown(request_trace.get())
+    await send_json(send, result)
+
+async def azure_files_api(scope, receive, send):
+    container_client = get_async_blob_client()
+    if container_client:
+        processed_files = await get_processed_files(container_client)
+        await send_json(send, {
+            'status': 'success',
+            'files_count': len(processed_files) if processed_files else 0,
+            'files': processed_files
+        })
+    else:
+        await send_json(send, {
+            'status': 'error',
+            'message': 'Failed to connect to Azure Storage'
+        })
+
+# /api/upload stays on the Flask route: its body is read here on the event loop, and the handler
+# only writes the files and queues the ingest job, whose blob uploads run on the ingest workers
+async_routes = {
+    ('POST', '/api/query'): query_api,
+    ('GET', '/api/azure-files'): azure_files_api,
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = async_routes.get((scope.get('method'), scope.get('path')))
+    if route is None:
+        return await flask_application(scope, receive, send)
+
+    # Same request metric and Server-Timing header as the Flask after_request hook
+    trace = start_request_trace()
+
+    async def send_traced(message):
+        if message['type'] == 'http.response.start':
+            seconds = time.perf_counter() - trace['started']
+            observe_histogram('rag_request_seconds', seconds, route=scope['path'], method=scope['method'], status=str(message['status']))
+            if message['status'] == 200:
+                record_first_query(scope['path'], seconds)
+            headers = dict(message['headers'])
+            if SERVER_TIMING and headers.get(b'content-type') != b'text/event-stream':
+                message = dict(message, headers=[*message['headers'], (b'server-timing', format_server_timing(trace).encode())])
+        await send(message)
+
+    await route(scope, receive, send_traced)
@@ -0,0 +1,115 @@
+# benchmarks/ann_recall.py
+# Recall-vs-latency report for the ANN index types against the exact (flat) index.
+#
+#   python benchmarks/ann_recall.py --synthetic 200000 --dimension 768
+#   python benchmarks/ann_recall.py --azure            (vectors of the live Azure index)
+#
+# Recall@k is the fraction of the exact top-k that the ANN index also returns.
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import build_segment_index, get_search_parameters, get_index_vectors  # noqa: E402
+
+SWEEPS = {
+    'ivf_flat': ('nprobe', [1, 4, 16, 64]),
+    'ivf_pq': ('nprobe', [1, 4, 16, 64]),
+    'hnsw': ('ef_search', [16, 32, 64, 128]),
+}
+
+
+def synthetic_vectors(count, dimension, clusters=1000, seed=0):
+    # Clustered like real embeddings, so ANN recall is not judged on uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.3 * rng.standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def azure_vectors():
+    from app import get_blob_client, read_manifest, load_segment
+    container_client = get_blob_client()
+    if not container_client:
+        raise SystemExit("Failed to connect to Azure Storage. Please check your connection string and container name.")
+    manifest, _ = read_manifest(container_client)
+    return np.vstack([get_index_vectors(load_segment(container_client, segment).index) for segment in manifest['segments']])
+
+
+def search_one_by_one(index, queries, k, params):
+    # One query per call, like /api/query
+    latencies, positions = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, found = index.search(query[None, :], k, params=params)
+        latencies.append(time.perf_counter() - started)
+        positions.append(found[0])
+    return np.array(positions), np.array(latencies)
+
+
+def recall_at_k(found, exact):
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)]))
+
+
+def run(vectors, query_count, k, index_types):
+    faiss.omp_set_num_threads(1)
+    rng = np.random.default_rng(1)
+    # Queries are perturbed corpus vectors: close to the data, like real questions about it
+    queries = vectors[rng.choice(len(vectors), query_count, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    flat = build_segment_index(vectors, 'flat')
+    exact, flat_latencies = search_one_by_one(flat, queries, k, None)
+    rows = [{
+        'index_type': 'flat', 'parameter': None, 'value': None, 'recall': 1.0,
+        'mean_ms': round(flat_latencies.mean() * 1000, 3), 'p95_ms': round(np.percentile(flat_latencies, 95) * 1000, 3),
+        'index_bytes': faiss.serialize_index(flat).nbytes, 'build_seconds': None,
+    }]
+
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = build_segment_index(vectors, index_type)
+        build_seconds = round(time.perf_counter() - started, 2)
+        index_bytes = faiss.serialize_index(index).nbytes
+        parameter, values = SWEEPS[index_type]
+        for value in values:
+            params = get_search_parameters(index, **{parameter: value})
+            found, latencies = search_one_by_one(index, queries, k, params)
+            rows.append({
+                'index_type': index_type, 'parameter': parameter, 'value': value,
+                'recall': round(recall_at_k(found, exact), 4),
+                'mean_ms': round(latencies.mean() * 1000, 3), 'p95_ms': round(np.percentile(latencies, 95) * 1000, 3),
+                'index_bytes': index_bytes, 'build_seconds': build_seconds,
+            })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ANN recall-vs-latency report against the exact index.")
+    parser.add_argument('--azure', action='store_true', help="use the vectors of the live Azure index")
+    parser.add_argument('--synthetic', type=int, default=100000, help="number of synthetic vectors (default 100000)")
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--index-types', nargs='+', default=list(SWEEPS), choices=list(SWEEPS))
+    parser.add_argument('--output', help="also write the rows to this JSON file")
+    args = parser.parse_args()
+
+    vectors = azure_vectors() if args.azure else synthetic_vectors(args.synthetic, args.dimension)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dimensions, {args.queries} queries, recall@{args.k}")
+    rows = run(vectors, args.queries, args.k, args.index_types)
+
+    print(f"{'index':<9} {'param':<14} {'recall':>7} {'mean ms':>9} {'p95 ms':>9} {'MB':>8} {'build s':>8}")
+    for row in rows:
+        param = f"{row['parameter']}={row['value']}" if row['parameter'] else '-'
+        build = '-' if row['build_seconds'] is None else row['build_seconds']
+        print(f"{row['index_type']:<9} {param:<14} {row['recall']:>7.4f} {row['mean_ms']:>9.3f} {row['p95_ms']:>9.3f} "
+              f"{row['index_bytes'] / 1e6:>8.1f} {build:>8}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,89 @@
+# benchmarks/load_test.py
+# Fires concurrent /api/query requests at a running server and reports throughput and latency.
+# Run it against both serving modes with the same settings to compare them:
+#
+#   gunicorn -w 1 --threads 16 app:app -b :5000        (threaded WSGI)
+#   uvicorn asgi:application --workers 1 --port 5000   (async, see asgi.py)
+#
+#   python benchmarks/load_test.py --url http://localhost:5000 --mode azure --concurrency 16 64 256
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+async def run_level(url, concurrency, requests_per_level, mode, session_id, unique_questions, timeout):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(requests_per_level):
+        queue.put_nowait(i)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                i = queue.get_nowait()
+                # Unique questions bypass the answer cache so every request does the full round-trip
+                question = f"What does the document say about item {i}? ({time.time_ns()})" if unique_questions else "What is the recommended dosage?"
+                payload = {'question': question, 'mode': mode, 'session_id': session_id}
+                started = time.perf_counter()
+                try:
+                    response = await client.post('/api/query', json=payload)
+                    response.raise_for_status()
+                    if response.json().get('status') != 'success':
+                        errors += 1
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': requests_per_level,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+    }
+
+
+async def main(args):
+    results = []
+    for concurrency in args.concurrency:
+        result = await run_level(args.url, concurrency, args.requests or concurrency * 4, args.mode,
+                                 args.session_id, not args.repeat_question, args.timeout)
+        results.append(result)
+        print(json.dumps(result))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent /api/query load test.")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--mode', default='azure', choices=['azure', 'upload'])
+    parser.add_argument('--session-id', help="session with processed PDFs, required for --mode upload")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--requests', type=int, help="requests per concurrency level (default: 4 x concurrency)")
+    parser.add_argument('--repeat-question', action='store_true', help="ask the same question every time (answer cache hits)")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,326 @@
+# benchmarks/offline_suite.py
+# End-to-end benchmark of app.py with no external service: Groq, the embeddings API and Azure Blob
+# Storage are replaced by the stand-ins in stand_ins.py, and requests go through Flask's test client.
+#
+#   python benchmarks/offline_suite.py --output results.json
+#   python benchmarks/offline_suite.py --pdfs 50 --concurrency 1 8 32 --baseline results.json
+#
+# Scenarios: ingestion of --pdfs PDFs through /api/upload, cold / warm / cached /api/query in upload
+# and azure modes, concurrent users, and the same questions sent as one /api/query-batch. Every row reports p50/p95/p99 latency, throughput and the
+# peak RSS of this process while the scenario ran. Runs are repeatable: same PDFs, same questions,
+# same vectors and answers.
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+from load_test import percentile  # noqa: E402
+
+TOPICS = ["aspirin", "ibuprofen", "paracetamol", "warfarin", "metformin", "amoxicillin", "insulin", "codeine"]
+FACTS = ["dosage", "contraindications", "interactions", "side effects", "renal adjustment", "monitoring"]
+
+
+def write_pdf(path, pages):
+    # Minimal PDF with one text block per page; pages are lists of lines
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = " T* ".join("(%s) Tj" % line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_corpus(directory, count, pages_per_pdf, lines_per_page=40, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for number in range(count):
+        pages = []
+        for page in range(pages_per_pdf):
+            lines = []
+            for line in range(lines_per_page):
+                topic, fact = TOPICS[rng.integers(len(TOPICS))], FACTS[rng.integers(len(FACTS))]
+                lines.append(f"Leaflet {number} page {page}: the {fact} of {topic} is {rng.integers(5, 1000)} mg "
+                             f"for adults, reviewed every {rng.integers(1, 12)} weeks.")
+            pages.append(lines)
+        path = os.path.join(directory, f"leaflet-{number:04d}.pdf")
+        write_pdf(path, pages)
+        paths.append(path)
+    return paths
+
+
+def questions(prefix, count):
+    # Distinct questions miss the answer cache; the same list is asked on every run
+    return [f"{prefix} {i}: what is the {FACTS[i % len(FACTS)]} of {TOPICS[i % len(TOPICS)]}?" for i in range(count)]
+
+
+class PeakRss:
+    # Samples the resident set size of this process while a scenario runs
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+
+    def sample(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # No /proc: the lifetime peak (kilobytes on Linux, bytes on macOS)
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def run(self):
+        while not self.stop.is_set():
+            self.peak = max(self.peak, self.sample())
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.sample())
+
+
+class Suite:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.rows = []
+        self.local = threading.local()
+
+    def client(self):
+        # One test client per thread, like one connection per user
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.app.test_client()
+        return client
+
+    def drop_caches(self):
+        # What a freshly started worker has: no loaded indexes, no cached answers, no clients
+        app = self.app
+        with app.session_store_cache_lock:
+            app.session_store_cache.clear()
+        with app.azure_index_load_lock:
+            app.azure_index_cache['entry'] = None
+            app.azure_segment_cache.clear()
+        with app.answer_cache_lock:
+            app.answer_cache.clear()
+            app.answer_cache_versions.clear()
+        shutil.rmtree(app.INDEX_CACHE_DIR, ignore_errors=True)
+        app.reset_resources()
+
+    def measure(self, scenario, calls, concurrency=1, before=None, **labels):
+        # calls: one zero-argument callable per request, returning True on success; before runs untimed
+        def timed(call):
+            if before:
+                before()
+            started = time.perf_counter()
+            ok = call()
+            return time.perf_counter() - started, ok
+
+        with PeakRss() as rss:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(timed, calls))
+            elapsed = time.perf_counter() - started
+
+        latencies = [seconds for seconds, ok in results if ok]
+        row = {
+            'scenario': scenario,
+            **labels,
+            'concurrency': concurrency,
+            'requests': len(calls),
+            'errors': len(calls) - len(latencies),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+            'peak_rss_mb': round(rss.peak / 1e6, 1),
+        }
+        if 'pages' in labels:
+            row['pages_per_second'] = round(labels['pages'] * len(latencies) / elapsed, 1)
+        if 'questions' in labels:
+            row['questions_per_second'] = round(labels['questions'] * len(latencies) / elapsed, 1)
+        self.rows.append(row)
+        print(json.dumps(row))
+        return row
+
+    def upload(self, paths, session_id=None, save_to_azure=False):
+        data = {'wait': 'true', 'save_to_azure': 'true' if save_to_azure else 'false',
+                'pdfs': [(open(path, 'rb'), os.path.basename(path)) for path in paths]}
+        if session_id:
+            data['session_id'] = session_id
+        try:
+            response = self.client().post('/api/upload', data=data, content_type='multipart/form-data')
+        finally:
+            for f, _ in data['pdfs']:
+                f.close()
+        return response.get_json()
+
+    def query(self, question, mode, session_id=None):
+        response = self.client().post('/api/query', json={'question': question, 'mode': mode, 'session_id': session_id})
+        body = response.get_json()
+        return response.status_code == 200 and body.get('status') == 'success'
+
+    def query_batch(self, batch, mode, session_id=None):
+        response = self.client().post('/api/query-batch', json={'questions': batch, 'mode': mode, 'session_id': session_id})
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        return response.status_code == 200 and bool(lines) and lines[-1].get('status') == 'done' and not lines[-1]['errors']
+
+    def run_ingest(self, paths):
+        pages = len(paths) * self.args.pages
+        # One request with every PDF, saved to the (local) Azure index: the corpus for the azure-mode scenarios
+        result = {}
+
+        def ingest_all():
+            result.update(self.upload(paths, save_to_azure=True))
+            return result.get('status') == 'success'
+
+        self.measure('ingest', [ingest_all], pdfs=len(paths), pages=pages)
+        self.session_id = result.get('session_id')
+
+        # One PDF per request and session, session index only
+        self.measure('ingest_single', [lambda path=path: self.upload([path]).get('status') == 'success' for path in paths],
+                     pdfs=1, pages=self.args.pages)
+
+    def run_queries(self, mode):
+        args = self.args
+        session_id = self.session_id if mode == 'upload' else None
+        ask = lambda question: (lambda: self.query(question, mode, session_id))
+
+        self.measure('query_cold', [ask(q) for q in questions(f"cold {mode}", args.cold_queries)], mode=mode,
+                     before=self.drop_caches)
+        self.query("warm-up", mode, session_id)
+        self.measure('query_warm', [ask(q) for q in questions(f"warm {mode}", args.queries)], mode=mode)
+        repeated = questions(f"cached {mode}", 1)[0]
+        self.query(repeated, mode, session_id)
+        self.measure('query_cached', [ask(repeated) for _ in range(args.queries)], mode=mode)
+
+        for concurrency in args.concurrency:
+            count = args.load_requests or concurrency * 4
+            self.measure('load', [ask(q) for q in questions(f"load {mode} {concurrency}", count)], concurrency, mode=mode)
+
+        # The same number of questions as the largest load run, in one /api/query-batch request
+        batch = questions(f"batch {mode}", args.load_requests or max(args.concurrency) * 4)
+        self.measure('batch', [lambda: self.query_batch(batch, mode, session_id)], mode=mode, questions=len(batch))
+
+
+def compare(rows, baseline_rows):
+    key = lambda row: (row['scenario'], row.get('mode'), row['concurrency'])
+    baseline = {key(row): row for row in baseline_rows}
+    print(f"{'scenario':<14} {'mode':<7} {'conc':>4} {'p50 ms':>16} {'p95 ms':>16} {'req/s':>14} {'RSS MB':>14}")
+    for row in rows:
+        old = baseline.get(key(row))
+        if old is None:
+            continue
+        cells = []
+        for field in ('p50_ms', 'p95_ms', 'throughput_rps', 'peak_rss_mb'):
+            if row[field] is None or not old[field]:
+                cells.append('-')
+            else:
+                cells.append(f"{row[field]:g} ({(row[field] - old[field]) / old[field]:+.0%})")
+        print(f"{row['scenario']:<14} {row.get('mode') or '-':<7} {row['concurrency']:>4} "
+              f"{cells[0]:>16} {cells[1]:>16} {cells[2]:>14} {cells[3]:>14}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of app.py with local stand-ins.")
+    parser.add_argument('--pdfs', type=int, default=20, help="PDFs to ingest (default 20)")
+    parser.add_argument('--pages', type=int, default=10, help="pages per PDF (default 10)")
+    parser.add_argument('--queries', type=int, default=50, help="questions per warm / cached scenario")
+    parser.add_argument('--cold-queries', type=int, default=10, help="questions asked after dropping every cache")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--load-requests', type=int, help="requests per load level (default: 4 x concurrency)")
+    parser.add_argument('--modes', nargs='+', default=['upload', 'azure'], choices=['upload', 'azure'])
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="fake Groq time to first token, seconds")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=500.0)
+    parser.add_argument('--answer-tokens', type=int, default=50)
+    parser.add_argument('--embed-latency', type=float, default=0.01, help="fake embeddings latency per call, seconds")
+    parser.add_argument('--dimension', type=int, default=768, help="fake embedding dimension")
+    parser.add_argument('--blob-latency', type=float, default=0.0, help="added to every local blob request, seconds")
+    parser.add_argument('--workdir', help="directory for uploads, indexes and blobs (default: a new temporary one)")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="offline-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # app.py keeps uploads, chat history and caches relative to the working directory
+    os.chdir(workdir)
+    os.environ.update({
+        'EMBEDDING_BACKEND': 'fake',
+        'EMBEDDING_FAKE_LATENCY': str(args.embed_latency),
+        'EMBEDDING_FAKE_DIM': str(args.dimension),
+        'EMBEDDING_MAX_QPS': '0',
+        'EMBEDDING_CACHE_DIR': '',
+        'GROQ_API_KEY': os.environ.get('GROQ_API_KEY', 'offline'),
+    })
+
+    import app  # noqa: E402
+    import stand_ins  # noqa: E402
+    container = stand_ins.install(app, os.path.join(workdir, "blobs"), llm_latency=args.llm_latency,
+                                  llm_tokens_per_second=args.llm_tokens_per_second,
+                                  answer_tokens=args.answer_tokens, blob_latency=args.blob_latency)
+
+    suite = Suite(app, args)
+    corpus_dir = os.path.join(workdir, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = make_corpus(corpus_dir, args.pdfs, args.pages)
+    try:
+        suite.run_ingest(paths)
+        for mode in args.modes:
+            suite.run_queries(mode)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'started_at': started_at,
+        'config': vars(args),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'blob_requests': container.requests,
+        'scenarios': suite.rows,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            compare(suite.rows, json.load(f)['scenarios'])
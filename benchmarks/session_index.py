@@ -0,0 +1,176 @@
+# benchmarks/session_index.py
+# Memory / recall report of the session index modes (SESSION_INDEX_MODE) against the default 'faiss' mode,
+# LangChain's FAISS.from_embeddings output (float32 IndexFlatL2 + pickled InMemoryDocstore):
+#
+#   python benchmarks/session_index.py --chunks 20000 --dimension 768
+#   python benchmarks/session_index.py --sessions 16 --output session_index.json
+#
+# Every mode is written with app.save_session_vector_store, copied to --sessions session directories and
+# loaded in a fresh process, which then searches each copy. Its memory is split as /proc reports it:
+#   anon  private heap: float32 vectors, Document objects, offsets, BM25; adds up with every session
+#   file  mmap'd index codes and docstore pages the searches touched; page cache, shared and reclaimable
+# Recall@k is the fraction of the float32 exact top-k that the mode's dense search also returns.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+from load_test import percentile  # noqa: E402
+
+MODES = ['faiss', 'fp16', 'int8']
+WORDS = ("dose renal hepatic adjustment monitoring contraindication interaction infusion tablet oral daily "
+         "weekly clearance elderly paediatric warfarin aspirin ibuprofen metformin insulin codeine").split()
+
+
+def read_memory():
+    # (RssAnon, RssFile) of this process in bytes
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ('RssAnon', 'RssFile'):
+                values[name] = int(value.split()[0]) * 1024
+    return values['RssAnon'], values['RssFile']
+
+
+def make_chunks(count, chunk_size, seed=0):
+    # Chunk-sized texts with the metadata the ingestion pipeline attaches
+    rng = np.random.default_rng(seed)
+    texts, metadatas, ids = [], [], []
+    for i in range(count):
+        words = rng.choice(WORDS, chunk_size // 7)
+        texts.append(" ".join(words)[:chunk_size])
+        metadatas.append({'source': f"doc{i // 200}.pdf", 'sha256': f"{i // 200:064x}", 'page': i // 4 % 50 + 1,
+                          'start_index': i % 4 * 900, 'chunk': i % 200})
+        ids.append(f"{i // 200:016x}-{i % 200}")
+    return texts, metadatas, ids
+
+
+def measure_loaded(app, directories, queries, k):
+    # Runs in a fresh process: memory added by loading every directory and searching it
+    gc_anon, gc_file = read_memory()
+    started = time.perf_counter()
+    stores = [app.load_session_vector_store(directory) for directory in directories]
+    load_seconds = (time.perf_counter() - started) / len(stores)
+    for vector_store in stores:
+        segmented = app.SegmentedVectorStore([vector_store], app.get_embeddings())
+        for found in segmented.search_dense_batch(queries, k):
+            for _, position, _ in found:
+                segmented.get_document(0, position)
+    anon, file_backed = read_memory()
+    return {'anon_bytes': anon - gc_anon, 'file_bytes': file_backed - gc_file, 'load_ms': round(load_seconds * 1000, 1)}
+
+
+def search_one_by_one(app, vector_store, queries, k):
+    segmented = app.SegmentedVectorStore([vector_store], app.get_embeddings())
+    latencies, positions = [], []
+    for query in queries:
+        started = time.perf_counter()
+        found = segmented.search_dense(query, k)
+        positions.append([position for _, position, _ in found])
+        latencies.append(time.perf_counter() - started)
+    return positions, latencies
+
+
+def run(app, args, workdir):
+    from ann_recall import synthetic_vectors, recall_at_k
+    from langchain_community.vectorstores import FAISS
+
+    vectors = synthetic_vectors(args.chunks, args.dimension)
+    texts, metadatas, ids = make_chunks(args.chunks, app.CHUNK_SIZE)
+    baseline = FAISS.from_embeddings(zip(texts, vectors), embedding=app.get_embeddings(), metadatas=metadatas, ids=ids)
+    del texts, metadatas, ids
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    _, exact = baseline.index.search(queries, args.k)
+    query_path = os.path.join(workdir, "queries.npy")
+    np.save(query_path, queries)
+
+    rows = []
+    for mode in args.modes:
+        app.SESSION_INDEX_MODE = mode
+        first = os.path.join(workdir, mode, "session-0")
+        vector_store = app.save_session_vector_store(first, baseline)
+        directories = [first]
+        for i in range(1, args.sessions):
+            directories.append(os.path.join(workdir, mode, f"session-{i}"))
+            shutil.copytree(first, directories[-1])
+
+        found, latencies = search_one_by_one(app, vector_store, queries, args.k)
+        measured = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--workdir', workdir, '--dimension', str(args.dimension),
+             '--k', str(args.k), '--measure', query_path, *directories],
+            check=True, capture_output=True, text=True
+        )
+        memory = json.loads(measured.stdout.strip().splitlines()[-1])
+        rows.append({
+            'mode': mode,
+            'index_type': app.get_index_type(vector_store.index),
+            'disk_bytes': app.get_index_dir_size(first),
+            'anon_bytes_per_session': memory['anon_bytes'] // args.sessions,
+            'file_bytes_per_session': memory['file_bytes'] // args.sessions,
+            'load_ms': memory['load_ms'],
+            'recall': round(recall_at_k(found, exact), 4),
+            'mean_ms': round(float(np.mean(latencies)) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Memory / recall report of the compact session index modes.")
+    parser.add_argument('--chunks', type=int, default=20000, help="chunks per session index (default 20000)")
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--sessions', type=int, default=8, help="session copies loaded side by side for the memory figures")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--workdir', help="directory for the session indexes (default: a new temporary one)")
+    parser.add_argument('--output', help="also write the rows to this JSON file")
+    parser.add_argument('--measure', nargs='+', help=argparse.SUPPRESS)  # internal: queries.npy, then directories
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="session-index-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # app.py keeps uploads, chat history and caches relative to the working directory
+    os.chdir(workdir)
+    os.environ.update({
+        'EMBEDDING_BACKEND': 'fake',
+        'EMBEDDING_FAKE_DIM': str(args.dimension),
+        'EMBEDDING_CACHE_DIR': '',
+        'GROQ_API_KEY': os.environ.get('GROQ_API_KEY', 'offline'),
+    })
+
+    import app  # noqa: E402
+
+    if args.measure:
+        print(json.dumps(measure_loaded(app, args.measure[1:], np.load(args.measure[0]), args.k)))
+        raise SystemExit(0)
+
+    try:
+        rows = run(app, args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.chunks} chunks x {args.dimension} dimensions, {args.sessions} sessions loaded, recall@{args.k} of dense search")
+    print(f"{'mode':<6} {'index':<8} {'disk MB':>8} {'anon MB':>8} {'file MB':>8} {'load ms':>8} {'recall':>7} {'mean ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        print(f"{row['mode']:<6} {row['index_type']:<8} {row['disk_bytes'] / 1e6:>8.1f} {row['anon_bytes_per_session'] / 1e6:>8.1f} "
+              f"{row['file_bytes_per_session'] / 1e6:>8.1f} {row['load_ms']:>8} {row['recall']:>7.4f} {row['mean_ms']:>8.3f} "
+              f"{row['p95_ms']:>8.3f}")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(rows, f, indent=2)
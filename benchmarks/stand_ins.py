@@ -0,0 +1,223 @@
+# benchmarks/stand_ins.py
+# Local stand-ins for the paid services app.py talks to, so benchmarks run offline and repeatably:
+#
+#   FakeChatGroq        replaces ChatGroq (app.build_llm): deterministic answers, time to first token + tokens/second
+#   LocalBlobContainer  replaces the Azure container client: Azurite-style blobs in a local directory
+#
+# Embeddings already have an offline backend in app.py (EMBEDDING_BACKEND=fake, hash-seeded vectors).
+# install() wires all three into an imported app module.
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORDS = (
+    "the dose should be adjusted for renal function and reviewed after each cycle of treatment "
+    "patients with hepatic impairment need closer monitoring of liver enzymes during therapy"
+).split()
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class FakeChatGroq(BaseChatModel):
+    latency: float = 0.05  # seconds before the first token
+    tokens_per_second: float = 500.0
+    answer_tokens: int = 50
+
+    @property
+    def _llm_type(self):
+        return "fake-groq"
+
+    def _tokens(self, messages):
+        # The same prompt always gets the same answer
+        seed = hashlib.sha256("".join(str(message.content) for message in messages).encode("utf-8")).digest()
+        return [f" {WORDS[seed[i % len(seed)] % len(WORDS)]}" for i in range(self.answer_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class LocalBlobDownload:
+    def __init__(self, path, properties, offset, length):
+        self.path = path
+        self.properties = properties
+        self.offset = offset or 0
+        self.length = properties.size - self.offset if length is None else min(length, properties.size - self.offset)
+
+    def chunks(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    def readall(self):
+        return b"".join(self.chunks())
+
+    def readinto(self, stream):
+        written = 0
+        for block in self.chunks():
+            stream.write(block)
+            written += len(block)
+        return written
+
+
+class LocalBlobClient:
+    def __init__(self, container, blob_path):
+        self.container = container
+        self.blob_path = blob_path
+        self.data_path = os.path.join(container.root, "data", blob_path)
+        self.meta_path = os.path.join(container.root, "meta", f"{blob_path}.json")
+
+    def _properties(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(message=f"The specified blob does not exist: {self.blob_path}")
+        return SimpleNamespace(name=self.blob_path, size=meta['size'], etag=meta['etag'],
+                               last_modified=datetime.fromisoformat(meta['last_modified']), metadata=meta['metadata'])
+
+    def exists(self):
+        self.container.request()
+        return os.path.exists(self.meta_path)
+
+    def get_blob_properties(self):
+        self.container.request()
+        return self._properties()
+
+    def upload_blob(self, data, overwrite=False, etag=None, match_condition=None, metadata=None, **kwargs):
+        # length, max_concurrency and other transfer options do not apply to a local file
+        self.container.request()
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        os.makedirs(os.path.dirname(self.meta_path), exist_ok=True)
+        temp_path = f"{self.data_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f, READ_BLOCK_SIZE)
+            size = f.tell()
+
+        # The write is staged outside the lock; only the condition check and the swap are serialized
+        with self.container.lock:
+            exists = os.path.exists(self.meta_path)
+            try:
+                if exists and not overwrite:
+                    raise ResourceExistsError(message=f"The specified blob already exists: {self.blob_path}")
+                if match_condition == MatchConditions.IfNotModified and (not exists or self._properties().etag != etag):
+                    raise ResourceModifiedError(message=f"The condition specified using HTTP conditional header(s) is not met: {self.blob_path}")
+            except Exception:
+                os.remove(temp_path)
+                raise
+            os.replace(temp_path, self.data_path)
+            meta = {
+                'size': size,
+                'etag': f'"0x{uuid.uuid4().hex[:16].upper()}"',
+                'last_modified': datetime.now(timezone.utc).isoformat(),
+                'metadata': metadata or {}
+            }
+            with open(f"{temp_path}.json", "w") as f:
+                json.dump(meta, f)
+            os.replace(f"{temp_path}.json", self.meta_path)
+        return {'etag': meta['etag'], 'last_modified': datetime.fromisoformat(meta['last_modified'])}
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        self.container.request()
+        return LocalBlobDownload(self.data_path, self._properties(), offset, length)
+
+    def delete_blob(self, **kwargs):
+        self.container.request()
+        with self.container.lock:
+            if not os.path.exists(self.meta_path):
+                raise ResourceNotFoundError(message=f"The specified blob does not exist: {self.blob_path}")
+            os.remove(self.meta_path)
+            os.remove(self.data_path)
+
+
+class LocalBlobContainer:
+    # The subset of azure.storage.blob.ContainerClient that app.py uses, with ETags and conditional writes.
+    # latency is added to every request to mimic the round-trip to a storage account.
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        os.makedirs(os.path.join(root, "data"), exist_ok=True)
+        os.makedirs(os.path.join(root, "meta"), exist_ok=True)
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_blob_client(self, blob):
+        return LocalBlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with=None, include=None, **kwargs):
+        self.request()
+        meta_root = os.path.join(self.root, "meta")
+        blobs = []
+        for directory, _, names in os.walk(meta_root):
+            for name in names:
+                blob_path = os.path.relpath(os.path.join(directory, name), meta_root)[:-len(".json")].replace(os.sep, "/")
+                if not name_starts_with or blob_path.startswith(name_starts_with):
+                    try:
+                        blobs.append(LocalBlobClient(self, blob_path)._properties())
+                    except ResourceNotFoundError:
+                        pass  # deleted while listing
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+def install(app, blob_root, llm_latency=0.05, llm_tokens_per_second=500.0, answer_tokens=50, blob_latency=0.0):
+    # Call after importing app with EMBEDDING_BACKEND=fake; returns the container stand-in
+    container = LocalBlobContainer(blob_root, latency=blob_latency)
+
+    def build_llm():
+        # app.build_llm imports langchain_groq on first use; so does its stand-in, to keep cold starts comparable
+        importlib.import_module("langchain_groq")
+        return FakeChatGroq(latency=llm_latency, tokens_per_second=llm_tokens_per_second, answer_tokens=answer_tokens)
+
+    app.build_llm = build_llm
+    app.build_container_client = lambda: container
+    app.reset_resources()
+    return container
@@ -0,0 +1,167 @@
+# benchmarks/startup.py
+# Cold start of one worker, with and without PREWARM, against the offline stand-ins (stand_ins.py):
+#
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --runs 5 --blob-latency 0.02 --output startup.json
+#
+# The shared Azure index is built once; then every run starts a fresh interpreter that imports app,
+# waits for /api/ready (at once without prewarm) and asks two azure-mode questions. Each run reports:
+#   import_s        import of app.py, as recorded by app itself
+#   ready_s         process start to the first 200 from /api/ready
+#   first_query_ms  the first /api/query: everything prewarm did not load is loaded here
+#   first_answer_s  process start to the end of the first answer
+#   warm_query_ms   the second /api/query
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+MODES = ['lazy', 'prewarm']
+
+
+def install_stand_ins(app, args, workdir):
+    import stand_ins
+
+    return stand_ins.install(app, os.path.join(workdir, "blobs"), llm_latency=args.llm_latency,
+                             blob_latency=args.blob_latency)
+
+
+def seed_azure_index(args, workdir):
+    # Runs in this process: one upload of the corpus, saved to the (local) Azure index
+    from offline_suite import make_corpus
+
+    import app
+    install_stand_ins(app, args, workdir)
+    corpus_dir = os.path.join(workdir, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = make_corpus(corpus_dir, args.pdfs, args.pages)
+    data = {'wait': 'true', 'save_to_azure': 'true', 'pdfs': [(open(path, 'rb'), os.path.basename(path)) for path in paths]}
+    try:
+        response = app.app.test_client().post('/api/upload', data=data, content_type='multipart/form-data')
+    finally:
+        for f, _ in data['pdfs']:
+            f.close()
+    if response.get_json().get('status') != 'success':
+        raise SystemExit(f"Seeding the Azure index failed: {response.get_json()}")
+
+
+def boot(args, workdir, mode, launched):
+    # Runs in a fresh process started at `launched` (time.time() in the parent)
+    import app
+    install_stand_ins(app, args, workdir)
+    client = app.app.test_client()
+    if mode == 'prewarm':
+        app.start_prewarm()
+    while client.get('/api/ready').status_code != 200:
+        time.sleep(0.005)
+    ready = time.time()
+
+    def ask(question):
+        started = time.perf_counter()
+        response = client.post('/api/query', json={'question': question, 'mode': 'azure'})
+        if response.get_json().get('status') != 'success':
+            raise SystemExit(f"Query failed: {response.get_json()}")
+        return time.perf_counter() - started
+
+    first_query = ask("what is the dosage of aspirin?")
+    first_answer = time.time()
+    warm_query = ask("what is the renal adjustment of metformin?")
+    stats = client.get('/api/ready').get_json()
+    return {
+        'mode': mode,
+        'import_s': round(stats['import_seconds'], 3),
+        'prewarm_s': round(stats['prewarm_seconds'], 3) if stats['prewarm_seconds'] is not None else None,
+        'ready_s': round(ready - launched, 3),
+        'first_query_ms': round(first_query * 1000, 1),
+        'first_answer_s': round(first_answer - launched, 3),
+        'warm_query_ms': round(warm_query * 1000, 1),
+    }
+
+
+def run(args, workdir):
+    rows = []
+    for run_no in range(args.runs):
+        for mode in args.modes:
+            # A new working directory each time, so no run starts with another's local index cache
+            run_dir = os.path.join(workdir, f"run-{run_no}-{mode}")
+            os.makedirs(run_dir)
+            launched = time.time()
+            booted = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--workdir', workdir, '--dimension', str(args.dimension),
+                 '--llm-latency', str(args.llm_latency), '--blob-latency', str(args.blob_latency), '--boot', mode, str(launched)],
+                check=True, capture_output=True, text=True, cwd=run_dir
+            )
+            rows.append(json.loads(booted.stdout.strip().splitlines()[-1]))
+            print(json.dumps(rows[-1]))
+    return rows
+
+
+def summarize(rows):
+    # Median of every column, per mode
+    summary = []
+    for mode in dict.fromkeys(row['mode'] for row in rows):
+        mode_rows = [row for row in rows if row['mode'] == mode]
+        columns = [key for key in mode_rows[0] if key != 'mode' and mode_rows[0][key] is not None]
+        summary.append({'mode': mode, **{key: round(float(np.median([row[key] for row in mode_rows])), 3) for key in columns}})
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cold start of one worker, with and without PREWARM.")
+    parser.add_argument('--runs', type=int, default=3, help="fresh processes per mode (default 3)")
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--pdfs', type=int, default=20, help="PDFs in the shared Azure index")
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="stand-in LLM seconds to first token")
+    parser.add_argument('--blob-latency', type=float, default=0.01, help="stand-in seconds per blob request")
+    parser.add_argument('--workdir', help="directory for the blobs and runs (default: a new temporary one)")
+    parser.add_argument('--output', help="also write the rows to this JSON file")
+    parser.add_argument('--boot', nargs=2, help=argparse.SUPPRESS)  # internal: mode, launch time
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="startup-bench-"))
+    os.environ.update({
+        'EMBEDDING_BACKEND': 'fake',
+        'EMBEDDING_FAKE_DIM': str(args.dimension),
+        'EMBEDDING_MAX_QPS': '0',
+        'EMBEDDING_CACHE_DIR': '',
+        'GROQ_API_KEY': os.environ.get('GROQ_API_KEY', 'offline'),
+        # Prewarm is started by boot(), after the stand-ins are installed
+        'PREWARM': 'false',
+    })
+
+    if args.boot:
+        print(json.dumps(boot(args, workdir, args.boot[0], float(args.boot[1]))))
+        raise SystemExit(0)
+
+    os.makedirs(workdir, exist_ok=True)
+    # app.py keeps uploads, chat history and caches relative to the working directory
+    os.chdir(workdir)
+    try:
+        seed_azure_index(args, workdir)
+        rows = run(args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(rows)
+    print(f"median of {args.runs} runs, {args.pdfs} PDFs x {args.pages} pages in the Azure index")
+    print(f"{'mode':<8} {'import s':>9} {'prewarm s':>10} {'ready s':>8} {'first query ms':>15} {'first answer s':>15} {'warm query ms':>14}")
+    for row in summary:
+        print(f"{row['mode']:<8} {row['import_s']:>9} {row.get('prewarm_s', '-'):>10} {row['ready_s']:>8} {row['first_query_ms']:>15} "
+              f"{row['first_answer_s']:>15} {row['warm_query_ms']:>14}")
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'runs': rows, 'summary': summary}, f, indent=2)
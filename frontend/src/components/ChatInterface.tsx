@@ -14,6 +14,7 @@ interface ChatInterfaceProps {
   onClearHistory: () => void;
   isLoading: boolean;
   additionalInfo?: React.ReactNode;
+  streamingContent?: string | null;
 }
 
 const ChatInterface: React.FC<ChatInterfaceProps> = ({ 
@@ -22,16 +23,26 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
   onSendMessage, 
   onClearHistory, 
   isLoading,
-  additionalInfo 
+  additionalInfo,
+  streamingContent = null
 }) => {
   const [message, setMessage] = useState('');
   const chatContainerRef = useRef<HTMLDivElement>(null);
 
+  // Newest turn is first: show the partial answer right after the pending question
+  const displayHistory = streamingContent !== null && chatHistory.length > 0
+    ? [
+        chatHistory[0],
+        { role: 'assistant', content: streamingContent, timestamp: '' },
+        ...chatHistory.slice(1)
+      ]
+    : chatHistory;
+
   useEffect(() => {
     if (chatContainerRef.current) {
       chatContainerRef.current.scrollTop = chatContainerRef.current.scrollHeight;
     }
-  }, [chatHistory]);
+  }, [chatHistory, streamingContent]);
 
   const handleSubmit = (e: React.FormEvent) => {
     e.preventDefault();
@@ -67,13 +78,13 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
         className="flex-1 overflow-y-auto p-4 space-y-4"
         style={{ maxHeight: 'calc(100vh - 300px)' }}
       >
-        {chatHistory.length === 0 ? (
+        {displayHistory.length === 0 ? (
           <div className="flex flex-col items-center justify-center h-full text-gray-500">
             <p className="text-center">No messages yet. Start a conversation!</p>
           </div>
         ) : (
           <>
-            {chatHistory.map((msg, index) => (
+            {displayHistory.map((msg, index) => (
               <div 
                 key={index} 
                 className={`flex flex-col ${
@@ -95,7 +106,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
           </>
         )}
         
-        {isLoading && (
+        {isLoading && !streamingContent && (
           <div className="flex items-center space-x-2 text-gray-500">
             <div className="animate-pulse flex space-x-1">
               <div className="h-2 w-2 bg-blue-600 rounded-full"></div>
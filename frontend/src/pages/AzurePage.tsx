@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import Header from '../components/Header';
 import Footer from '../components/Footer';
 import ChatInterface from '../components/ChatInterface';
+import { streamQuery } from '../utils/streamQuery';
 import { Database, FileText } from 'lucide-react';
 
 interface Message {
@@ -13,6 +14,7 @@ interface Message {
 const AzurePage: React.FC = () => {
   const [chatHistory, setChatHistory] = useState<Message[]>([]);
   const [isQuerying, setIsQuerying] = useState(false);
+  const [streamingContent, setStreamingContent] = useState<string | null>(null);
   const [filesCount, setFilesCount] = useState(0);
   
   useEffect(() => {
@@ -76,16 +78,14 @@ const AzurePage: React.FC = () => {
       formData.append('question', message);
       formData.append('mode', 'azure');
       
-      const response = await fetch('/query', {
-        method: 'POST',
-        body: formData
+      setStreamingContent('');
+      const result = await streamQuery('/query', formData, {
+        onToken: token => setStreamingContent(prev => (prev ?? '') + token)
       });
       
-      const result = await response.json();
-      
       if (result.status === 'success') {
-        // Update chat history with the backend response
-        setChatHistory(result.chat_history);
+        // The backend returns only the new turn; it replaces the optimistic user message
+        setChatHistory(prev => [...result.chat_history, ...prev.slice(1)]);
       } else {
         // Add error message if query failed
         const errorMessage = {
@@ -104,6 +104,7 @@ const AzurePage: React.FC = () => {
       };
       setChatHistory(prev => [errorMessage, ...prev]);
     } finally {
+      setStreamingContent(null);
       setIsQuerying(false);
     }
   };
@@ -172,6 +173,7 @@ const AzurePage: React.FC = () => {
             onSendMessage={handleSendMessage}
             onClearHistory={handleClearHistory}
             isLoading={isQuerying}
+            streamingContent={streamingContent}
             additionalInfo={renderAdditionalInfo()}
           />
         </div>
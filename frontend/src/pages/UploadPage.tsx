@@ -3,6 +3,7 @@ import Header from '../components/Header';
 import Footer from '../components/Footer';
 import DocumentUploader from '../components/DocumentUploader';
 import ChatInterface from '../components/ChatInterface';
+import { streamQuery } from '../utils/streamQuery';
 
 interface Message {
   role: string;
@@ -14,6 +15,7 @@ const UploadPage: React.FC = () => {
   const [chatHistory, setChatHistory] = useState<Message[]>([]);
   const [isUploading, setIsUploading] = useState(false);
   const [isQuerying, setIsQuerying] = useState(false);
+  const [streamingContent, setStreamingContent] = useState<string | null>(null);
   const [uploadStatus, setUploadStatus] = useState<{
     success: boolean;
     message: string;
@@ -114,16 +116,14 @@ const UploadPage: React.FC = () => {
       formData.append('question', message);
       formData.append('mode', 'upload');
       
-      const response = await fetch('/query', {
-        method: 'POST',
-        body: formData
+      setStreamingContent('');
+      const result = await streamQuery('/query', formData, {
+        onToken: token => setStreamingContent(prev => (prev ?? '') + token)
       });
       
-      const result = await response.json();
-      
       if (result.status === 'success') {
-        // Update chat history with the backend response
-        setChatHistory(result.chat_history);
+        // The backend returns only the new turn; it replaces the optimistic user message
+        setChatHistory(prev => [...result.chat_history, ...prev.slice(1)]);
       } else {
         // Add error message if query failed
         const errorMessage = {
@@ -142,6 +142,7 @@ const UploadPage: React.FC = () => {
       };
       setChatHistory(prev => [errorMessage, ...prev]);
     } finally {
+      setStreamingContent(null);
       setIsQuerying(false);
     }
   };
@@ -209,6 +210,7 @@ const UploadPage: React.FC = () => {
               onSendMessage={handleSendMessage}
               onClearHistory={handleClearHistory}
               isLoading={isQuerying}
+              streamingContent={streamingContent}
             />
           </div>
         </div>
@@ -0,0 +1,92 @@
+interface Message {
+  role: string;
+  content: string;
+  timestamp: string;
+}
+
+export interface Source {
+  content: string;
+  metadata: Record<string, unknown>;
+}
+
+export interface StreamResult {
+  status: string;
+  response: string;
+  chat_history: Message[];
+}
+
+interface StreamHandlers {
+  onSources?: (sources: Source[]) => void;
+  onToken?: (token: string) => void;
+}
+
+// POSTs a question with stream=true and consumes the Server-Sent Events reply:
+// one "sources" event, then "token" events, then a final "done" event.
+export const streamQuery = async (
+  url: string,
+  body: FormData,
+  handlers: StreamHandlers = {}
+): Promise<StreamResult> => {
+  body.append('stream', 'true');
+
+  const response = await fetch(url, {
+    method: 'POST',
+    body,
+    headers: { Accept: 'text/event-stream' }
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`Query failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result: StreamResult | null = null;
+
+  const handleEvent = (raw: string) => {
+    let event = 'message';
+    const dataLines: string[] = [];
+    raw.split('\n').forEach(line => {
+      if (line.startsWith('event:')) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith('data:')) {
+        dataLines.push(line.slice(5).trimStart());
+      }
+    });
+    if (dataLines.length === 0) return;
+
+    const data = JSON.parse(dataLines.join('\n'));
+    if (event === 'sources') {
+      handlers.onSources?.(data.sources);
+    } else if (event === 'token') {
+      handlers.onToken?.(data.token);
+    } else if (event === 'error') {
+      console.error('Streaming error:', data.message);
+    } else if (event === 'done') {
+      result = data;
+    }
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      handleEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+    }
+  }
+
+  if (buffer.trim()) {
+    handleEvent(buffer);
+  }
+
+  if (!result) {
+    throw new Error('Stream ended before the answer was complete');
+  }
+  return result;
+};
@@ -0,0 +1,122 @@
+# migrate_index.py
+# Converts pickled Azure vector store data (the legacy vector_store/faiss_index blob and any
+# pickled segments) to the memory-mappable segment format described in README.md, and with
+# --reindex rebuilds segments whose index type no longer matches INDEX_TYPE / ANN_MIN_CHUNKS
+# or that were written before segments carried a BM25 keyword index.
+#
+#   python migrate_index.py --dry-run
+#   python migrate_index.py
+#   python migrate_index.py --reindex
+import argparse
+import time
+
+from app import (
+    SEGMENT_FORMAT, get_blob_client, read_manifest, update_manifest, load_segment,
+    upload_segment, segment_blob_paths, get_store_documents, choose_index_type,
+    build_segment_index, get_index_vectors
+)
+
+
+def swap_segments(container_client, old_segments, replacements):
+    # Returns the new manifest, or None if a concurrent compaction replaced some of old_segments
+    def replace(manifest):
+        current_ids = {segment['id'] for segment in manifest['segments']}
+        if not set(replacements) <= current_ids:
+            # A compaction already replaced some of these segments
+            return False
+        manifest['segments'] = [replacements.get(segment['id'], segment) for segment in manifest['segments']]
+        manifest.setdefault('retired', []).extend(
+            {'path': segment['path'], 'blobs': segment_blob_paths(segment), 'retired_at': time.time()}
+            for segment in old_segments
+        )
+
+    manifest, _ = update_manifest(container_client, replace)
+    if manifest is None:
+        for new_segment in replacements.values():
+            for blob_path in segment_blob_paths(new_segment):
+                container_client.get_blob_client(blob_path).delete_blob()
+    return manifest
+
+
+def migrate(container_client, dry_run=False):
+    manifest, _ = read_manifest(container_client)
+    legacy_segments = [segment for segment in manifest['segments'] if segment.get('format') != SEGMENT_FORMAT]
+
+    if not legacy_segments:
+        print("Nothing to migrate: all segments already use the current format.")
+        return 0
+
+    for segment in legacy_segments:
+        print(f"Found legacy segment {segment['id']} at {segment['path']}")
+    if dry_run:
+        return len(legacy_segments)
+
+    replacements = {}
+    for segment in legacy_segments:
+        vector_store = load_segment(container_client, segment)
+        migrated = upload_segment(container_client, vector_store.index, get_store_documents(vector_store))
+        replacements[segment['id']] = migrated
+        print(f"Converted {segment['id']} -> {migrated['id']} ({migrated['chunks']} chunks, {migrated['bytes']} bytes)")
+
+    manifest = swap_segments(container_client, legacy_segments, replacements)
+    if manifest is None:
+        print("The manifest changed during migration; nothing was swapped. Run the migration again.")
+        return 0
+
+    print(f"Migrated {len(replacements)} segments; manifest is now at version {manifest['version']}.")
+    print("The legacy blobs are retired and will be deleted by the next compaction.")
+    return len(replacements)
+
+
+def reindex(container_client, dry_run=False):
+    manifest, _ = read_manifest(container_client)
+    stale_segments = [
+        segment for segment in manifest['segments']
+        if segment.get('format') == SEGMENT_FORMAT and (
+            segment.get('index_type', 'flat') != choose_index_type(segment['chunks']) or not segment.get('bm25')
+        )
+    ]
+
+    if not stale_segments:
+        print("Nothing to reindex: every segment already uses its configured index type and has a keyword index.")
+        return 0
+
+    for segment in stale_segments:
+        target = choose_index_type(segment['chunks'])
+        print(f"Segment {segment['id']} ({segment['chunks']} chunks): {segment.get('index_type', 'flat')} -> {target}"
+              f"{'' if segment.get('bm25') else ', adding BM25'}")
+        if segment.get('index_type') == 'ivf_pq':
+            print("  warning: IVF-PQ vectors are quantized; the rebuilt index inherits that loss")
+    if dry_run:
+        return len(stale_segments)
+
+    replacements = {}
+    for segment in stale_segments:
+        vector_store = load_segment(container_client, segment)
+        index = build_segment_index(get_index_vectors(vector_store.index))
+        rebuilt = upload_segment(container_client, index, get_store_documents(vector_store))
+        replacements[segment['id']] = rebuilt
+        print(f"Rebuilt {segment['id']} -> {rebuilt['id']} ({rebuilt['index_type']}, {rebuilt['bytes']} bytes)")
+
+    manifest = swap_segments(container_client, stale_segments, replacements)
+    if manifest is None:
+        print("The manifest changed during reindexing; nothing was swapped. Run it again.")
+        return 0
+
+    print(f"Reindexed {len(replacements)} segments; manifest is now at version {manifest['version']}.")
+    return len(replacements)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the Azure vector store to the mmap segment format.")
+    parser.add_argument('--dry-run', action='store_true', help="only list the segments that would be converted")
+    parser.add_argument('--reindex', action='store_true', help="rebuild segments with the index type configured for their size")
+    args = parser.parse_args()
+
+    container_client = get_blob_client()
+    if not container_client:
+        raise SystemExit("Failed to connect to Azure Storage. Please check your connection string and container name.")
+    if args.reindex:
+        reindex(container_client, dry_run=args.dry_run)
+    else:
+        migrate(container_client, dry_run=args.dry_run)
@@ -0,0 +1,18 @@
+# pdf_extract.py
+# PDF text extraction for app.py's page-parallel ingestion. The extraction processes import this module
+# (not app.py) to unpickle their tasks, so it must stay free of side effects: no app import, no setup.
+# PyPDF2 is imported on first use, like app.py's other heavy dependencies (see README "Worker startup").
+
+
+def get_pdf_page_count(pdf_path):
+    from PyPDF2 import PdfReader
+
+    return len(PdfReader(pdf_path).pages)
+
+
+def extract_page_range(pdf_path, start, end):
+    # Runs in a worker process; each task parses the file once for its range of pages
+    from PyPDF2 import PdfReader
+
+    pdf_reader = PdfReader(pdf_path)
+    return [(page_index + 1, pdf_reader.pages[page_index].extract_text() or "") for page_index in range(start, end)]
@@ -0,0 +1,101 @@
+# tests/conftest.py
+# app.py reads its configuration from the environment and keeps uploads, chat history and caches relative
+# to the working directory, both when it is imported; so the offline backends are selected and a scratch
+# directory is entered before any test imports it.
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+os.environ.update({
+    'EMBEDDING_BACKEND': 'fake',
+    'EMBEDDING_FAKE_DIM': '32',
+    'EMBEDDING_FAKE_LATENCY': '0',
+    'EMBEDDING_MAX_QPS': '0',
+    'EMBEDDING_CACHE_DIR': '',
+    'GROQ_API_KEY': 'test',
+    'PREWARM': 'false',
+    # Forked extraction processes need no importable __main__
+    'PDF_EXTRACT_START_METHOD': 'fork',
+})
+os.chdir(tempfile.mkdtemp(prefix="rag-tests-"))
+
+import app as app_module  # noqa: E402
+import stand_ins  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    # Every test starts like a new worker: no cached indexes, answers or shared clients
+    with app_module.session_store_cache_lock:
+        app_module.session_store_cache.clear()
+    with app_module.azure_index_load_lock:
+        app_module.azure_index_cache['entry'] = None
+        app_module.azure_index_cache['checked_at'] = 0.0
+        app_module.azure_segment_cache.clear()
+    with app_module.answer_cache_lock:
+        app_module.answer_cache.clear()
+        app_module.answer_cache_versions.clear()
+        app_module.answer_cache_stats.update(dict.fromkeys(app_module.answer_cache_stats, 0))
+    app_module.reset_resources()
+    yield
+
+
+@pytest.fixture
+def container(tmp_path, monkeypatch):
+    # Local Azure container stand-in, wired into app (with the fake LLM) for the test
+    monkeypatch.setattr(app_module, 'build_llm', app_module.build_llm)
+    monkeypatch.setattr(app_module, 'build_container_client', app_module.build_container_client)
+    return stand_ins.install(app_module, str(tmp_path / "blobs"), llm_latency=0, llm_tokens_per_second=1e6,
+                             answer_tokens=5)
+
+
+@pytest.fixture
+def make_store():
+    # LangChain FAISS store over texts, embedded with the fake backend
+    def make(texts, metadatas=None):
+        from langchain_community.vectorstores import FAISS
+
+        return FAISS.from_texts(list(texts), app_module.get_embeddings(), metadatas=metadatas)
+    return make
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    # make_pdf(name, pages) writes a PDF with one list of text lines per page
+    from offline_suite import write_pdf
+
+    def make(name, pages):
+        path = str(tmp_path / name)
+        write_pdf(path, pages)
+        return path
+    return make
+
+
+@pytest.fixture
+def upload(app):
+    # POST /api/upload and wait for its ingest job; returns the response JSON
+    client = app.app.test_client()
+
+    def post(paths, save_to_azure=False, session_id=None, filenames=None):
+        filenames = filenames or [os.path.basename(path) for path in paths]
+        data = {'wait': 'true', 'save_to_azure': 'true' if save_to_azure else 'false',
+                'pdfs': [(open(path, 'rb'), filename) for path, filename in zip(paths, filenames)]}
+        if session_id:
+            data['session_id'] = session_id
+        try:
+            return client.post('/api/upload', data=data, content_type='multipart/form-data').get_json()
+        finally:
+            for f, _ in data['pdfs']:
+                f.close()
+    return post
@@ -0,0 +1,79 @@
+# tests/test_ann_indexes.py
+import faiss
+import pytest
+
+import migrate_index
+
+TEXTS = [f"Chunk {i}: drug {i} is given {i * 5} mg daily." for i in range(400)]
+
+
+@pytest.fixture
+def small_ann(app, monkeypatch):
+    # ANN indexes from 100 chunks, so a test-sized segment gets one
+    monkeypatch.setattr(app, 'ANN_MIN_CHUNKS', 100)
+    monkeypatch.setattr(app, 'INDEX_TYPE', 'auto')
+
+
+@pytest.mark.parametrize("index_type, ntotal, pq_min_chunks, expected", [
+    ('auto', 99, 10 ** 6, 'flat'),
+    ('auto', 400, 10 ** 6, 'ivf_flat'),
+    ('auto', 20000, 10000, 'ivf_pq'),
+    # Too few rows to train 256-centroid PQ codebooks
+    ('auto', 5000, 1000, 'ivf_flat'),
+    ('hnsw', 400, 10 ** 6, 'hnsw'),
+])
+def test_index_type_follows_segment_size(app, small_ann, monkeypatch, index_type, ntotal, pq_min_chunks, expected):
+    monkeypatch.setattr(app, 'INDEX_TYPE', index_type)
+    monkeypatch.setattr(app, 'ANN_PQ_MIN_CHUNKS', pq_min_chunks)
+    assert app.choose_index_type(ntotal) == expected
+
+
+@pytest.mark.parametrize("index_type, expected", [
+    ('flat', "Flat"),
+    ('ivf_flat', "IVF10,Flat"),
+    ('ivf_pq', "IVF10,PQ4x8"),
+    ('hnsw', "HNSW32"),
+    ('sq8', "SQ8"),
+])
+def test_factory_strings(app, index_type, expected):
+    # 400 rows: min(4 * sqrt(400), 400 // 39) = 10 lists; 32 dimensions: 4 sub-quantizers of 8
+    assert app.get_index_factory_string(index_type, 400, 32) == expected
+
+
+def test_search_parameters_are_per_call(app):
+    vectors = app.get_embeddings().embed_documents(TEXTS)
+    ivf = app.build_segment_index(vectors, 'ivf_flat')
+    hnsw = app.build_segment_index(vectors, 'hnsw')
+
+    assert app.get_search_parameters(ivf, nprobe=7).nprobe == 7
+    assert app.get_search_parameters(ivf).nprobe == app.SEARCH_NPROBE
+    assert app.get_search_parameters(hnsw, ef_search=99).efSearch == 99
+    assert app.get_search_parameters(app.build_segment_index(vectors, 'flat')) is None
+    assert faiss.extract_index_ivf(ivf).nprobe == 1
+
+
+def test_an_ann_segment_is_written_and_searched(app, container, make_store, small_ann):
+    segment = app.append_vector_store_segment(make_store(TEXTS), container)
+
+    assert segment['index_type'] == 'ivf_flat'
+    vector_store = app.get_azure_vector_store(container)
+    assert app.get_index_type(vector_store.segments[0].index) == 'ivf_flat'
+    # Probing every list is exact
+    embedding = app.get_embeddings().embed_query(TEXTS[123])
+    [(segment_no, position, _)] = vector_store.search_dense(embedding, 1, nprobe=10)
+    assert vector_store.get_document(segment_no, position).page_content == TEXTS[123]
+
+
+def test_reindex_rebuilds_segments_for_the_configured_type(app, container, make_store, monkeypatch):
+    assert app.append_vector_store_segment(make_store(TEXTS), container)['index_type'] == 'flat'
+    assert migrate_index.reindex(container) == 0
+
+    monkeypatch.setattr(app, 'ANN_MIN_CHUNKS', 100)
+    assert migrate_index.reindex(container, dry_run=True) == 1
+    assert migrate_index.reindex(container) == 1
+
+    [segment] = app.read_manifest(container)[0]['segments']
+    assert segment['index_type'] == 'ivf_flat'
+    vector_store = app.get_azure_vector_store(container)
+    embedding = app.get_embeddings().embed_query(TEXTS[7])
+    assert [doc.page_content for doc in vector_store.search(TEXTS[7], embedding, k=1, nprobe=10)] == [TEXTS[7]]
@@ -0,0 +1,104 @@
+# tests/test_answer_cache.py
+import pytest
+from langchain_core.documents import Document
+
+DOCS = [Document(page_content="Aspirin: 300 mg every four hours.", metadata={'source': "leaflet.pdf", 'page': 1})]
+
+
+def store(app, index_key, question, response="300 mg"):
+    embedding = app.get_embeddings().embed_query(question)
+    app.store_cached_answer(index_key, question, embedding, response, DOCS, {'chunks': 1})
+
+
+@pytest.mark.parametrize("question", [
+    "What is the dosage of aspirin?",
+    "  what IS the dosage   of aspirin ",
+    "what is the dosage of aspirin?!",
+])
+def test_questions_are_normalized(app, question):
+    assert app.normalize_question(question) == "what is the dosage of aspirin"
+
+
+def test_exact_lookup_hits_a_normalized_question(app):
+    store(app, ('azure', 1), "What is the dosage of aspirin?")
+
+    entry = app.lookup_cached_answer(('azure', 1), "what is the dosage of ASPIRIN")
+
+    assert entry['response'] == "300 mg"
+    assert entry['sources'] == [{'content': DOCS[0].page_content, 'metadata': DOCS[0].metadata}]
+    assert app.lookup_cached_answer(('azure', 1), "what is the dosage of metformin?") is None
+    assert app.lookup_cached_answer(('session-a', 1), "what is the dosage of aspirin?") is None
+
+
+def test_a_new_index_version_drops_old_answers(app):
+    store(app, ('azure', 1), "what is the dosage of aspirin?")
+
+    assert app.lookup_cached_answer(('azure', 2), "what is the dosage of aspirin?") is None
+    assert app.get_answer_cache_stats()['invalidations'] == 1
+    # An answer computed against another version is never served for this one
+    store(app, ('azure', 1), "what is the dosage of aspirin?")
+    assert app.lookup_cached_answer(('azure', 2), "what is the dosage of aspirin?") is None
+    assert app.get_answer_cache_stats()['entries'] == 0
+
+
+def test_expired_answers_are_missed(app, monkeypatch):
+    store(app, ('azure', 1), "what is the dosage of aspirin?")
+    monkeypatch.setattr(app, 'ANSWER_CACHE_TTL_SECONDS', 0)
+
+    assert app.lookup_cached_answer(('azure', 1), "what is the dosage of aspirin?") is None
+    assert app.get_answer_cache_stats()['expired'] == 1
+
+
+def test_oldest_answers_are_evicted_first(app, monkeypatch):
+    monkeypatch.setattr(app, 'ANSWER_CACHE_MAX_ENTRIES', 2)
+    for question in ["first?", "second?", "third?"]:
+        store(app, ('azure', 1), question)
+
+    assert app.lookup_cached_answer(('azure', 1), "first?") is None
+    assert app.lookup_cached_answer(('azure', 1), "third?") is not None
+    assert app.get_answer_cache_stats()['evictions'] == 1
+
+
+def test_semantic_match_needs_the_threshold(app, monkeypatch):
+    store(app, ('azure', 1), "what is the dosage of aspirin?")
+    embedding = app.get_embeddings().embed_query("what is the dosage of aspirin?")
+
+    assert app.find_similar_answer(('azure', 1), None) is None
+    monkeypatch.setattr(app, 'ANSWER_CACHE_SEMANTIC_THRESHOLD', 0.99)
+    assert app.find_similar_answer(('azure', 1), embedding)['response'] == "300 mg"
+    assert app.find_similar_answer(('azure', 2), embedding) is None
+
+
+def test_answer_question_serves_the_second_ask_from_cache(app, container, make_store):
+    vector_store = make_store(["Aspirin: 300 mg every four hours.", "Metformin: 500 mg twice daily."])
+
+    response, context = app.answer_question("Aspirin dosage?", vector_store, ('session-a', 1))
+    cached_response, cached_context = app.answer_question("aspirin dosage", vector_store, ('session-a', 1))
+
+    assert not context.get('cached')
+    assert cached_context['cached'] is True
+    assert cached_response == response
+
+
+def test_collecting_a_session_forgets_its_answers(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    scope = f"session:{tmp_path / 'expired-session' / 'faiss_index'}"
+    store(app, (scope, 1.0), "what is the dosage of aspirin?")
+    store(app, ('azure', 1), "what is the dosage of aspirin?")
+
+    app.remove_session_dir("expired-session")
+
+    assert scope not in app.answer_cache_versions
+    assert app.lookup_cached_answer(('azure', 1), "what is the dosage of aspirin?") is not None
+    assert app.get_answer_cache_stats()['entries'] == 1
+
+
+def test_scope_versions_stay_bounded(app, monkeypatch):
+    monkeypatch.setattr(app, 'ANSWER_CACHE_MAX_ENTRIES', 4)
+    store(app, ('azure', 1), "what is the dosage of aspirin?")
+    for n in range(20):
+        # Sessions another worker collected: looked up once, never answered here again
+        app.lookup_cached_answer((f"session:{n}", 1.0), "anything?")
+
+    assert len(app.answer_cache_versions) <= 4
+    assert app.lookup_cached_answer(('azure', 1), "what is the dosage of aspirin?") is not None
@@ -0,0 +1,51 @@
+# tests/test_asgi.py
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+asgi = pytest.importorskip("asgi")
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."], ["Metformin 500 mg twice daily with meals."]]
+
+
+def call(*requests):
+    # Sends (method, path, kwargs) requests concurrently to asgi.application; returns the responses in order
+    async def send_all():
+        transport = httpx.ASGITransport(app=asgi.application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(client.request(method, path, **kwargs) for method, path, kwargs in requests))
+    return asyncio.run(send_all())
+
+
+def test_query_is_answered_on_the_event_loop(app, container, make_pdf, upload):
+    session_id = upload([make_pdf("leaflet.pdf", LEAFLET)])['session_id']
+
+    [response] = call(('POST', '/api/query', {'json': {'question': "Aspirin dosage?", 'mode': 'upload', 'session_id': session_id}}))
+
+    result = response.json()
+    assert response.status_code == 200 and result['status'] == 'success'
+    assert result['response'] and result['context']['chunks'] >= 1
+    assert [message['role'] for message in result['chat_history']] == ['user', 'assistant']
+
+
+def test_other_routes_reach_flask_each_on_its_own_thread(app, monkeypatch):
+    assert isinstance(asgi.flask_application, asgi.ThreadedWsgiToAsgi)
+    # Both requests must be inside Flask at once to get past the barrier: one shared thread would deadlock
+    barrier = threading.Barrier(2, timeout=5)
+    get_startup_stats = app.get_startup_stats
+
+    def meet_then_get_startup_stats():
+        barrier.wait()
+        return get_startup_stats()
+
+    monkeypatch.setattr(app, 'get_startup_stats', meet_then_get_startup_stats)
+    responses = call(('GET', '/api/ready', {}), ('GET', '/api/ready', {}))
+
+    assert [response.status_code for response in responses] == [200, 200]
+
+
+def test_bad_json_is_refused(app):
+    [response] = call(('POST', '/api/query', {'content': b"not json", 'headers': {'content-type': 'application/json'}}))
+    assert response.status_code == 400
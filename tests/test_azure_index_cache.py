@@ -0,0 +1,87 @@
+# tests/test_azure_index_cache.py
+import pytest
+
+
+def append(app, container, make_store, texts):
+    assert app.append_vector_store_segment(make_store(texts), container) is not None
+
+
+def stats_delta(app, before):
+    after = app.get_azure_index_cache_stats()
+    return {key: after[key] - before[key] for key in ('hits', 'misses', 'reloads', 'checks', 'errors')}
+
+
+@pytest.fixture
+def loads(app, monkeypatch):
+    calls = []
+    load = app.load_azure_vector_store
+
+    def counting_load(container_client):
+        calls.append(container_client)
+        return load(container_client)
+
+    monkeypatch.setattr(app, 'load_azure_vector_store', counting_load)
+    return calls
+
+
+def test_an_unchanged_etag_reuses_the_loaded_store(app, container, make_store, loads):
+    append(app, container, make_store, ["aspirin dosage"])
+    before = app.get_azure_index_cache_stats()
+
+    first = app.get_azure_vector_store(container)
+    second = app.get_azure_vector_store(container)
+
+    assert second is first and len(loads) == 1
+    # Each call still checks the ETag (AZURE_INDEX_CHECK_INTERVAL is 0); only the first one loads
+    assert stats_delta(app, before) == {'hits': 1, 'misses': 1, 'reloads': 0, 'checks': 2, 'errors': 0}
+    assert app.get_azure_index_cache_stats()['etag'] == app.get_azure_index_version(container)
+
+
+def test_a_fresh_check_skips_the_head_request(app, container, make_store, monkeypatch):
+    append(app, container, make_store, ["aspirin dosage"])
+    monkeypatch.setattr(app, 'AZURE_INDEX_CHECK_INTERVAL', 60)
+    vector_store = app.get_azure_vector_store(container)
+
+    def no_head(container_client):
+        raise AssertionError("the ETag was checked within the interval")
+
+    monkeypatch.setattr(app, 'get_azure_index_version', no_head)
+    assert app.get_azure_vector_store(container) is vector_store
+
+
+def test_a_changed_manifest_is_reloaded(app, container, make_store, loads):
+    append(app, container, make_store, ["aspirin dosage"])
+    first = app.get_azure_vector_store(container)
+    etag = app.get_azure_index_cache_stats()['etag']
+    before = app.get_azure_index_cache_stats()
+
+    append(app, container, make_store, ["warfarin monitoring"])
+    second = app.get_azure_vector_store(container)
+
+    assert second is not first and len(loads) == 2
+    assert (first.ntotal, second.ntotal) == (1, 2)
+    assert stats_delta(app, before) == {'hits': 0, 'misses': 1, 'reloads': 1, 'checks': 1, 'errors': 0}
+    stats = app.get_azure_index_cache_stats()
+    assert stats['etag'] != etag and stats['segments'] == 2
+
+
+def test_a_failed_head_request_serves_the_last_cached_store(app, container, make_store, monkeypatch):
+    append(app, container, make_store, ["aspirin dosage"])
+    vector_store = app.get_azure_vector_store(container)
+    before = app.get_azure_index_cache_stats()
+
+    def unavailable(container_client):
+        raise ConnectionError("storage account unreachable")
+
+    monkeypatch.setattr(app, 'get_azure_index_version', unavailable)
+
+    assert app.get_azure_vector_store(container) is vector_store
+    assert stats_delta(app, before) == {'hits': 0, 'misses': 0, 'reloads': 0, 'checks': 0, 'errors': 1}
+
+
+def test_a_failed_head_request_before_any_load_returns_none(app, container, monkeypatch):
+    def unavailable(container_client):
+        raise ConnectionError("storage account unreachable")
+
+    monkeypatch.setattr(app, 'get_azure_index_version', unavailable)
+    assert app.get_azure_vector_store(container) is None
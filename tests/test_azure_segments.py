@@ -0,0 +1,86 @@
+# tests/test_azure_segments.py
+import threading
+
+
+def append(app, container, make_store, texts):
+    segment = app.append_vector_store_segment(make_store(texts), container)
+    assert segment is not None
+    return segment
+
+
+def test_segments_are_appended_and_searched_together(app, container, make_store):
+    first = append(app, container, make_store, ["aspirin dosage", "aspirin interactions"])
+    second = append(app, container, make_store, ["warfarin monitoring"])
+
+    manifest, etag = app.read_manifest(container)
+    assert [segment['id'] for segment in manifest['segments']] == [first['id'], second['id']]
+    assert manifest['version'] == 2 and etag
+
+    vector_store = app.get_azure_vector_store(container)
+    assert vector_store.ntotal == 3
+    found = vector_store.search_dense(app.get_embeddings().embed_query("warfarin monitoring"), 1)
+    assert vector_store.get_document(*found[0][:2]).page_content == "warfarin monitoring"
+
+
+def test_manifest_update_retries_when_the_etag_changed(app, container):
+    app.update_manifest(container, lambda manifest: manifest['segments'].append({'id': 'a'}))
+    attempts = []
+
+    def change(manifest):
+        attempts.append(manifest['version'])
+        if len(attempts) == 1:
+            # Another writer commits between this read and the conditional write
+            app.update_manifest(container, lambda other: other['segments'].append({'id': 'b'}))
+        manifest['segments'].append({'id': 'c'})
+
+    manifest, _ = app.update_manifest(container, change)
+
+    assert attempts == [1, 2]
+    assert [segment['id'] for segment in manifest['segments']] == ['a', 'b', 'c']
+    assert app.read_manifest(container)[0]['version'] == 3
+
+
+def test_abandoned_update_writes_nothing(app, container):
+    app.update_manifest(container, lambda manifest: manifest['segments'].append({'id': 'a'}))
+    assert app.update_manifest(container, lambda manifest: False) == (None, None)
+    assert app.read_manifest(container)[0]['version'] == 1
+
+
+def test_compaction_merges_small_segments_and_retires_them(app, container, make_store):
+    segments = [append(app, container, make_store, [f"leaflet {i} chunk {j}" for j in range(3)]) for i in range(3)]
+
+    compacted = app.compact_vector_store(container)
+
+    manifest, _ = app.read_manifest(container)
+    assert [segment['id'] for segment in manifest['segments']] == [compacted['id']]
+    assert compacted['chunks'] == 9
+    assert sorted(entry['path'] for entry in manifest['retired']) == sorted(segment['path'] for segment in segments)
+    texts = {doc.page_content for doc in app.get_store_documents(app.load_segment(container, compacted))}
+    assert texts == {f"leaflet {i} chunk {j}" for i in range(3) for j in range(3)}
+
+
+def test_only_one_compaction_is_scheduled_at_a_time(app, container, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def slow_compaction(container_client):
+        runs.append(container_client)
+        started.set()
+        release.wait(10)
+
+    monkeypatch.setattr(app, 'compact_vector_store', slow_compaction)
+    manifest = {'segments': [{'id': str(i), 'chunks': 1} for i in range(app.COMPACTION_MIN_SEGMENTS)]}
+    callers = [threading.Thread(target=app.schedule_compaction, args=(container, manifest)) for _ in range(16)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert started.wait(10)
+    assert len(runs) == 1
+
+    release.set()
+    app.compaction_executor.submit(lambda: None).result()
+    # The lock is released once the compaction has finished, so the next append can schedule one again
+    app.schedule_compaction(container, manifest)
+    app.compaction_executor.submit(lambda: None).result()
+    assert len(runs) == 2
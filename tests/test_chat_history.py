@@ -0,0 +1,96 @@
+# tests/test_chat_history.py
+import json
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def own_db(app, tmp_path, monkeypatch):
+    # A chat history database of its own, with the legacy chat_history/ folder under tmp_path
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("chat_history")
+    monkeypatch.setattr(app, 'CHAT_HISTORY_DB_PATH', str(tmp_path / "chat_history.db"))
+    monkeypatch.setattr(app.chat_history_local, 'conn', None)
+    return tmp_path
+
+
+def write_legacy_file(name, history):
+    with open(os.path.join("chat_history", name), "w", encoding="utf-8") as f:
+        f.write(history if isinstance(history, str) else json.dumps(history))
+
+
+def test_pages_follow_the_cursor_newest_first(app):
+    session_id = uuid.uuid4().hex
+    for i in range(5):
+        app.save_chat_history(f"question {i}", f"answer {i}", 'session', session_id)
+
+    pages, cursor = [], None
+    while True:
+        messages, cursor = app.read_chat_history('session', session_id, cursor, limit=2)
+        pages.append([message['content'] for message in messages if message['role'] == 'user'])
+        if cursor is None:
+            break
+
+    assert pages == [["question 4", "question 3"], ["question 2", "question 1"], ["question 0"]]
+
+
+def test_history_is_kept_per_session_and_mode(app):
+    session_id, other_id = uuid.uuid4().hex, uuid.uuid4().hex
+    app.save_chat_history("mine", "yes", 'session', session_id)
+    app.save_chat_history("theirs", "no", 'session', other_id)
+    app.save_chat_history("azure one", "maybe", 'azure', session_id)
+
+    assert [m['content'] for m in app.read_chat_history('session', session_id)[0]] == ["mine", "yes"]
+    app.clear_chat_history('session', session_id)
+    assert app.read_chat_history('session', session_id)[0] == []
+    assert len(app.read_chat_history('azure', session_id)[0]) == 2
+    assert len(app.read_chat_history('session', other_id)[0]) == 2
+
+
+def test_chat_history_endpoint_returns_next_cursor(app):
+    session_id = uuid.uuid4().hex
+    for i in range(3):
+        app.save_chat_history(f"question {i}", f"answer {i}", 'session', session_id)
+    client = app.app.test_client()
+
+    first = client.get('/api/chat-history', query_string={'mode': 'session', 'session_id': session_id, 'limit': 2}).get_json()
+    rest = client.get('/api/chat-history', query_string={
+        'mode': 'session', 'session_id': session_id, 'limit': 2, 'cursor': first['next_cursor']
+    }).get_json()
+
+    assert len(first['chat_history']) == 4 and first['next_cursor'] is not None
+    assert [m['content'] for m in rest['chat_history']] == ["question 0", "answer 0"]
+    assert rest['next_cursor'] is None
+
+
+def test_legacy_files_are_imported_once(app, own_db):
+    write_legacy_file("01-02-2024_azure.json", [
+        {"role": "user", "content": "old question", "timestamp": "10:00:00"},
+        {"role": "assistant", "content": "old answer", "timestamp": "10:00:05"},
+    ])
+
+    app.init_chat_history_db()
+    app.init_chat_history_db()
+
+    rows = app.get_chat_history_db().execute("SELECT mode, day, question, response FROM turns").fetchall()
+    assert rows == [('azure', '01-02-2024', "old question", "old answer")]
+    assert os.listdir("chat_history") == ["01-02-2024_azure.json.imported"]
+
+
+def test_a_broken_legacy_file_does_not_stop_startup(app, own_db):
+    write_legacy_file("01-02-2024_azure.json", "{not json")
+    write_legacy_file("02-02-2024_azure.json", [{"role": "user", "content": "no timestamp"}, {"role": "assistant", "content": "x"}])
+    write_legacy_file("03-02-2024_upload.json", [
+        {"role": "user", "content": "fine", "timestamp": "09:00:00"},
+        {"role": "assistant", "content": "ok", "timestamp": "09:00:01"},
+    ])
+
+    app.init_chat_history_db()
+
+    # The broken files stay where they were, to be retried; the good one is imported
+    assert sorted(os.listdir("chat_history")) == [
+        "01-02-2024_azure.json", "02-02-2024_azure.json", "03-02-2024_upload.json.imported"
+    ]
+    assert app.get_chat_history_db().execute("SELECT question FROM turns").fetchall() == [("fine",)]
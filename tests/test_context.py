@@ -0,0 +1,65 @@
+# tests/test_context.py
+from langchain_core.documents import Document
+
+
+def chunk(text, chunk_no, page=1, sha256="doc-a"):
+    return Document(page_content=text, metadata={'sha256': sha256, 'source': f"{sha256}.pdf", 'page': page, 'chunk': chunk_no})
+
+
+def test_adjacent_chunks_are_joined_without_their_overlap(app):
+    merged = app.merge_adjacent_chunks([
+        chunk("Take 300 mg every four hours", 4),
+        chunk("four hours, at most 4 g a day.", 5),
+    ])
+
+    assert [doc.page_content for doc in merged] == ["Take 300 mg every four hours, at most 4 g a day."]
+    assert merged[0].metadata['chunks'] == [4, 5]
+
+
+def test_chunks_without_an_overlap_are_joined_with_a_space(app):
+    assert app.join_overlapping("First part.", "Second part.") == "First part. Second part."
+
+
+def test_runs_keep_the_rank_of_their_best_chunk(app):
+    merged = app.merge_adjacent_chunks([
+        chunk("page two, chunk 8", 8, page=2),
+        chunk("other document", 1, sha256="doc-b"),
+        chunk("page two, chunk 7", 7, page=2),
+        chunk("page two, chunk 10", 10, page=2),
+        Document(page_content="no position", metadata={'source': "old.pdf"}),
+        chunk("page three, chunk 9", 9, page=3),
+    ])
+
+    assert [doc.page_content for doc in merged] == [
+        "page two, chunk 7 page two, chunk 8",
+        "other document",
+        "page two, chunk 10",
+        "no position",
+        "page three, chunk 9",
+    ]
+
+
+def test_duplicates_and_contained_chunks_are_removed(app):
+    docs, context = app.build_context("dose?", [
+        Document(page_content="Aspirin 300 mg   every four hours.", metadata={}),
+        Document(page_content="Aspirin 300 mg every four hours.", metadata={}),
+        Document(page_content="300 mg", metadata={}),
+        Document(page_content="Metformin 500 mg.", metadata={}),
+    ], k=4)
+
+    assert [doc.page_content for doc in docs] == ["Aspirin 300 mg   every four hours.", "Metformin 500 mg."]
+    assert context['duplicates_removed'] == 2
+
+
+def test_the_token_budget_drops_the_worst_and_truncates_an_oversized_best(app):
+    chars = app.CONTEXT_CHARS_PER_TOKEN
+    small = Document(page_content="x" * int(10 * chars), metadata={})
+    medium = Document(page_content="y" * int(15 * chars), metadata={})
+
+    docs, context = app.build_context("q", [small, medium], k=2, token_budget=20)
+    assert docs == [small]
+    assert (context['dropped'], context['context_tokens'], context['token_budget']) == (1, 10, 20)
+
+    docs, context = app.build_context("q", [medium], k=1, token_budget=5)
+    assert len(docs) == 1 and app.estimate_tokens(docs[0].page_content) <= 5
+    assert context['truncated'] == 1
@@ -0,0 +1,82 @@
+# tests/test_document_registry.py
+import os
+import pickle
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."], ["Do not exceed 4 g in one day."]]
+
+
+def segment_ids(app, container):
+    return [segment['id'] for segment in app.read_manifest(container)[0]['segments']]
+
+
+def test_registration_is_create_only(app, container):
+    entry = {'sha256': "ab" * 32, 'filename': "a.pdf", 'chunks': 2}
+    assert app.register_document(container, entry) is True
+    assert app.register_document(container, dict(entry, filename="renamed.pdf")) is False
+    assert app.get_registered_document(container, "ab" * 32)['filename'] == "a.pdf"
+    assert app.get_registered_document(container, "cd" * 32) is None
+
+
+def test_processed_files_include_the_legacy_list_once(app, container):
+    app.register_document(container, {'sha256': "ab" * 32, 'filename': "a.pdf"})
+    container.get_blob_client(app.PROCESSED_FILES_LIST_PATH).upload_blob(pickle.dumps(["a.pdf", "old.pdf"]))
+    assert sorted(app.get_processed_files(container)) == ["a.pdf", "old.pdf"]
+
+
+def test_same_content_is_indexed_once_whatever_its_name(app, container, make_pdf, upload):
+    path = make_pdf("leaflet.pdf", LEAFLET)
+    assert upload([path], save_to_azure=True)['status'] == 'success'
+    first_segments = segment_ids(app, container)
+
+    result = upload([path], save_to_azure=True, filenames=["copy-of-leaflet.pdf"])
+
+    assert result['status'] == 'success'
+    assert segment_ids(app, container) == first_segments
+    job = app.get_ingest_job(result['job_id'])
+    assert job['skipped_files'] == [{'filename': "copy-of-leaflet.pdf", 'reason': 'already_indexed'}]
+    registered = app.get_registered_document(container, app.hash_file(path))
+    assert registered['filename'] == "leaflet.pdf" and registered['segment_id'] == first_segments[0]
+
+
+def post_legacy_upload(app, paths):
+    data = {'save_to_azure': 'true', 'pdfs': [(open(path, 'rb'), os.path.basename(path)) for path in paths]}
+    try:
+        return app.app.test_client().post('/upload', data=data, content_type='multipart/form-data').get_json()
+    finally:
+        for f, _ in data['pdfs']:
+            f.close()
+
+
+def test_legacy_upload_route_skips_registered_documents(app, container, make_pdf):
+    first = make_pdf("first.pdf", LEAFLET)
+    second = make_pdf("second.pdf", [["Warfarin needs INR monitoring every week."]])
+    assert post_legacy_upload(app, [first])['status'] == 'success'
+    assert len(segment_ids(app, container)) == 1
+
+    assert post_legacy_upload(app, [first, second])['status'] == 'success'
+    manifest = app.read_manifest(container)[0]
+    # Only the new document's chunk went into the second segment
+    assert [segment['chunks'] for segment in manifest['segments']] == [2, 1]
+
+    assert post_legacy_upload(app, [first, second])['status'] == 'success'
+    assert len(segment_ids(app, container)) == 2
+
+
+def test_legacy_upload_registers_nothing_when_the_segment_is_not_saved(app, container, make_pdf, monkeypatch):
+    path = make_pdf("leaflet.pdf", LEAFLET)
+    update_manifest = app.update_manifest
+
+    def failing_update_manifest(*args, **kwargs):
+        raise ConnectionError("Azure is down")
+
+    monkeypatch.setattr(app, 'update_manifest', failing_update_manifest)
+    assert post_legacy_upload(app, [path])['status'] == 'error'
+    assert app.get_registered_document(container, app.hash_file(path)) is None
+    assert container.get_blob_client("pdfs/leaflet.pdf").exists() is False
+
+    # Once Azure is back, the retry indexes the document
+    monkeypatch.setattr(app, 'update_manifest', update_manifest)
+    assert post_legacy_upload(app, [path])['status'] == 'success'
+    segment_ids_after = segment_ids(app, container)
+    assert len(segment_ids_after) == 1
+    assert app.get_registered_document(container, app.hash_file(path))['segment_id'] == segment_ids_after[0]
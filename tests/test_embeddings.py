@@ -0,0 +1,79 @@
+# tests/test_embeddings.py
+import asyncio
+
+import pytest
+
+
+class TaskTypeEmbeddings:
+    # Stands in for the Google model: the vector says which method and task type produced it
+    def __init__(self, failures=0):
+        self.calls = []
+        self.failures = failures
+
+    def _call(self, name, texts, task_type):
+        self.calls.append(name)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("quota exceeded")
+        return [[float(len(text)), 1.0 if task_type == "RETRIEVAL_QUERY" else 0.0] for text in texts]
+
+    def embed_documents(self, texts, task_type=None):
+        return self._call('embed_documents', texts, task_type)
+
+    def embed_query(self, text):
+        return self._call('embed_query', [text], "RETRIEVAL_QUERY")[0]
+
+    async def aembed_query(self, text):
+        return self._call('aembed_query', [text], "RETRIEVAL_QUERY")[0]
+
+
+@pytest.fixture
+def make_embeddings(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+
+    def make(base, cache_dir=str(tmp_path / "cache")):
+        return app.CachedBatchEmbeddings(base, "task-types", cache_dir=cache_dir, concurrency=1, max_qps=0, max_retries=2)
+    return make
+
+
+def test_questions_and_chunks_use_their_own_task_type(make_embeddings):
+    base = TaskTypeEmbeddings()
+    embeddings = make_embeddings(base)
+
+    assert embeddings.embed_query("aspirin") == [7.0, 1.0]
+    assert embeddings.embed_documents(["aspirin"]) == [[7.0, 0.0]]
+    assert base.calls == ['embed_query', 'embed_documents']
+
+
+def test_the_disk_cache_keeps_query_and_document_vectors_apart(make_embeddings):
+    make_embeddings(TaskTypeEmbeddings()).embed_documents(["aspirin"])
+    make_embeddings(TaskTypeEmbeddings()).embed_query("aspirin")
+
+    base = TaskTypeEmbeddings()
+    embeddings = make_embeddings(base)
+    assert embeddings.embed_documents(["aspirin"]) == [[7.0, 0.0]]
+    assert embeddings.embed_query("aspirin") == [7.0, 1.0]
+    assert asyncio.run(embeddings.aembed_query("aspirin")) == [7.0, 1.0]
+    assert base.calls == []
+    assert embeddings.get_stats()['cache_hits'] == 3
+
+
+def test_async_queries_use_the_async_query_method(make_embeddings):
+    base = TaskTypeEmbeddings()
+    embeddings = make_embeddings(base, cache_dir='')
+
+    assert asyncio.run(embeddings.aembed_query("aspirin")) == embeddings.embed_query("aspirin")
+    assert base.calls == ['aembed_query', 'embed_query']
+
+
+def test_failed_calls_are_retried(make_embeddings):
+    base = TaskTypeEmbeddings(failures=2)
+    embeddings = make_embeddings(base, cache_dir='')
+
+    assert embeddings.embed_documents(["a", "bb"]) == [[1.0, 0.0], [2.0, 0.0]]
+    assert (embeddings.get_stats()['retries'], embeddings.get_stats()['api_calls']) == (2, 1)
+
+    base.failures = 3
+    with pytest.raises(RuntimeError):
+        embeddings.embed_query("ccc")
+    assert embeddings.get_stats()['failures'] == 1
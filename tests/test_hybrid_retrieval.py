@@ -0,0 +1,61 @@
+# tests/test_hybrid_retrieval.py
+import numpy as np
+
+CHUNKS = [
+    "Aspirin 300 mg every four hours for pain.",
+    "Co-amoxiclav 625 mg three times daily.",
+    "Metformin is reduced when eGFR falls below 45.",
+    "Type 2 diabetes is coded E11.9 when uncomplicated.",
+]
+
+
+def test_codes_and_drug_names_are_indexed_whole_and_by_part(app):
+    assert app.tokenize("Co-amoxiclav for E11.9") == ["co-amoxiclav", "co", "amoxiclav", "for", "e11.9", "e11", "9"]
+
+
+def test_reciprocal_rank_fusion_rewards_agreement(app):
+    fused = app.reciprocal_rank_fusion([["a", "b"], ["b", "c"]])
+
+    # b is found by both retrievers, so it beats a, first in only one; c, second in only one, comes last
+    assert fused == ["b", "a", "c"]
+    assert app.reciprocal_rank_fusion([["x", "y"]]) == ["x", "y"]
+
+
+def test_bm25_ranks_exact_terms_first_and_round_trips(app, tmp_path):
+    bm25 = app.BM25Index.build(CHUNKS)
+    idf = {term: 1.0 for term in app.tokenize("e11.9")}
+
+    top = sorted(bm25.top(idf, bm25.total_length / len(bm25), k=2), key=lambda result: -result[1])
+    assert [position for position, _ in top] == [3]
+
+    bm25.save(str(tmp_path / "bm25.npz"))
+    loaded = app.BM25Index.load(str(tmp_path / "bm25.npz"))
+    assert loaded.top(idf, loaded.total_length / len(loaded), k=2) == bm25.top(idf, bm25.total_length / len(bm25), k=2)
+    assert loaded.document_frequencies(["mg", "insulin"]) == {"mg": 2, "insulin": 0}
+
+
+def test_keyword_search_spans_segments(app, make_store):
+    segments = [make_store(CHUNKS[:2]), make_store(CHUNKS[2:])]
+    for segment in segments:
+        segment.bm25 = app.BM25Index.build(doc.page_content for doc in app.get_store_documents(segment))
+    store = app.SegmentedVectorStore(segments, app.get_embeddings())
+
+    assert [(n, p) for n, p, _ in store.search_keywords("egfr metformin", k=3)] == [(1, 0)]
+    assert [(n, p) for n, p, _ in store.search_keywords("co-amoxiclav", k=3)] == [(0, 1)]
+    assert store.search_keywords("insulin", k=3) == []
+
+
+def test_hybrid_search_keeps_the_keyword_match(app, make_store, monkeypatch):
+    segment = make_store(CHUNKS)
+    segment.bm25 = app.BM25Index.build(CHUNKS)
+    store = app.SegmentedVectorStore([segment], app.get_embeddings())
+    query = "E11.9"
+    embedding = app.get_embeddings().embed_query(query)
+
+    monkeypatch.setattr(app, 'RETRIEVAL_MODE', 'hybrid')
+    hybrid = [doc.page_content for doc in store.search(query, embedding, k=2)]
+    monkeypatch.setattr(app, 'RETRIEVAL_MODE', 'dense')
+    dense = [doc.page_content for doc in store.search(query, embedding, k=len(CHUNKS))]
+
+    assert CHUNKS[3] in hybrid
+    assert len(hybrid) == 2 and np.isin(hybrid, dense).all()
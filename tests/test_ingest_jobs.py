@@ -0,0 +1,72 @@
+# tests/test_ingest_jobs.py
+import threading
+import time
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."], ["Do not exceed 4 g in one day."]]
+
+
+def poll(client, job_id, until=('succeeded', 'failed'), timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()['job']
+        if job['status'] in until:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {until}")
+
+
+def post_upload(client, path, filename):
+    with open(path, 'rb') as f:
+        return client.post('/api/upload', data={'pdfs': [(f, filename)]}, content_type='multipart/form-data').get_json()
+
+
+def test_a_job_runs_every_stage_and_reports_progress(app, container, make_pdf, monkeypatch):
+    client = app.app.test_client()
+    release = threading.Event()
+    get_pdf_page_count = app.get_pdf_page_count
+
+    def held_page_count(path):
+        release.wait(10)
+        return get_pdf_page_count(path)
+
+    monkeypatch.setattr(app, 'get_pdf_page_count', held_page_count)
+    queued = post_upload(client, make_pdf("leaflet.pdf", LEAFLET), "leaflet.pdf")
+    assert queued['status'] == 'success' and queued['message'] == "Queued 1 files for processing"
+
+    running = poll(client, queued['job_id'], until=('running',))
+    assert running['files'] == ["leaflet.pdf"] and running['finished_at'] is None
+    release.set()
+    job = poll(client, queued['job_id'])
+
+    assert job['status'] == 'succeeded' and job['error'] is None
+    assert job['stages']['azure']['status'] == 'skipped'
+    for name in ('extract', 'chunk', 'embed', 'save'):
+        assert (job['stages'][name]['status'], job['stages'][name]['progress']) == ('done', 1.0)
+    assert (job['stages']['extract']['items'], job['stages']['chunk']['items'], job['stages']['embed']['items']) == (2, 2, 2)
+    assert job['elapsed_seconds'] > 0
+    assert app.get_session_store().get(queued['session_id'])['processed_files'] == ["leaflet.pdf"]
+
+
+def test_a_failed_job_reports_its_error_and_stage(app, container, tmp_path):
+    client = app.app.test_client()
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"this is not a PDF")
+
+    job = poll(client, post_upload(client, str(path), "broken.pdf")['job_id'])
+
+    assert job['status'] == 'failed' and job['error']
+    assert job['stages']['save']['status'] == 'pending'
+    assert app.get_session_store().get(job['session_id'])['pdf_processed'] is False
+
+
+def test_finished_jobs_are_pruned_after_the_retention_period(app, container, make_pdf, monkeypatch):
+    client = app.app.test_client()
+    path = make_pdf("leaflet.pdf", LEAFLET)
+    first = post_upload(client, path, "leaflet.pdf")['job_id']
+    poll(client, first)
+
+    monkeypatch.setattr(app, 'JOB_RETENTION_SECONDS', 0)
+    second = post_upload(client, path, "leaflet.pdf")['job_id']
+
+    assert client.get(f'/api/jobs/{first}').get_json() == {'status': 'error', 'message': 'Job not found'}
+    assert poll(client, second)['status'] == 'succeeded'
@@ -0,0 +1,71 @@
+# tests/test_ingestion_pipeline.py
+import pytest
+
+# 30 lines of ~60 characters: more than one CHUNK_SIZE of text on a page
+LONG_PAGE = [f"Line {i:02d}: aspirin 300 mg every four hours, at most 4 g a day." for i in range(30)]
+
+
+@pytest.fixture
+def documents(app, make_pdf):
+    return {
+        "a" * 64: app.new_ingest_document("long.pdf", make_pdf("long.pdf", [LONG_PAGE, ["Page two of long."]])),
+        "b" * 64: app.new_ingest_document("short.pdf", make_pdf("short.pdf", [["Metformin 500 mg."]] * 3)),
+    }
+
+
+def test_batches_cover_every_item_in_order(app):
+    assert list(app.iter_batches(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(app.iter_batches([], 3)) == []
+
+
+def test_chunks_carry_their_provenance(app, documents):
+    chunks = list(app.iter_document_chunks(documents))
+
+    long_chunks = [doc for doc in chunks if doc.metadata['sha256'] == "a" * 64]
+    assert [doc.metadata['page'] for doc in long_chunks][-1] == 2
+    assert len([doc for doc in long_chunks if doc.metadata['page'] == 1]) > 1
+    assert [doc.metadata['chunk'] for doc in long_chunks] == list(range(len(long_chunks)))
+    assert [doc.id for doc in long_chunks] == [f"{'a' * 16}-{n}" for n in range(len(long_chunks))]
+    # start_index is within the page, and every chunk comes from a single page
+    assert long_chunks[0].metadata['start_index'] == 0
+    assert all("Page two" not in doc.page_content for doc in long_chunks if doc.metadata['page'] == 1)
+
+    short_chunks = [doc for doc in chunks if doc.metadata['sha256'] == "b" * 64]
+    assert [(doc.metadata['source'], doc.metadata['page'], doc.metadata['chunk']) for doc in short_chunks] == [
+        ("short.pdf", 1, 0), ("short.pdf", 2, 1), ("short.pdf", 3, 2)
+    ]
+    assert (documents["a" * 64]['pages'], documents["b" * 64]['pages']) == (2, 3)
+    assert documents["a" * 64]['chunks'] == len(long_chunks)
+
+
+def test_parallel_extraction_yields_the_same_chunks(app, documents, monkeypatch):
+    serial = [(doc.id, doc.page_content) for doc in app.iter_document_chunks(documents)]
+    for document in documents.values():
+        document.update(pages=0, chunks=0)
+
+    monkeypatch.setattr(app, 'PDF_EXTRACT_WORKERS', 2)
+    monkeypatch.setattr(app, 'PDF_PARALLEL_MIN_PAGES', 1)
+    monkeypatch.setattr(app, 'PDF_PAGES_PER_TASK', 1)
+    monkeypatch.setattr(app, 'pdf_process_pool', None)
+    try:
+        parallel = [(doc.id, doc.page_content) for doc in app.iter_document_chunks(documents)]
+        assert app.pdf_process_pool is not None
+    finally:
+        if app.pdf_process_pool is not None:
+            app.pdf_process_pool.shutdown()
+
+    assert parallel == serial
+
+
+def test_chunks_are_indexed_batch_by_batch(app, documents):
+    batches = []
+
+    vector_store = app.index_document_chunks(app.iter_document_chunks(documents), batch_size=2,
+                                             on_batch=lambda docs, vectors: batches.append((len(docs), len(vectors))))
+
+    total = sum(document['chunks'] for document in documents.values())
+    assert vector_store.index.ntotal == total
+    assert [size for size, _ in batches[:-1]] == [2] * (len(batches) - 1)
+    assert all(size == vectors for size, vectors in batches)
+    assert vector_store.docstore.search(f"{'b' * 16}-0").metadata['page'] == 1
+    assert app.index_document_chunks(iter([])) is None
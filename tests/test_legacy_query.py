@@ -0,0 +1,54 @@
+# tests/test_legacy_query.py
+import json
+import os
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."],
+           ["Ibuprofen should be taken with food."]]
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def post_upload(client, paths):
+    data = {'pdfs': [(open(path, 'rb'), os.path.basename(path)) for path in paths]}
+    try:
+        return client.post('/upload', data=data, content_type='multipart/form-data').get_json()
+    finally:
+        for f, _ in data['pdfs']:
+            f.close()
+
+
+def test_upload_page_answers_stream_from_the_chain(app, container, make_pdf):
+    client = app.app.test_client()
+    assert post_upload(client, [make_pdf("leaflet.pdf", LEAFLET)])['status'] == 'success'
+
+    response = client.post('/query', data={'question': "What is the aspirin dosage?", 'mode': 'upload', 'stream': 'true'})
+    assert response.mimetype == 'text/event-stream'
+    events = parse_sse(response.get_data(as_text=True))
+
+    names = [name for name, _ in events]
+    assert names[0] == 'sources' and names[-1] == 'done'
+    assert any("Aspirin" in source['content'] for source in events[0][1]['sources'])
+    tokens = [data['token'] for name, data in events if name == 'token']
+    # The fake LLM streams its answer in several tokens; none of it arrives as one block
+    assert len(tokens) > 1
+    assert events[-1][1]['status'] == 'success'
+
+
+def test_upload_page_answers_without_streaming(app, container, make_pdf):
+    client = app.app.test_client()
+    post_upload(client, [make_pdf("leaflet.pdf", LEAFLET)])
+
+    body = client.post('/query', data={'question': "What is the aspirin dosage?", 'mode': 'upload'}).get_json()
+    assert body['status'] == 'success'
+    assert body['response'] and body['response'] != "Please upload and process PDF files first."
+
+
+def test_query_before_upload_reports_it(app, container):
+    body = app.app.test_client().post('/query', data={'question': "Anything?", 'mode': 'upload'}).get_json()
+    assert body['response'] == "Please upload and process PDF files first."
@@ -0,0 +1,60 @@
+# tests/test_metrics.py
+import pytest
+
+REQUEST_LABELS = 'method="GET",route="/api/chat-history",status="200"'
+
+
+def scrape(client):
+    # {sample name with labels: value}
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def sorted_labels(sample):
+    # Labels are written in the order they were passed; compare them sorted
+    name, _, labels = sample.partition("{")
+    return name + "{" + ",".join(sorted(labels.rstrip("}").split(","))) + "}"
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def test_requests_are_counted_and_timed_per_route(client):
+    before = {sorted_labels(name): value for name, value in scrape(client).items()}
+
+    client.get('/api/chat-history', query_string={'mode': 'azure'})
+    after = {sorted_labels(name): value for name, value in scrape(client).items()}
+
+    count = f'rag_request_seconds_count{{{REQUEST_LABELS}}}'
+    assert after[count] == before.get(count, 0) + 1
+    assert after[f'rag_request_seconds_sum{{{REQUEST_LABELS}}}'] > 0
+    buckets = {name: value for name, value in after.items()
+               if name.startswith("rag_request_seconds_bucket{") and 'route="/api/chat-history"' in name}
+    assert buckets[sorted_labels(f'rag_request_seconds_bucket{{{REQUEST_LABELS},le="+Inf"}}')] == after[count]
+    assert list(buckets.values()) == sorted(buckets.values())
+
+
+def test_every_metric_is_declared_with_its_type(app, client):
+    text = client.get('/metrics').get_data(as_text=True)
+
+    for name, (kind, _) in app.METRIC_TYPES.items():
+        assert f"# TYPE {name} {kind}\n" in text
+
+
+def test_stages_and_blob_bytes_are_recorded(app, container, client):
+    app.save_chat_history("aspirin?", "300 mg", 'azure')
+    container.get_blob_client("probe.bin").upload_blob(b"x" * 10)
+    app.download_from_blob(container, "probe.bin")
+
+    samples = scrape(client)
+
+    assert samples['rag_stage_seconds_count{stage="chat_history"}'] >= 1
+    assert samples['rag_blob_bytes_total{direction="download"}'] >= 10
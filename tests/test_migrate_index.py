@@ -0,0 +1,38 @@
+# tests/test_migrate_index.py
+import os
+import pickle
+import tempfile
+
+import migrate_index
+
+TEXTS = ["Aspirin 300 mg every four hours.", "Warfarin needs INR monitoring.", "Metformin 500 mg twice daily."]
+
+
+def upload_legacy_index(app, container, vector_store):
+    # The single pickled blob the app wrote before segments existed
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vector_store.save_local(temp_dir)
+        data = {}
+        for name in ("index.faiss", "index.pkl"):
+            with open(os.path.join(temp_dir, name), "rb") as f:
+                data[name] = f.read()
+    container.get_blob_client(app.VECTOR_STORE_PATH).upload_blob(pickle.dumps(data))
+
+
+def test_legacy_index_is_converted_to_a_segment_and_still_answers(app, container, make_store):
+    upload_legacy_index(app, container, make_store(TEXTS))
+    assert [segment['id'] for segment in app.read_manifest(container)[0]['segments']] == ['legacy']
+
+    assert migrate_index.migrate(container, dry_run=True) == 1
+    assert app.read_manifest(container)[1] is None
+    assert migrate_index.migrate(container) == 1
+
+    manifest, _ = app.read_manifest(container)
+    [segment] = manifest['segments']
+    assert segment['format'] == app.SEGMENT_FORMAT and segment['chunks'] == len(TEXTS)
+    assert manifest['retired'][0]['path'] == app.VECTOR_STORE_PATH
+    vector_store = app.get_azure_vector_store(container)
+    embedding = app.get_embeddings().embed_query(TEXTS[1])
+    assert [doc.page_content for doc in vector_store.search(TEXTS[1], embedding, k=1)] == [TEXTS[1]]
+
+    assert migrate_index.migrate(container) == 0
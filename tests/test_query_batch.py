@@ -0,0 +1,80 @@
+# tests/test_query_batch.py
+import json
+
+import pytest
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."], ["Metformin 500 mg twice daily with meals."]]
+
+
+class RecordingEmbeddings:
+    # Stands in for the Google model: records each call and gives each task type its own vectors
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts, task_type=None):
+        self.calls.append(('embed_documents', len(texts), task_type))
+        return [[float(len(text)), 1.0 if task_type == "RETRIEVAL_QUERY" else 0.0] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(('embed_query', 1, None))
+        return [float(len(text)), 1.0]
+
+
+@pytest.fixture
+def session_id(app, container, make_pdf, upload):
+    result = upload([make_pdf("leaflet.pdf", LEAFLET)])
+    assert result['status'] == 'success'
+    return result['session_id']
+
+
+def ask(app, questions, **data):
+    response = app.app.test_client().post('/api/query-batch', json=dict(data, questions=questions))
+    if response.mimetype != 'application/x-ndjson':
+        return response.get_json()
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_queries_are_embedded_in_one_call_like_embed_query(app):
+    base = RecordingEmbeddings()
+    embeddings = app.CachedBatchEmbeddings(base, "recording", cache_dir='', concurrency=1, max_qps=0)
+
+    vectors = embeddings.embed_queries(["aspirin?", "metformin dose?", "aspirin?"])
+
+    assert base.calls == [('embed_documents', 2, "RETRIEVAL_QUERY")]
+    assert vectors[0] == vectors[2] == base.embed_query("aspirin?")
+    assert embeddings.embed_query("metformin dose?") == vectors[1]
+
+
+def test_the_same_question_is_answered_once(app, session_id):
+    questions = ["What is the aspirin dosage?", "what is the aspirin dosage", "Metformin dose?"]
+    embed_calls_before = app.get_embeddings().get_stats()['api_calls']
+
+    lines = ask(app, questions, session_id=session_id)
+
+    answers, summary = lines[:-1], lines[-1]
+    assert sorted(line['index'] for line in answers) == [0, 1, 2]
+    assert all(line['question'] == questions[line['index']] for line in answers)
+    by_index = {line['index']: line for line in answers}
+    assert by_index[0]['response'] == by_index[1]['response']
+    assert (summary['status'], summary['questions'], summary['answered'], summary['errors']) == ('done', 3, 3, 0)
+    # Both distinct questions were embedded in a single call
+    assert app.get_embeddings().get_stats()['api_calls'] == embed_calls_before + 1
+
+
+def test_a_repeated_batch_is_served_from_the_answer_cache(app, session_id):
+    questions = ["What is the aspirin dosage?", "Metformin dose?"]
+    ask(app, questions, session_id=session_id)
+
+    summary = ask(app, questions, session_id=session_id)[-1]
+
+    assert (summary['cached'], summary['answered']) == (2, 0)
+
+
+@pytest.mark.parametrize("questions", [[], "aspirin?", ["aspirin?", "  "], [1]])
+def test_invalid_batches_are_refused(app, questions):
+    assert ask(app, questions)['status'] == 'error'
+
+
+def test_batches_above_the_limit_are_refused(app, monkeypatch):
+    monkeypatch.setattr(app, 'QUERY_BATCH_MAX_QUESTIONS', 2)
+    assert "At most 2" in ask(app, ["a?", "b?", "c?"])['message']
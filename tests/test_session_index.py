@@ -0,0 +1,73 @@
+# tests/test_session_index.py
+import os
+
+import numpy as np
+import pytest
+
+TEXTS = [f"Chunk {i}: drug {i} is given {i * 50} mg daily (β-blocker {i})." for i in range(40)]
+
+
+@pytest.fixture
+def float_store(app, make_store):
+    return make_store(TEXTS, metadatas=[{'source': "leaflet.pdf", 'page': i // 4 + 1, 'chunk': i} for i in range(len(TEXTS))])
+
+
+def test_offset_docstore_round_trips_rows(app, float_store, tmp_path):
+    docs = app.get_store_documents(float_store)
+    app.write_segment_files(str(tmp_path), float_store.index, docs)
+    offsets = np.fromfile(str(tmp_path / "docstore.offsets"), dtype="<u8")
+    data = (tmp_path / "docstore.jsonl").read_bytes()
+    docstore = app.OffsetDocstore(offsets, lambda start, length: data[start:start + length])
+
+    assert len(docstore) == len(docs) and offsets[-1] == len(data)
+    for position in (0, 17, len(docs) - 1):
+        row = docstore.search(position)
+        assert (row.id, row.page_content, row.metadata) == (docs[position].id, docs[position].page_content, docs[position].metadata)
+    assert docstore.search(len(docs)) == f"ID {len(docs)} not found."
+
+
+def test_segment_store_reads_rows_through_read_range(app, float_store, tmp_path):
+    app.write_segment_files(str(tmp_path), float_store.index, app.get_store_documents(float_store))
+    data = (tmp_path / "docstore.jsonl").read_bytes()
+    reads = []
+
+    def read_range(start, length):
+        reads.append(length)
+        return data[start:start + length]
+
+    store = app.open_segment_store(str(tmp_path), app.get_embeddings(), read_range)
+
+    assert store.similarity_search(TEXTS[5], k=1)[0].page_content == TEXTS[5]
+    assert len(reads) == 1 and len(store.bm25) == len(TEXTS)
+
+
+@pytest.mark.parametrize("mode, index_type", [('fp16', 'sq_fp16'), ('int8', 'sq8')])
+def test_compact_session_indexes_are_smaller_and_find_the_same_chunks(app, float_store, tmp_path, monkeypatch, mode, index_type):
+    float_dir, compact_dir = str(tmp_path / "float"), str(tmp_path / "compact")
+    app.save_session_vector_store(float_dir, float_store)
+    monkeypatch.setattr(app, 'SESSION_INDEX_MODE', mode)
+
+    compact = app.save_session_vector_store(compact_dir, float_store)
+
+    assert sorted(os.listdir(compact_dir)) == sorted(app.SEGMENT_FILES + (app.KEYWORD_INDEX_FILE,))
+    assert app.get_index_type(compact.index) == index_type
+    assert os.path.getsize(os.path.join(compact_dir, "index.faiss")) < os.path.getsize(os.path.join(float_dir, "index.faiss"))
+    for text in TEXTS[::7]:
+        assert compact.similarity_search(text, k=1)[0].page_content == text
+    # Read back by whichever format is on disk, whatever the mode is now
+    monkeypatch.setattr(app, 'SESSION_INDEX_MODE', 'faiss')
+    assert app.get_index_type(app.load_session_vector_store(compact_dir).index) == index_type
+    assert app.get_index_type(app.load_session_vector_store(float_dir).index) == 'flat'
+
+
+def test_saving_in_faiss_mode_replaces_a_compact_index(app, float_store, tmp_path, monkeypatch):
+    vector_store_dir = str(tmp_path / "index")
+    monkeypatch.setattr(app, 'SESSION_INDEX_MODE', 'int8')
+    app.save_session_vector_store(vector_store_dir, float_store)
+    monkeypatch.setattr(app, 'SESSION_INDEX_MODE', 'faiss')
+
+    app.save_session_vector_store(vector_store_dir, float_store)
+
+    assert not app.is_compact_index_dir(vector_store_dir)
+    assert sorted(os.listdir(vector_store_dir)) == sorted(["index.faiss", "index.pkl", app.KEYWORD_INDEX_FILE])
+    assert app.load_session_vector_store(vector_store_dir).similarity_search(TEXTS[3], k=1)[0].page_content == TEXTS[3]
@@ -0,0 +1,50 @@
+# tests/test_session_store_cache.py
+import os
+
+
+def save_store(app, make_store, directory, text):
+    return app.save_session_vector_store(str(directory), make_store([text, f"{text} again"]))
+
+
+def test_least_recently_used_store_is_evicted_first(app, make_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'SESSION_CACHE_MAX_ENTRIES', 2)
+    dirs = [tmp_path / name for name in "abc"]
+    for directory in dirs[:2]:
+        save_store(app, make_store, directory, directory.name)
+        app.get_session_vector_store(str(directory))
+
+    app.get_session_vector_store(str(dirs[0]))  # a is now the most recently used
+    save_store(app, make_store, dirs[2], "c")
+    app.get_session_vector_store(str(dirs[2]))
+
+    assert list(app.session_store_cache) == [str(dirs[0]), str(dirs[2])]
+    assert app.session_store_cache_stats['evictions'] >= 1
+
+
+def test_byte_budget_bounds_the_cache(app, make_store, tmp_path, monkeypatch):
+    for name in "ab":
+        save_store(app, make_store, tmp_path / name, name)
+    monkeypatch.setattr(app, 'SESSION_CACHE_MAX_BYTES', app.get_index_dir_size(str(tmp_path / "a")))
+
+    app.get_session_vector_store(str(tmp_path / "a"))
+    app.get_session_vector_store(str(tmp_path / "b"))
+
+    stats = app.get_session_cache_stats()
+    assert stats['entries'] == 1
+    assert stats['bytes'] <= stats['max_bytes']
+    assert list(app.session_store_cache) == [str(tmp_path / "b")]
+
+
+def test_hit_until_the_index_is_rewritten(app, make_store, tmp_path):
+    directory = str(tmp_path / "s")
+    save_store(app, make_store, directory, "first")
+    loaded = app.get_session_vector_store(directory)
+    assert app.get_session_vector_store(directory) is loaded
+
+    save_store(app, make_store, directory, "second")
+    index_path = os.path.join(directory, "index.faiss")
+    os.utime(index_path, (os.path.getatime(index_path), os.path.getmtime(index_path) + 10))
+    reloaded = app.get_session_vector_store(directory)
+
+    assert reloaded is not loaded
+    assert "second" in [doc.page_content for doc in app.get_store_documents(reloaded)]
@@ -0,0 +1,93 @@
+# tests/test_sessions.py
+import os
+import time
+
+import pytest
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."]]
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def store(app, request, tmp_path):
+    if request.param == 'memory':
+        return app.MemorySessionStore()
+    return app.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+
+@pytest.fixture
+def uploads(app, tmp_path, monkeypatch):
+    # An upload folder and session database of the test's own, so collections only see its sessions
+    upload_folder = tmp_path / "uploads"
+    upload_folder.mkdir()
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(upload_folder))
+    monkeypatch.setattr(app, 'SESSION_DB_PATH', str(tmp_path / "sessions.db"))
+    app.reset_resources()
+    yield upload_folder
+    app.reset_resources()
+
+
+def make_old(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_sessions_are_created_updated_and_expired(app, store):
+    store.create("s1")
+    store.create("s2")
+
+    assert store.get("s1") == app.new_session_record()
+    assert store.update("s1", pdf_processed=True, processed_files=["a.pdf"]) is True
+    assert store.get("s1")['processed_files'] == ["a.pdf"]
+    assert store.update("missing", pdf_processed=True) is False
+    assert store.get("missing") is None
+
+    assert store.delete_expired(time.time() - 60) == []
+    assert sorted(store.delete_expired(time.time() + 1)) == ["s1", "s2"]
+    assert store.count() == 0
+
+
+def test_sqlite_sessions_are_shared_between_store_instances(app, tmp_path):
+    first = app.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    second = app.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+    first.create("s1")
+    second.update("s1", vector_store_exists=True)
+
+    assert first.get("s1")['vector_store_exists'] is True
+
+
+def test_collection_removes_idle_sessions_and_orphaned_directories(app, uploads, monkeypatch):
+    monkeypatch.setattr(app, 'SESSION_TTL_SECONDS', 60)
+    store = app.get_session_store()
+    for session_id in ("idle", "active"):
+        store.create(session_id)
+        (uploads / session_id / "pdfs").mkdir(parents=True)
+        (uploads / session_id / "pdfs" / "a.pdf").write_bytes(b"%PDF" * 100)
+    store.connect().execute("UPDATE sessions SET last_seen_at = ? WHERE session_id = 'idle'", (time.time() - 120,))
+    (uploads / "orphan").mkdir()
+    make_old(uploads / "orphan", 120)
+    (uploads / "incoming" / "abandoned").mkdir(parents=True)
+    make_old(uploads / "incoming" / "abandoned", 120)
+
+    assert app.collect_sessions() == ["idle"]
+
+    assert sorted(os.listdir(uploads)) == ["active", "incoming"]
+    assert os.listdir(uploads / "incoming") == []
+    assert store.get("idle") is None and store.get("active") is not None
+    stats = app.get_session_gc_stats()
+    assert stats['orphans'] >= 1 and stats['bytes_freed'] >= 400
+
+
+def test_uploads_beyond_the_file_quota_are_refused(app, uploads, make_pdf, upload, monkeypatch):
+    monkeypatch.setattr(app, 'SESSION_MAX_FILES', 1)
+    first = make_pdf("first.pdf", LEAFLET)
+    second = make_pdf("second.pdf", [["Metformin 500 mg twice daily."]])
+
+    accepted = upload([first])
+    assert accepted['status'] == 'success'
+
+    # The same content again is not a new file, another one is
+    assert upload([first], session_id=accepted['session_id'])['status'] == 'success'
+    refused = upload([second], session_id=accepted['session_id'])
+    assert refused['status'] == 'error' and "quota" in refused['message']
+    assert len(os.listdir(uploads / accepted['session_id'] / "pdfs")) == 1
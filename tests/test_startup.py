@@ -0,0 +1,65 @@
+# tests/test_startup.py
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fresh_worker(app, monkeypatch):
+    # Startup state as a newly imported worker has it, before prewarm
+    monkeypatch.setattr(app, 'startup_stats', {
+        'status': 'starting', 'import_seconds': 0.5, 'prewarm_seconds': None, 'steps': {}, 'errors': [],
+        'time_to_first_query_seconds': None, 'first_query_seconds': None
+    })
+    return app.app.test_client()
+
+
+def wait_until_ready(client, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get('/api/ready')
+        if response.status_code == 200:
+            return response.get_json()
+        time.sleep(0.01)
+    raise AssertionError("worker did not become ready")
+
+
+def test_ready_is_503_until_prewarm_finishes(app, container, fresh_worker, monkeypatch):
+    release = threading.Event()
+    prewarm_clients = app.prewarm_clients
+
+    def slow_prewarm_clients():
+        release.wait(10)
+        prewarm_clients()
+
+    monkeypatch.setattr(app, 'prewarm_clients', slow_prewarm_clients)
+    assert fresh_worker.get('/api/ready').status_code == 503
+
+    app.start_prewarm()
+    response = fresh_worker.get('/api/ready')
+    assert response.status_code == 503 and response.get_json()['status'] == 'warming'
+
+    release.set()
+    stats = wait_until_ready(fresh_worker)
+    assert set(stats['steps']) == {'clients', 'azure_index', 'ingestion'}
+    assert stats['errors'] == [] and stats['prewarm_seconds'] > 0
+
+
+def test_a_failed_prewarm_step_still_ends_ready(app, container, fresh_worker, monkeypatch):
+    def failing_prewarm_ingestion():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(app, 'prewarm_ingestion', failing_prewarm_ingestion)
+    app.start_prewarm()
+
+    assert wait_until_ready(fresh_worker)['errors'] == ["ingestion: disk full"]
+
+
+def test_the_first_query_is_recorded_once(app, fresh_worker):
+    app.record_first_query('/api/azure-files', 5.0)
+    app.record_first_query('/api/query', 0.25)
+    app.record_first_query('/api/query-batch', 1.0)
+
+    stats = fresh_worker.get('/api/ready').get_json()
+    assert stats['first_query_seconds'] == 0.25
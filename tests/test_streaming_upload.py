@@ -0,0 +1,49 @@
+# tests/test_streaming_upload.py
+import hashlib
+import os
+from io import BytesIO
+
+LEAFLET = [["Aspirin dosage for adults is 300 mg every four hours."]]
+
+
+def test_parts_are_hashed_as_they_are_written(app, tmp_path):
+    upload = app.HashingUploadFile(str(tmp_path / "part"))
+    for block in (b"%PDF-1.4\n", b"x" * 70000, b"%%EOF\n"):
+        upload.write(block)
+    upload.close()
+
+    data = (tmp_path / "part").read_bytes()
+    assert upload.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert upload.size == len(data) == 70015
+
+
+def test_uploads_are_stored_by_the_hash_taken_while_streaming(app, container, make_pdf, monkeypatch):
+    path = make_pdf("leaflet.pdf", LEAFLET)
+    with open(path, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+
+    def no_rehashing(path):
+        raise AssertionError("the upload was read again to hash it")
+
+    monkeypatch.setattr(app, 'hash_file', no_rehashing)
+    with open(path, "rb") as f:
+        result = app.app.test_client().post('/api/upload', data={'wait': 'true', 'pdfs': [(f, "leaflet.pdf")]},
+                                            content_type='multipart/form-data').get_json()
+
+    assert result['status'] == 'success'
+    pdf_dir = os.path.join(app.app.config['UPLOAD_FOLDER'], result['session_id'], "pdfs")
+    assert os.listdir(pdf_dir) == [f"{content_hash}.pdf"]
+    assert app.get_ingest_job(result['job_id'])['uploads'][0]['sha256'] == content_hash
+
+
+def test_a_body_over_the_limit_is_refused_with_413(app, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 4096)
+    incoming_root = os.path.join(app.app.config['UPLOAD_FOLDER'], "incoming")
+    incoming_before = set(os.listdir(incoming_root)) if os.path.isdir(incoming_root) else set()
+
+    response = app.app.test_client().post('/api/upload', data={'pdfs': [(BytesIO(b"%PDF" * 5000), "big.pdf")]},
+                                          content_type='multipart/form-data')
+
+    assert response.status_code == 413
+    assert "quota" in response.get_json()['message']
+    assert set(os.listdir(incoming_root)) == incoming_before